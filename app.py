@@ -1,31 +1,71 @@
-import re
+import os
 import json
 from datetime import date
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, jsonify
-import numpy as np
+from functools import partial
 
-from src.AppScheduler import AppScheduler
+from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, jsonify, Response
+
+from src.AppSchedulerPool import SchedulerPool
+from src.AppScheduleGrid import ScheduleGrid, ScheduleStream
+from src.AppJobStore import JobStore
+from src.AppCredentialCache import CredentialCache
+from src.AppCaptchaCache import SolveCache
+from src.AppCaptchaHandler import TrackCalibration
+from src.AppSlotRanking import SlotPreferences
 
 app = Flask(__name__)
 app.secret_key = "dev-secret-change-me"
-scheduler = None
-fields = None
+# 设置环境变量COURT_BASE_URL（例如http://127.0.0.1:5001）后所有上游请求发往本地的模拟服务器
+BASE_URL = os.environ.get("COURT_BASE_URL") or None
+# 任务和订单的持久化存储，重启后恢复未完成的任务
+JOB_STORE = JobStore(os.environ.get("COURT_JOB_DB") or "data/jobs.db")
+# 登录凭证缓存，重启后直接恢复会话而不需要重新登录
+CREDENTIALS = CredentialCache(os.environ.get("COURT_CREDENTIALS") or "data/credentials.json")
+# 验证码求解执行器：COURT_SOLVER_WORKERS为同时求解的数量，COURT_SOLVER_KIND为thread或process，
+# COURT_SOLVER_MODE为求解模式（见CaptchaLoader.MODES），匹配置信度低于COURT_SOLVER_MIN_CONFIDENCE时重新获取验证码，
+# 被服务器接受过的求解结果缓存在COURT_CAPTCHA_DB（CaptchaDatabase）中，重复出现的验证码不需要再次求解，
+# 滑动距离的可选细调从同一个数据库读取（用python -m src.AppCaptchaCorpus calibrate拟合，没有时不做修正）
+CAPTCHA_DB = os.environ.get("COURT_CAPTCHA_DB") or "data/captchas.db"
+SOLVER_OPTIONS = {
+    "workers": int(os.environ.get("COURT_SOLVER_WORKERS") or 2),
+    "kind": os.environ.get("COURT_SOLVER_KIND") or "thread",
+    "mode": os.environ.get("COURT_SOLVER_MODE") or "ensemble",
+    "min_confidence": float(os.environ.get("COURT_SOLVER_MIN_CONFIDENCE") or 0.2),
+    "cache": SolveCache(CAPTCHA_DB),
+    "calibration": TrackCalibration.load(CAPTCHA_DB),
+}
+# 监听任务共享的场次轮询器：临近放票或场次变化时以COURT_POLL_MIN_INTERVAL秒轮询，之后逐渐退避到
+# COURT_POLL_MAX_INTERVAL秒，查询失败时也会退避
+POLLER_OPTIONS = {
+    "min_interval": float(os.environ.get("COURT_POLL_MIN_INTERVAL") or 10.0),
+    "max_interval": float(os.environ.get("COURT_POLL_MAX_INTERVAL") or 60.0),
+}
+# 所有已登录账号的调度器，场馆目录、场次缓存、轮询器和验证码求解器由所有账号共享
+# 用refresh_token换取id_token的接口尚未确认，设置COURT_USE_REFRESH_TOKEN=1后才使用，否则id_token过期时完整登录
+USE_REFRESH_TOKEN = os.environ.get("COURT_USE_REFRESH_TOKEN") == "1"
+POOL = SchedulerPool(base_url=BASE_URL, job_store=JOB_STORE, credential_cache=CREDENTIALS,
+                     solver_options=SOLVER_OPTIONS, poller_options=POLLER_OPTIONS,
+                     use_refresh_token=USE_REFRESH_TOKEN)
 
 
 def current_username():
     return session.get("username", "访客")
 
 
-@app.route("/home", methods=["GET"])
-def home():
-    q = (request.args.get("q") or "").strip().lower()
+def current_scheduler():
+    """当前浏览器会话对应账号的调度器，未登录时返回None"""
+    username = session.get("username")
+    return None if username is None else POOL.get(username)
 
-    def hit(v):
-        return (q in v["name"].lower()) or (q in (v.get("memo") or "").lower())
 
-    venues = [c.properties for c in scheduler.courts]
-    venues = [v for v in venues if not q or hit(v)]
+@app.route("/home", methods=["GET"])
+def home():
+    if current_scheduler() is None:
+        return redirect(url_for("login"))
+    q = (request.args.get("q") or "").strip()
+    # 场馆目录在第一个账号登录时获取，获取失败时显示空列表
+    venues = [] if POOL.courts is None else POOL.courts.search(q)
     return render_template(
         "home.html",
         active_page="home",
@@ -36,8 +76,9 @@ def home():
 
 
 def get_venue(venue_id:int):
-    venues = [c.properties for c in scheduler.courts]
-    return next((v for v in venues if v["id"] == str(venue_id)), None)
+    if POOL.courts is None:
+        return None
+    return POOL.courts.get_properties(venue_id)
 
 @app.get("/venue_detail/<int:venue_id>")
 def venue_detail(venue_id:int):
@@ -52,7 +93,6 @@ def venue_detail(venue_id:int):
 
 @app.get("/api/venues/<int:venue_id>/schedule")
 def api_venue_schedule(venue_id:int):
-    global fields
     v = get_venue(venue_id)
     if not v:
         return jsonify({"error":"venue not found"}), 404
@@ -64,43 +104,8 @@ def api_venue_schedule(venue_id:int):
     except Exception:
         return jsonify({"error":"invalid date"}), 400
 
-    fields = scheduler.crawler.get_fields(target, venue_id)
-
-    ts = np.unique([f.time_no for f in fields])
-    first_times = [int(t.split(":")[0]) for t in ts]
-    indexs = np.argsort(first_times)
-    times = [{"id": t, "label": t} for t in ts[indexs]]
-
-    cs = np.unique([f.sname for f in fields]).tolist()
-    cs_nums = [int(re.search(r"(\d+)", c).group(1)) for c in cs]
-    cs = sorted(cs, key=lambda c: cs_nums[cs.index(c)])
-    courts = [{"id": c, "name": c} for c in cs]
-
-    cells = {}
-    for c in courts:
-        for t in times:
-            key = f"{c['id']}|{t['id']}"
-            for f in fields:
-                if f.sname == c["name"] and f.time_no == t["label"]:
-                    status = f.status
-                    price = f.price
-                    stock_id = f.stockid
-                    field_id = f.id
-                    break
-            else:
-                status = -1
-                price = -1
-                stock_id = -1
-                field_id = -1
-            if status <= 0:
-                status = "closed"
-            elif status == 2:
-                status = "occupied"
-            else:
-                status = "available"
-            cells[key] = {"price": price, "status": status,
-                          "stock_id":  stock_id,
-                          "court_id": field_id}
+    fields = POOL.get_fields(target, venue_id)
+    courts, times, cells = ScheduleGrid.build(fields)
 
     return jsonify({
         "venue_id": venue_id,
@@ -111,6 +116,26 @@ def api_venue_schedule(venue_id:int):
     })
 
 
+@app.get("/api/venues/<int:venue_id>/schedule/stream")
+def api_venue_schedule_stream(venue_id:int):
+    v = get_venue(venue_id)
+    if not v:
+        return jsonify({"error":"venue not found"}), 404
+
+    qd = request.args.get("date")
+    try:
+        y,m,d = map(int, (qd or date.today().isoformat()).split("-"))
+        target = date(y,m,d)
+    except Exception:
+        return jsonify({"error":"invalid date"}), 400
+
+    # 与监听任务使用相同的(court_id, date)，共享同一个轮询器
+    court_id, date_str = str(venue_id), target.isoformat()
+    stream = ScheduleStream(POOL.pollers, court_id, date_str, partial(POOL.get_fields, date_str, court_id))
+    return Response(iter(stream), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # === 新增：全局监听模式
 @app.post("/api/venues/<int:venue_id>/listen")
 def api_venue_listen(venue_id:int):
@@ -133,7 +158,16 @@ def api_venue_listen(venue_id:int):
     if num < 1:
         return jsonify({"error":"num must be >= 1"}), 400
 
-    scheduler.monitor_court(str(venue_id), qdate, num)
+    # 可选的场次偏好，例如{"start": "18:00", "end": "21:00", "consecutive": 1, "price": 0.5}，见SlotPreferences
+    try:
+        preferences = SlotPreferences.from_dict(data.get("preferences"))
+    except ValueError as e:
+        return jsonify({"error": f"invalid preferences: {e}"}), 400
+
+    scheduler = current_scheduler()
+    if scheduler is None:
+        return jsonify({"error": "not logged in"}), 401
+    scheduler.monitor_court(str(venue_id), qdate, num, preferences=preferences)
     watch_id = f"W-{venue_id}-{qdate.replace('-','')}-{num}"
     return jsonify({"ok": True, "watch_id": watch_id})
 
@@ -152,61 +186,109 @@ def api_venue_book(venue_id:int):
     if not court_id or not stock_id:
         return jsonify({"error":"missing court_id or stock_id"}), 400
 
+    scheduler = current_scheduler()
+    if scheduler is None:
+        return jsonify({"error": "not logged in"}), 401
     scheduler.order_stock(qdate, str(venue_id), str(court_id), str(stock_id))
     order_id = f"O-{venue_id}-{qdate.replace('-','')}-{court_id}-{abs(hash(stock_id))%100000}"
     return jsonify({"ok": True, "order_id": order_id})
 
 
+@app.get("/api/metrics")
+def api_metrics():
+    scheduler = current_scheduler()
+    if scheduler is None:
+        return jsonify({"error": "not logged in"}), 401
+    crawler = scheduler.crawler
+    return jsonify({
+        "http": crawler.transport.stats(),
+        "captcha_pool": crawler.captcha_pool.stats,
+        **POOL.stats,
+    })
+
+
+def _task_view(entry):
+    """任务列表中的一项"""
+    v = get_venue(entry.court_id)
+    return {
+        **entry.properties,
+        "venue_name": v["name"] if v else entry.court_id,
+        "mode": "listen" if entry.kind == "monitor" else "book",
+    }
+
+
+@app.get("/api/tasks")
+def api_tasks():
+    scheduler = current_scheduler()
+    if scheduler is None:
+        return jsonify({"error": "not logged in"}), 401
+    try:
+        offset = max(int(request.args.get("offset", 0)), 0)
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "invalid offset or limit"}), 400
+
+    status = request.args.getlist("status") or None
+    total, entries = scheduler.jobs.page(offset=offset, limit=limit, kind=request.args.get("kind"),
+                                         status=status, date=request.args.get("date"),
+                                         court_id=request.args.get("venue_id"))
+    orders = JOB_STORE.orders_by_job(e.id for e in entries)  # 当前页的订单一次查询
+    items = []
+    for entry in entries:
+        item = _task_view(entry)
+        item["orders"] = orders.get(entry.id, [])
+        items.append(item)
+    return jsonify({"total": total, "offset": offset, "limit": limit, "items": items})
+
+
+@app.delete("/api/tasks/<int:task_id>")
+def api_task_cancel(task_id:int):
+    scheduler = current_scheduler()
+    if scheduler is None:
+        return jsonify({"error": "not logged in"}), 401
+    if not scheduler.cancel(task_id):
+        return jsonify({"error": "task not found"}), 404
+    return jsonify({"ok": True, "id": task_id})
+
+
 @app.route("/sessions", methods=["GET"])
 def session_manage():
-    jobs = scheduler.jobs
-    keys = list(jobs.keys())
-    tasks = []
-    for num, key in enumerate(keys):
-        if key.endswith("order"):
-            venue_id, date, field_id, stock_id, mode = key.split("/")
-        else:
-            venue_id, date, mode = key.split("/")
-        mode = "listen" if mode == "monitor" else "book"
-        v = get_venue(venue_id)
-        venue_name = v["name"]
-        if scheduler.user_order.get(key) is None:
-            status = "listening"
-        elif scheduler.user_order.get(key) is False:
-            status = "failed"
-        else:
-            status = "success"
-        task = {
-            "id": num,
-            "date": date,
-            "venue_name": venue_name,
-            "mode": mode,
-            "status": status
-        }
-        tasks.append(task)
-
-    sessions = sorted(tasks, key=lambda x: x["id"])  # 使显示顺序为 1,2,3…（配合模板里的 loop.index）
+    scheduler = current_scheduler()
+    if scheduler is None:
+        return redirect(url_for("login"))
+    per_page = 50
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+    total, entries = scheduler.jobs.page(offset=(page - 1) * per_page, limit=per_page)
+    sessions = []
+    for entry in entries:
+        task = _task_view(entry)
+        task["status"] = "listening" if entry.status == JobStore.LISTENING else entry.status
+        sessions.append(task)
+
     return render_template(
         "sessions.html",
         active_page="sessions",
         username=session.get("username"),
         sessions=sessions,
+        page=page,
+        offset=(page - 1) * per_page,
+        pages=max((total + per_page - 1) // per_page, 1),
         logout_url=url_for("logout"),
     )
 
 
 @app.post("/tasks/<int:task_id>/delete")
 def task_delete(task_id:int):
-    global scheduler
-    # 从 TASKS 中删除对应任务
-    jobs = scheduler.jobs
-    if task_id >= len(jobs):
+    scheduler = current_scheduler()
+    if scheduler is None:
+        return redirect(url_for("login"))
+    # 按稳定的任务id取消任务，同时移除对应的定时任务或监听者
+    if not scheduler.cancel(task_id):
         flash("任务不存在或已删除。", "error")
     else:
-        key = list(jobs.keys())[task_id]
-        del jobs[key]
-        if key in scheduler.user_order:
-            del scheduler.user_order[key]
         flash(f"已删除任务 {task_id}", "success")
     return redirect(url_for("session_manage"))
 
@@ -215,14 +297,13 @@ def task_delete(task_id:int):
 @app.route("/login", methods=["GET", "POST"])
 def login():
     flash(f"如遇到页面卡住的情况，请查看程序终端，根据提示输入手机验证码（再次登录即可正常登录）")
-    global scheduler
-    if scheduler is not None:
+    if current_scheduler() is not None:
         return redirect(url_for("home"))
     if request.method == "POST":
         username = (request.form.get("username") or "").strip()
         password = (request.form.get("password") or "").strip()
         try:
-            scheduler = AppScheduler(username, password)
+            scheduler = POOL.add(username, password)
             session["username"] = username
             with open("data/users.json", "w") as file:
                 json.dump({"username": username, "password": scheduler.crawler.password}, file, indent=2)
@@ -239,7 +320,7 @@ def login():
         if username == "" and password == "":
             return render_template("login.html")
         try:
-            scheduler = AppScheduler(username, password, encrypt_password=False)
+            POOL.add(username, password, encrypt_password=False)
             session["username"] = username
             return redirect(url_for("home"))
         except:
@@ -249,9 +330,10 @@ def login():
 
 @app.post("/logout")
 def logout():
-    global scheduler
+    username = session.get("username")
     session.clear()
-    scheduler = None
+    if username is not None and POOL.remove(username):
+        CREDENTIALS.clear(username)  # 退出后不再使用缓存的登录凭证
     with open("data/users.json", "w") as file:
         json.dump({"username": "", "password": ""}, file, indent=2)
     flash("已退出登录", "info")
@@ -259,4 +341,4 @@ def logout():
 
 
 if __name__ == "__main__":
-    app.run(debug=False)
+    app.run(debug=False, threaded=True)  # 每个场次推送流占用一个线程
@@ -0,0 +1,582 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import subprocess
+from functools import partial
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import requests
+
+from .AppDataBase import FieldProperties, FieldTable
+from .AppCaptchaHandler import CaptchaDatabase, CaptchaLoader, CaptchaHandler, TrackCalibration
+from .AppCaptchaCorpus import CaptchaCorpus
+from .AppCaptchaParallel import CaptchaParallel
+from .AppScheduleGrid import ScheduleGrid
+
+
+def make_field_objects(num_courts, num_times, *, start_hour=8, slot_minutes=30):
+    """
+    生成模拟的findOkArea场次数据
+    :param num_courts: 场地数量
+    :param num_times: 每个场地的时间段数量
+    :return: 与findOkArea返回的object字段格式相同的字典列表
+    """
+    objects = []
+    stock_id = 100000
+    for t in range(num_times):
+        begin = start_hour * 60 + t * slot_minutes
+        end = begin + slot_minutes
+        time_no = f"{begin // 60:02d}:{begin % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+        for c in range(1, num_courts + 1):
+            stock_id += 1
+            objects.append({
+                "id": c * 1000 + t,
+                "name": str(c),
+                "sname": f"场地{c}",
+                "status": (stock_id % 3) or 1,
+                "stockid": stock_id,
+                "stock": {"s_date": "2025-01-01", "time_no": time_no, "price": 20},
+            })
+    return objects
+
+
+def make_fields(num_courts, num_times, **kwargs):
+    """生成模拟的场次表FieldTable"""
+    return FieldTable.from_objects(make_field_objects(num_courts, num_times, **kwargs))
+
+
+def _timeit(func, *args, repeat=5):
+    """返回多次运行中最快一次的耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_schedule_grid(court_counts=(4, 8, 16, 32, 64), num_times=28, repeat=5):
+    """
+    测试ScheduleGrid.build的耗时随场次数量的变化，每个场次的平均耗时应基本不变（线性复杂度）
+    """
+    results = []
+    for num_courts in court_counts:
+        fields = make_fields(num_courts, num_times)
+        cost = _timeit(ScheduleGrid.build, fields, repeat=repeat)
+        results.append({
+            "fields": len(fields),
+            "total_ms": cost * 1000,
+            "per_field_us": cost / len(fields) * 1e6,
+        })
+    return results
+
+
+def bench_field_parse(court_counts=(4, 16, 64), num_times=28, repeat=5):
+    """
+    比较FieldProperties逐对象解析与FieldTable列式解析的耗时
+    """
+    results = []
+    for num_courts in court_counts:
+        objects = make_field_objects(num_courts, num_times)
+        cost_objects = _timeit(lambda: [FieldProperties(i) for i in objects], repeat=repeat)
+        cost_table = _timeit(FieldTable.from_objects, objects, repeat=repeat)
+        mask_cost = _timeit(lambda t: t[t.status == 1], FieldTable.from_objects(objects), repeat=repeat)
+        results.append({
+            "fields": len(objects),
+            "objects_ms": cost_objects * 1000,
+            "table_ms": cost_table * 1000,
+            "mask_us": mask_cost * 1e6,
+        })
+    return results
+
+
+def _percentiles(samples, scale=1000):
+    """返回p50/p95/p99，默认单位为毫秒"""
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    p50, p95, p99 = np.percentile(np.asarray(samples) * scale, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def _captcha_samples(db_path, *, solver, corpus, mode):
+    """
+    :return: (无参的求解函数, 标注的偏移量)的生成器，求解函数接受timings参数
+    """
+    if corpus:
+        c = CaptchaCorpus(db_path)
+        try:
+            for item in c.replay():
+                # 语料库中保存了灰度图或原始图片字节，回放时不需要base64解码
+                yield partial(item.locate, mode=mode), item.offset
+        finally:
+            c.close()
+    else:
+        for row in CaptchaDatabase.load_many(db_path):
+            offset = row["offset"] if "offset" in row.keys() else None
+            yield partial(solver, row["backgroundImage"], row["sliderImage"], mode=mode), offset
+
+
+def bench_captcha(db_path="captchas.db", *, limit=None, tolerance=4, solver=None, corpus=False, mode=None):
+    """
+    离线回放CaptchaDatabase（或CaptchaCorpus）中的验证码，统计求解各阶段的耗时和准确率
+    :param db_path: 验证码数据库路径
+    :param limit: 最多回放的验证码数量
+    :param tolerance: 与标注偏移量的误差不超过该像素数即视为正确
+    :param solver: 求解函数，签名与CaptchaLoader.locate_slider相同，corpus为True时不使用
+    :param corpus: 是否从CaptchaCorpus回放
+    :param mode: 求解模式，见CaptchaLoader.MODES
+    :return: 统计结果字典
+    """
+    solver = solver or CaptchaLoader.locate_slider
+    stage_samples = {stage: [] for stage in CaptchaLoader.STAGES}
+    totals = []
+    labelled = correct = 0
+    errors = []
+    confidences = {True: [], False: []}  # 是否正确 -> 匹配置信度
+
+    for num, (solve, offset) in enumerate(_captcha_samples(db_path, solver=solver, corpus=corpus, mode=mode)):
+        if limit is not None and num >= limit:
+            break
+        timings = {}
+        start = time.perf_counter()
+        bx, _, confidence, piece_x = solve(timings=timings)
+        totals.append(time.perf_counter() - start)
+        for stage, cost in timings.items():
+            stage_samples.setdefault(stage, []).append(cost)
+
+        if offset is not None:
+            labelled += 1
+            error = abs(bx - piece_x - offset)  # 标注的是滑块图需要移动的距离
+            errors.append(error)
+            correct += error <= tolerance
+            confidences[error <= tolerance].append(confidence)
+
+    total_time = sum(totals)
+    return {
+        "count": len(totals),
+        "solves_per_sec": len(totals) / total_time if total_time else 0.0,
+        "total_ms": _percentiles(totals),
+        "stages_ms": {stage: _percentiles(v) for stage, v in stage_samples.items() if v},
+        "accuracy": {
+            "labelled": labelled,
+            "correct": correct,
+            "rate": correct / labelled,
+            "mean_abs_error": float(np.mean(errors)),
+            # 正确和错误结果的置信度分布，用于选择CaptchaSolver的min_confidence
+            "confidence_correct": _percentiles(confidences[True], scale=1) if confidences[True] else None,
+            "confidence_wrong": _percentiles(confidences[False], scale=1) if confidences[False] else None,
+        } if labelled else None,
+    }
+
+
+def bench_parallel(db_path="captchas.db", *, limit=None, mode=None, chunk=64, workers=1):
+    """
+    对比逐个调用CaptchaLoader.locate_gray与CaptchaParallel.locate的吞吐量，图片在计时前解码为灰度图
+    :param db_path: CaptchaCorpus数据库路径
+    :param chunk: 见CaptchaParallel.locate
+    :param workers: 见CaptchaParallel.locate
+    :return: 统计结果字典
+    """
+    corpus = CaptchaCorpus(db_path)
+    try:
+        items = list(corpus.replay(limit=limit))
+    finally:
+        corpus.close()
+    groups = {}  # 同一组的same_height参数相同
+    for item in items:
+        item.background_gray()  # 在计时前解码
+        groups.setdefault(item.same_height, []).append(item)
+
+    loop_time = parallel_time = 0.0
+    same = 0
+    for same_height, group in groups.items():
+        start = time.perf_counter()
+        expected = [CaptchaLoader.locate_gray(i.gray, i.slider_gray, i.y_min, same_height=same_height, mode=mode)[0]
+                    for i in group]
+        loop_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        offsets, _ = CaptchaParallel.locate([i.gray for i in group], [i.slider_gray for i in group],
+                                         [i.y_min for i in group], same_height=same_height, mode=mode, chunk=chunk,
+                                         workers=workers)
+        parallel_time += time.perf_counter() - start
+        # 多线程时cv2的计算路径（内存对齐）不同，亚像素位置可能有1e-6量级的浮点误差
+        same += int((np.abs(np.asarray(expected) - offsets) < 0.01).sum())
+
+    return {
+        "count": len(items),
+        "groups": len(groups),
+        "loop_per_sec": len(items) / loop_time if loop_time else 0.0,
+        "parallel_per_sec": len(items) / parallel_time if parallel_time else 0.0,
+        "agreement": same / len(items) if items else 0.0,
+    }
+
+
+def bench_track(db_path="captchas.db", *, limit=None, mode=None, tolerance=6, tracks=5):
+    """
+    按AppFakeServer.verify_captcha的判定规则（轨迹终点与标注偏移量换算的距离之差不超过tolerance）
+    统计CaptchaCorpus中有标注的验证码生成的滑动轨迹的通过率，对比：
+    integer为取整到像素的匹配位置，subpixel为亚像素精度的匹配位置，
+    calibrated在subpixel的基础上使用TrackCalibration（两折交叉拟合，不在拟合用的验证码上评估）
+    :param tolerance: 允许的误差，单位为网页中的像素
+    :param tracks: 每个验证码生成的轨迹数量（轨迹是随机的）
+    :return: 统计结果字典
+    """
+    corpus = CaptchaCorpus(db_path)
+    try:
+        samples = [(item.to_captcha(), item.locate(mode=mode), item.offset, item.background_width)
+                   for item in corpus.replay(limit=limit, labelled=True)]
+    finally:
+        corpus.close()
+
+    calibrations = [None, None]
+    for fold in range(2):
+        train = samples[1 - fold::2]
+        if len(train) >= 2:
+            calibrations[fold] = TrackCalibration.fit(
+                [bx - piece_x for _, (bx, _, _, piece_x), _, _ in train],
+                [offset for *_, offset, _ in train])
+
+    result = {}
+    for variant in ("integer", "subpixel", "calibrated"):
+        passed = 0
+        errors = []
+        for num, (captcha, (bx, hx, confidence, piece_x), offset, width) in enumerate(samples):
+            position = ((round(bx), round(hx), confidence, piece_x) if variant == "integer"
+                        else (bx, hx, confidence, piece_x))
+            calibration = calibrations[num % 2] if variant == "calibrated" else None
+            handler = CaptchaHandler(captcha, position=position, calibration=calibration)
+            expected = offset * TrackCalibration.TRACK_WIDTH / width
+            errors.append(abs(handler.distance - expected))
+            passed += sum(abs(handler.get_track()[-1]["x"] - expected) <= tolerance for _ in range(tracks))
+        result[variant] = {
+            "count": len(samples),
+            "pass_rate": passed / (len(samples) * tracks) if samples else 0.0,
+            "mean_abs_error": float(np.mean(errors)) if errors else 0.0,
+        }
+    return result
+
+
+def _print_captcha(title, result):
+    rows = [{"stage": "total", **result["total_ms"]}]
+    rows += [{"stage": stage, **v} for stage, v in result["stages_ms"].items()]
+    _print_table(f"{title}（{result['count']}个验证码，{result['solves_per_sec']:.1f}次/秒，单位ms）", rows)
+    if result["accuracy"] is not None:
+        acc = result["accuracy"]
+        print(f"准确率：{acc['correct']}/{acc['labelled']} = {acc['rate']:.2%}，平均误差{acc['mean_abs_error']:.2f}px")
+        for name, key in (("正确", "confidence_correct"), ("错误", "confidence_wrong")):
+            if (c := acc[key]) is not None:
+                print(f"{name}结果的置信度：p50={c['p50']:.3f}，p95={c['p95']:.3f}，p99={c['p99']:.3f}")
+
+
+def _wrap_pay_field(crawler, calls):
+    """记录crawler.pay_field每次调用的开始时间、结束时间和状态码"""
+    pay_field = crawler.pay_field
+
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        result, code = pay_field(*args, **kwargs)
+        calls.append((start, time.time(), code))
+        return result, code
+
+    crawler.pay_field = wrapper
+    return pay_field
+
+
+def bench_schedule_api(server, pool, court_id, date_str, *, clients=8, requests_per_client=50):
+    """
+    多个客户端并发请求/api/venues/<id>/schedule，统计延迟、吞吐量和上游findOkArea的请求次数
+    """
+    import app as web  # 在项目根目录运行时可以导入
+    from .AppFakeServer import BackgroundServer
+
+    web.POOL = pool
+    upstream_before = server.backend.counters.get("FIELD_URL", 0)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client(url):
+        session = requests.Session()
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            response = session.get(url, timeout=30)
+            cost = time.perf_counter() - start
+            with lock:
+                latencies.append(cost)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+    with BackgroundServer(web.app) as http:
+        url = f"{http.base_url}/api/venues/{court_id}/schedule?date={date_str}"
+        threads = [threading.Thread(target=client, args=(url,)) for _ in range(clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - start
+
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "latency_ms": _percentiles(latencies),
+        "upstream_field_requests": server.backend.counters.get("FIELD_URL", 0) - upstream_before,
+    }
+
+
+def bench_monitor_cycle(server, scheduler, court_id, date_str, *, cycles=10, num=2, open_count=6):
+    """
+    统计一次监听轮询的耗时：从查询场次到第一个订单成功的时间，以及整个轮询的时间
+    """
+    job_key = court_id + "/" + date_str + "/" + "monitor"
+    first_order, cycle_time, booked = [], [], []
+    calls = []
+    pay_field = _wrap_pay_field(scheduler.crawler, calls)
+    try:
+        for _ in range(cycles):
+            server.open_fields(date_str, court_id, open_count)
+            scheduler.crawler.field_cache.invalidate()
+            scheduler._failed_stocks.clear()  # 每轮都从头尝试，不受上一轮失败冷却的影响
+            with scheduler._order_lock:
+                scheduler.user_order[job_key] = []
+                scheduler.monitor_targets[job_key] = num
+            calls.clear()
+            start = time.time()
+            scheduler.monitor_court(court_id, date_str, num, if_monitor=True)
+            cycle_time.append(time.time() - start)
+            success = [end for _, end, code in calls if code == '1']
+            if success:
+                first_order.append(min(success) - start)
+            booked.append(len(scheduler.user_order[job_key]))
+    finally:
+        scheduler.crawler.pay_field = pay_field
+    return {
+        "cycles": cycles,
+        "num": num,
+        "booked_mean": float(np.mean(booked)) if booked else 0.0,
+        "poll_to_first_order_ms": _percentiles(first_order),
+        "cycle_ms": _percentiles(cycle_time),
+    }
+
+
+def bench_order_delay(server, scheduler, court_id, date_str, *, runs=3, lead=2.5):
+    """
+    统计定时预订任务的触发延迟：第一次调用pay_field的时间与DateTrigger设定时间的差
+    """
+    import app as web
+
+    delays, finished = [], []
+    calls = []
+    pay_field = _wrap_pay_field(scheduler.crawler, calls)
+    try:
+        for _ in range(runs):
+            (field_id, stock_id), = server.open_fields(date_str, court_id, 1)
+            calls.clear()
+            # DateTrigger的精度为秒，取lead秒之后的整秒
+            run_at = datetime.now(scheduler.timezone) + timedelta(seconds=lead)
+            run_at = run_at.replace(microsecond=0) + timedelta(seconds=1)
+            with web.app.test_request_context():
+                scheduler.order_stock(date_str, court_id, str(field_id), str(stock_id),
+                                      order_date=run_at.strftime('%Y-%m-%d %H:%M:%S'))
+            deadline = time.time() + lead + 30
+            while not calls and time.time() < deadline:
+                time.sleep(0.001)
+            if calls:
+                delays.append(calls[0][0] - run_at.timestamp())
+                while calls[-1][2] not in ('1', '0') and time.time() < deadline:
+                    time.sleep(0.001)
+                finished.append(calls[-1][1] - run_at.timestamp())
+    finally:
+        scheduler.crawler.pay_field = pay_field
+    return {
+        "runs": runs,
+        "fired": len(delays),
+        "firing_delay_ms": _percentiles(delays),
+        "trigger_to_result_ms": _percentiles(finished),
+    }
+
+
+def bench_pay_field(server, crawler, court_id, date_str, *, runs=20):
+    """
+    统计pay_field的总耗时，并拆分为获取验证码、求解验证码和预订请求
+    """
+    crawler.captcha_pool.clear()  # 不使用预取的验证码，测量完整的流程
+    stages = {"captcha_fetch": [], "captcha_solve": [], "book": []}
+    totals, codes = [], {}
+    for _ in range(runs):
+        (field_id, stock_id), = server.open_fields(date_str, court_id, 1)
+        timings = {}
+        start = time.perf_counter()
+        _, code = crawler.pay_field(court_id, field_id, stock_id, timings=timings)
+        totals.append(time.perf_counter() - start)
+        codes[code] = codes.get(code, 0) + 1
+        for stage, cost in timings.items():
+            stages[stage].append(cost)
+    return {
+        "runs": runs,
+        "codes": codes,
+        "total_ms": _percentiles(totals),
+        "stages_ms": {stage: _percentiles(v) for stage, v in stages.items()},
+    }
+
+
+def bench_e2e(*, latency=0.02, captcha_db=None, clients=8, requests_per_client=50, cycles=10, runs=20):
+    """
+    在本地模拟服务器上运行完整的预订流程性能测试
+    """
+    from .AppFakeServer import FakeServer, FakeConfig
+    from .AppSchedulerPool import SchedulerPool
+
+    config = FakeConfig(latency=latency, captcha_db=captcha_db, advancenum=4)
+    with FakeServer(config) as server:
+        pool = SchedulerPool(base_url=server.base_url, courts_refresh_minutes=0, prepare_seconds=1)
+        scheduler = pool.add("bench", "bench")
+        try:
+            court_id = next(iter(scheduler.courts)).id
+            date_str = date.today().isoformat()
+            server.open_fields(date_str, court_id, 20)
+            return {
+                "config": {"latency": latency, "captcha_db": captcha_db},
+                "schedule_api": bench_schedule_api(server, pool, court_id, date_str,
+                                                   clients=clients, requests_per_client=requests_per_client),
+                "pay_field": bench_pay_field(server, scheduler.crawler, court_id, date_str, runs=runs),
+                "monitor_cycle": bench_monitor_cycle(server, scheduler, court_id, date_str, cycles=cycles),
+                "order_delay": bench_order_delay(server, scheduler, court_id, date_str),
+                "http": scheduler.crawler.transport.stats(),
+            }
+        finally:
+            pool.shutdown()
+
+
+def _print_e2e(result):
+    api = result["schedule_api"]
+    print(f"/api/venues/<id>/schedule：{api['clients']}个客户端，{api['requests']}次请求，"
+          f"{api['throughput_rps']:.1f}次/秒，上游请求{api['upstream_field_requests']}次")
+    _print_table("延迟（ms）", [api["latency_ms"]])
+    pay = result["pay_field"]
+    rows = [{"stage": "total", **pay["total_ms"]}] + [{"stage": k, **v} for k, v in pay["stages_ms"].items()]
+    _print_table(f"pay_field（{pay['runs']}次，状态码{pay['codes']}，单位ms）", rows)
+    monitor = result["monitor_cycle"]
+    _print_table(f"monitor_court（{monitor['cycles']}轮，平均预订{monitor['booked_mean']:.1f}个，单位ms）", [
+        {"metric": "poll_to_first_order", **monitor["poll_to_first_order_ms"]},
+        {"metric": "cycle", **monitor["cycle_ms"]},
+    ])
+    order = result["order_delay"]
+    _print_table(f"_order_stock（触发{order['fired']}/{order['runs']}次，单位ms）", [
+        {"metric": "firing_delay", **order["firing_delay_ms"]},
+        {"metric": "trigger_to_result", **order["trigger_to_result_ms"]},
+    ])
+
+
+def _meta():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "argv": sys.argv[1:],
+    }
+
+
+def _print_table(title, rows):
+    print(title)
+    if not rows:
+        return
+    keys = list(rows[0].keys())
+    print("  ".join(f"{k:>14}" for k in keys))
+    for row in rows:
+        print("  ".join(f"{v:>14.3f}" if isinstance(v, float) else f"{v:>14}" for v in row.values()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="XJTUCourtMaster性能测试")
+    sub = parser.add_subparsers(dest="suite", required=True)
+
+    p = sub.add_parser("schedule", help="场次表格生成的耗时")
+    p.add_argument("--times", type=int, default=28, help="每个场地的时间段数量")
+    p.add_argument("--courts", type=int, nargs="+", default=[4, 8, 16, 32, 64], help="场地数量")
+
+    p = sub.add_parser("fields", help="场次数据的解析耗时")
+    p.add_argument("--times", type=int, default=28, help="每个场地的时间段数量")
+    p.add_argument("--courts", type=int, nargs="+", default=[4, 16, 64], help="场地数量")
+
+    p = sub.add_parser("captcha", help="离线回放验证码数据库，统计求解耗时和准确率")
+    p.add_argument("--db", default="captchas.db", help="CaptchaDatabase数据库路径")
+    p.add_argument("--limit", type=int, default=None, help="最多回放的验证码数量")
+    p.add_argument("--tolerance", type=int, default=4, help="判定正确的最大误差（像素）")
+    p.add_argument("--mode", nargs="+", default=CaptchaLoader.MODES, choices=CaptchaLoader.MODES,
+                   help="需要对比的求解模式")
+    p.add_argument("--corpus", action="store_true", help="从CaptchaCorpus（corpus表）回放，而不是captchas表")
+
+    p = sub.add_parser("parallel", help="对比逐个求解与CaptchaParallel多线程求解的吞吐量")
+    p.add_argument("--db", default="captchas.db", help="CaptchaCorpus数据库路径")
+    p.add_argument("--limit", type=int, default=None, help="最多回放的验证码数量")
+    p.add_argument("--mode", nargs="+", default=CaptchaLoader.MODES, choices=CaptchaLoader.MODES,
+                   help="需要对比的求解模式")
+    p.add_argument("--chunk", type=int, default=64, help="每个线程任务求解的验证码数量")
+    p.add_argument("--workers", type=int, default=1, help="并行求解的线程数")
+
+    p = sub.add_parser("track", help="对比取整、亚像素和校准后的滑动轨迹的通过率")
+    p.add_argument("--db", default="captchas.db", help="CaptchaCorpus数据库路径")
+    p.add_argument("--limit", type=int, default=None, help="最多回放的验证码数量")
+    p.add_argument("--mode", default=None, choices=CaptchaLoader.MODES, help="求解模式")
+    p.add_argument("--tolerance", type=float, default=6, help="允许的误差（按260像素宽度换算）")
+    p.add_argument("--tracks", type=int, default=5, help="每个验证码生成的轨迹数量")
+
+    p = sub.add_parser("e2e", help="在本地模拟服务器上测试网页接口和预订流程")
+    p.add_argument("--latency", type=float, default=0.02, help="模拟服务器每个接口的延迟（秒）")
+    p.add_argument("--captcha-db", default=None, help="模拟服务器使用的验证码数据库，默认使用合成验证码")
+    p.add_argument("--clients", type=int, default=8, help="并发请求网页接口的客户端数量")
+    p.add_argument("--requests", type=int, default=50, help="每个客户端的请求次数")
+    p.add_argument("--cycles", type=int, default=10, help="监听轮询的次数")
+    p.add_argument("--runs", type=int, default=20, help="pay_field的测试次数")
+
+    for p in sub.choices.values():
+        p.add_argument("--json", default=None, help="把结果以JSON格式写入该文件，便于不同提交之间比较")
+
+    args = parser.parse_args(argv)
+    if args.suite == "schedule":
+        result = bench_schedule_grid(args.courts, args.times)
+        _print_table("ScheduleGrid.build", result)
+    elif args.suite == "fields":
+        result = bench_field_parse(args.courts, args.times)
+        _print_table("FieldProperties vs FieldTable", result)
+    elif args.suite == "captcha":
+        result = {}
+        for mode in args.mode:
+            result[mode] = bench_captcha(args.db, limit=args.limit, tolerance=args.tolerance, corpus=args.corpus,
+                                         mode=mode)
+            name = "CaptchaCorpus" if args.corpus else "CaptchaLoader.locate_slider"
+            _print_captcha(f"{name}[mode={mode}]", result[mode])
+    elif args.suite == "parallel":
+        result = {mode: bench_parallel(args.db, limit=args.limit, mode=mode, chunk=args.chunk, workers=args.workers)
+                  for mode in args.mode}
+        _print_table("CaptchaLoader.locate_gray vs CaptchaParallel.locate（次/秒）",
+                     [{"mode": mode, **r} for mode, r in result.items()])
+    elif args.suite == "track":
+        result = bench_track(args.db, limit=args.limit, mode=args.mode, tolerance=args.tolerance, tracks=args.tracks)
+        _print_table(f"滑动轨迹的通过率（误差不超过{args.tolerance}）",
+                     [{"variant": variant, **r} for variant, r in result.items()])
+    elif args.suite == "e2e":
+        result = bench_e2e(latency=args.latency, captcha_db=args.captcha_db, clients=args.clients,
+                           requests_per_client=args.requests, cycles=args.cycles, runs=args.runs)
+        _print_e2e(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"suite": args.suite, "meta": _meta(), "results": result}, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import queue
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from .AppCaptchaHandler import CaptchaDatabase
+
+
+class SolveCache:
+    def __init__(self, db_path="captchas.db", *, capacity=1024, max_rejections=3, unverified_ttl=86400,
+                 write_batch=256):
+        """
+        已求解验证码的缓存，以背景图和滑块图内容的哈希为key，保存在CaptchaDatabase的solutions表中
+        验证码的背景图来自有限的图片集合时，重复出现的验证码不需要再次解码和匹配
+        只有预订时被服务器接受过的结果（verified）才会被命中，内存中按LRU保留最近使用的capacity个
+        put和verify只把写入放入队列，由后台的写入线程合并成批提交，求解和预订的线程不等待数据库
+        :param db_path: CaptchaDatabase数据库路径
+        :param capacity: 内存中保留的结果数量
+        :param max_rejections: 已验证的结果连续被服务器拒绝该次数后删除
+        :param unverified_ttl: 未验证的结果（没有等到report）保留的秒数，过期后在prune时删除（由调用者定期执行）
+        :param write_batch: 一次提交最多合并的写入数量
+        """
+        self.db_path = db_path
+        self.capacity = capacity
+        self.max_rejections = max_rejections
+        self.unverified_ttl = unverified_ttl
+        self.write_batch = write_batch
+        CaptchaDatabase.init_db(db_path)
+        self._lock = threading.Lock()  # 保护内存LRU和计数
+        self._db_lock = threading.Lock()  # 保护数据库连接
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._lru = OrderedDict()  # key -> (bx, hx, confidence, piece_x)
+
+        self.hits = 0
+        self.db_hits = 0  # 内存未命中、数据库命中的次数（包含在hits中）
+        self.misses = 0
+        self.stored = 0
+        self.verified = 0
+        self.rejected = 0
+        self.evicted = 0  # 已验证的结果被多次拒绝后删除的数量
+        self.pruned = 0  # 过期删除的未验证结果数量
+        self.commits = 0  # 写入线程提交的次数
+        self.prune()
+
+        self._writes = queue.Queue()  # 元素为(方法, 参数)，None表示停止
+        self._writer = threading.Thread(target=self._write_loop, name="solve-cache-writer", daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def key(captcha_json_data):
+        """背景图和滑块图base64文本的哈希，不需要解码图片（sha256有硬件加速，比md5和blake2b更快）"""
+        h = hashlib.sha256()
+        h.update(captcha_json_data["backgroundImage"].encode())
+        h.update(b"|")
+        h.update(captcha_json_data["sliderImage"].encode())
+        return h.hexdigest()[:32]
+
+    def _remember(self, key, position):
+        """放入内存LRU，需要持有锁"""
+        self._lru[key] = position
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def get(self, key):
+        """
+        :return: 已验证的(bx, hx, confidence, piece_x)，未命中时返回None（旧版本保存的结果piece_x为None）
+        """
+        with self._lock:
+            position = self._lru.get(key)
+            if position is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return position
+        with self._db_lock:
+            row = self._conn.execute("SELECT bx, hx, confidence, piece_x FROM solutions WHERE hash = ? "
+                                     "AND verified = 1",
+                                     (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self._remember(key, row)
+            self.hits += 1
+            self.db_hits += 1
+            return row
+
+    def put(self, key, bx, hx, confidence, piece_x=None):
+        """记录一次求解结果，等待verify确认后才会被命中"""
+        self._writes.put((self._put, (key, float(bx), float(hx), float(confidence),
+                                      None if piece_x is None else float(piece_x),
+                                      datetime.now().strftime("%Y-%m-%d %H:%M:%S"))))
+        with self._lock:
+            self.stored += 1
+
+    def verify(self, key, accepted):
+        """
+        根据预订结果确认求解结果，在写入线程中按提交的顺序执行，确认后的结果稍后才会被命中
+        :param accepted: 服务器是否接受了该验证码，不接受时删除未验证的结果；
+                         已验证的结果偶尔被拒绝可能是滑动轨迹的误差造成的，连续被拒绝max_rejections次才删除
+        """
+        self._writes.put((self._verify, (key, accepted)))
+
+    def flush(self):
+        """等待已经放入队列的写入全部提交"""
+        self._writes.join()
+
+    def _write_loop(self):
+        """写入线程：取出队列中已有的写入（最多write_batch个），在一个事务中执行"""
+        stopped = False
+        while not stopped:
+            ops = [self._writes.get()]
+            while len(ops) < self.write_batch:
+                try:
+                    ops.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._db_lock, self._conn:
+                    for op in ops:
+                        if op is None:
+                            stopped = True
+                        else:
+                            op[0](*op[1])
+                with self._lock:
+                    self.commits += 1
+            except Exception as e:  # 写入失败时丢弃这一批，不影响求解
+                print(f"写入验证码缓存失败！{e}")
+            finally:
+                for _ in ops:
+                    self._writes.task_done()
+
+    def _put(self, key, bx, hx, confidence, piece_x, updated):
+        """写入线程中执行，需要持有_db_lock"""
+        self._conn.execute("""
+        INSERT INTO solutions (hash, bx, hx, confidence, piece_x, verified, rejections, updated)
+        VALUES (?, ?, ?, ?, ?, 0, 0, ?)
+        ON CONFLICT (hash) DO UPDATE SET bx=excluded.bx, hx=excluded.hx, confidence=excluded.confidence,
+          piece_x=excluded.piece_x, updated=excluded.updated WHERE verified = 0
+        """, (key, bx, hx, confidence, piece_x, updated))
+
+    def _verify(self, key, accepted):
+        """写入线程中执行，需要持有_db_lock"""
+        if accepted:
+            self._conn.execute("UPDATE solutions SET verified = 1, rejections = 0 WHERE hash = ?", (key,))
+            row = self._conn.execute("SELECT bx, hx, confidence, piece_x FROM solutions WHERE hash = ?",
+                                     (key,)).fetchone()
+            with self._lock:
+                if row is not None:
+                    self._remember(key, row)
+                self.verified += 1
+            return
+        self._conn.execute("DELETE FROM solutions WHERE hash = ? AND verified = 0", (key,))
+        self._conn.execute("UPDATE solutions SET rejections = COALESCE(rejections, 0) + 1 WHERE hash = ?",
+                           (key,))
+        evicted = self._conn.execute("DELETE FROM solutions WHERE hash = ? AND rejections >= ?",
+                                     (key, self.max_rejections)).rowcount
+        with self._lock:
+            self.rejected += 1
+            if evicted:
+                self._lru.pop(key, None)
+                self.evicted += 1
+
+    def prune(self):
+        """
+        删除超过unverified_ttl仍未验证的结果（例如提交前验证码就失效了，永远不会有report）
+        不在求解的路径上执行，由调用者定期执行，例如SchedulerPool的定时任务
+        :return: 删除的数量
+        """
+        cutoff = (datetime.now() - timedelta(seconds=self.unverified_ttl)).strftime("%Y-%m-%d %H:%M:%S")
+        with self._db_lock, self._conn:
+            count = self._conn.execute("DELETE FROM solutions WHERE verified = 0 AND updated < ?",
+                                       (cutoff,)).rowcount
+        with self._lock:
+            self.pruned += count
+        return count
+
+    def close(self):
+        """提交队列中的写入后关闭数据库"""
+        self._writes.put(None)
+        self._writer.join()
+        with self._db_lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._lru)
+
+    @property
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._lru),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stored": self.stored,
+                "verified": self.verified,
+                "rejected": self.rejected,
+                "evicted": self.evicted,
+                "pruned": self.pruned,
+                "commits": self.commits,
+                "pending": self._writes.qsize(),
+            }
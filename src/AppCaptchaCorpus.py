@@ -0,0 +1,365 @@
+import time
+import json
+import base64
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from .AppCaptchaHandler import CaptchaDatabase, CaptchaLoader, StageTimer, TrackCalibration
+from .AppCaptchaCache import SolveCache
+
+
+class CorpusItem:
+    __slots__ = ("hash", "source_id", "background", "slider", "background_width", "background_height",
+                 "slider_width", "slider_height", "data", "offset", "y_min", "same_height", "slider_gray",
+                 "gray", "piece_x")
+
+    COLS = ("hash", "source_id", "background", "slider", "background_width", "background_height", "slider_width",
+            "slider_height", "data", "offset", "y_min", "same_height", "slider_gray", "slider_gray_width", "gray",
+            "gray_width", "piece_x")
+
+    def __init__(self, row):
+        (self.hash, self.source_id, self.background, self.slider, self.background_width, self.background_height,
+         self.slider_width, self.slider_height, self.data, self.offset, self.y_min, same_height, slider_gray,
+         slider_gray_width, gray, gray_width, self.piece_x) = row
+        self.same_height = bool(same_height)
+        if self.piece_x is None:  # 旧版本的语料库没有保存piece_x
+            self.piece_x = CaptchaLoader.crop_slider(CaptchaLoader.to_gray(CaptchaLoader._imdecode(self.slider)))[2]
+        # BLOB直接按uint8解释，不需要任何解码
+        self.slider_gray = np.frombuffer(slider_gray, np.uint8).reshape(-1, slider_gray_width)
+        self.gray = None if gray is None else np.frombuffer(gray, np.uint8).reshape(-1, gray_width)
+
+    def background_gray(self):
+        """背景图的灰度图，入库时没有保存灰度图的需要解码一次原图"""
+        if self.gray is None:
+            self.gray = CaptchaLoader.to_gray(CaptchaLoader._imdecode(self.background))
+        return self.gray
+
+    def locate(self, *, timings=None, mode=None):
+        """在灰度图上求解，结果与CaptchaLoader.locate_slider相同"""
+        timer = StageTimer(timings)
+        gray = self.background_gray()
+        timer.lap("imdecode")
+        bx, hx, confidence = CaptchaLoader.locate_gray(gray, self.slider_gray, self.y_min,
+                                                       same_height=self.same_height, timings=timings, mode=mode)
+        return bx, hx, confidence, self.piece_x
+
+    @staticmethod
+    def _data_url(img):
+        mime = "image/jpeg" if img[:2] == b"\xff\xd8" else "image/png"
+        return f"data:{mime};base64," + base64.b64encode(img).decode()
+
+    def to_captcha(self):
+        """还原为与/gen返回的captcha字段格式相同的字典，例如供AppFakeServer使用"""
+        return {
+            "backgroundImage": self._data_url(self.background),
+            "sliderImage": self._data_url(self.slider),
+            "backgroundImageWidth": self.background_width,
+            "backgroundImageHeight": self.background_height,
+            "sliderImageWidth": self.slider_width,
+            "sliderImageHeight": self.slider_height,
+            "data": self.data,
+        }
+
+
+class CaptchaCorpus:
+    def __init__(self, db_path="captchas.db", *, store_gray=False):
+        """
+        验证码语料库，保存在CaptchaDatabase文件的corpus表中
+        与captchas表相比：图片以解码base64后的原始字节保存为BLOB，同时保存裁剪后的滑块灰度图，按内容哈希去重，
+        所有线程共享一个WAL模式的连接，写入按批次在一个事务中完成
+        :param db_path: 数据库路径
+        :param store_gray: 是否同时保存背景图的灰度图（未压缩的uint8），回放时完全不需要解码图片，但文件会变大
+        """
+        self.db_path = db_path
+        self.store_gray = store_gray
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.init_db()
+
+    def init_db(self):
+        sql = """
+        PRAGMA journal_mode=WAL;
+        CREATE TABLE IF NOT EXISTS corpus (
+          hash TEXT PRIMARY KEY,       -- 背景图和滑块图内容的哈希，与SolveCache.key一致
+          source_id TEXT,              -- /gen返回的验证码id
+          background BLOB,             -- 背景图的原始字节（JPEG/PNG）
+          slider BLOB,
+          background_width INTEGER,
+          background_height INTEGER,
+          slider_width INTEGER,
+          slider_height INTEGER,
+          data TEXT,
+          offset INTEGER,              -- 人工标注的滑块（图）左边缘在背景图中的x坐标（像素），未标注为NULL
+          y_min INTEGER,               -- 拼图块在滑块图中的上边缘
+          same_height INTEGER,         -- 滑块图与背景图是否等高
+          slider_gray BLOB,            -- 裁剪后的滑块灰度图，uint8
+          slider_gray_width INTEGER,
+          gray BLOB,                   -- 背景图的灰度图，uint8，store_gray为False时为NULL
+          gray_width INTEGER,
+          created TEXT,
+          piece_x INTEGER              -- 拼图块在滑块图中的左边缘
+        );
+        """
+        with self._lock:
+            self._conn.executescript(sql)
+            # 兼容旧版本没有piece_x列的语料库，读取时从滑块图中计算
+            cols = [row[1] for row in self._conn.execute("PRAGMA table_info(corpus)")]
+            if "piece_x" not in cols:
+                self._conn.execute("ALTER TABLE corpus ADD COLUMN piece_x INTEGER")
+                self._conn.commit()
+
+    @staticmethod
+    def _row(item, store_gray):
+        """把/gen返回的数据转换为一行，需要解码一次图片"""
+        captcha = item["captcha"]
+        background = CaptchaLoader._decode_base64(captcha["backgroundImage"])
+        slider = CaptchaLoader._decode_base64(captcha["sliderImage"])
+        bg_img = CaptchaLoader._imdecode(background)
+        sl_img = CaptchaLoader._imdecode(slider)
+        slider_gray, y_min, piece_x = CaptchaLoader.crop_slider(CaptchaLoader.to_gray(sl_img))
+        gray = CaptchaLoader.to_gray(bg_img) if store_gray else None
+        data = captcha.get("data")
+        if data is not None and not isinstance(data, str):
+            data = json.dumps(data, ensure_ascii=False)
+        return (
+            SolveCache.key(captcha), item.get("id"), background, slider,
+            captcha.get("backgroundImageWidth"), captcha.get("backgroundImageHeight"),
+            captcha.get("sliderImageWidth"), captcha.get("sliderImageHeight"), data, item.get("offset"),
+            y_min, int(sl_img.shape[0] == bg_img.shape[0]),
+            np.ascontiguousarray(slider_gray).tobytes(), slider_gray.shape[1],
+            None if gray is None else gray.tobytes(), None if gray is None else gray.shape[1], piece_x,
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        )
+
+    def add_many(self, items):
+        """
+        在一个事务中批量加入验证码，内容相同的验证码只保存一次
+        :param items: /gen返回的数据{"id", "captcha"}，可以带有标注的"offset"
+        :return: 新加入的数量
+        """
+        keys = {}
+        for item in items:
+            keys.setdefault(SolveCache.key(item["captcha"]), item)
+        if not keys:
+            return 0
+        with self._lock:
+            existing = {row[0] for row in self._conn.execute(
+                f"SELECT hash FROM corpus WHERE hash IN ({', '.join('?' * len(keys))})", list(keys))}
+        # 只解码新的验证码，解码不需要持有锁
+        rows = [self._row(item, self.store_gray) for key, item in keys.items() if key not in existing]
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            cur = self._conn.executemany(f"""
+            INSERT OR IGNORE INTO corpus ({', '.join(CorpusItem.COLS)}, created)
+            VALUES ({', '.join('?' * (len(CorpusItem.COLS) + 1))})
+            """, rows)
+        return cur.rowcount
+
+    def import_database(self, db_path, *, batch=256):
+        """
+        导入旧格式的CaptchaDatabase（captchas表），保留人工标注的偏移量
+        :return: 新加入的数量
+        """
+        added = 0
+        items = []
+        for row in CaptchaDatabase.load_many(db_path):
+            captcha = {col: row[col] for col in CaptchaDatabase.CAPTCHA_COLS if col != "offset"}
+            items.append({"id": row["id"], "captcha": captcha, "offset": row["offset"]})
+            if len(items) >= batch:
+                added += self.add_many(items)
+                items = []
+        return added + self.add_many(items)
+
+    def set_offset(self, key, offset):
+        """标注验证码的正确偏移量，key为内容哈希"""
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE corpus SET offset = ? WHERE hash = ?", (offset, key)).rowcount
+
+    def replay(self, *, limit=None, labelled=False, batch=128):
+        """
+        按加入顺序遍历语料库，每批查询之间释放锁
+        :param labelled: 只返回有标注的验证码
+        :return: CorpusItem的生成器
+        """
+        where = "AND offset IS NOT NULL" if labelled else ""
+        last = 0
+        count = 0
+        while limit is None or count < limit:
+            size = batch if limit is None else min(batch, limit - count)
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT rowid, {', '.join(CorpusItem.COLS)} FROM corpus WHERE rowid > ? {where} "
+                    "ORDER BY rowid LIMIT ?", (last, size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield CorpusItem(row[1:])
+            last = rows[-1][0]
+            count += len(rows)
+
+    def calibrate(self, *, mode=None, limit=None, tolerance=4):
+        """
+        求解有标注的验证码，拟合像素距离到标注偏移量的换算
+        :param mode: 求解模式，见CaptchaLoader.MODES
+        :param tolerance: 见TrackCalibration.fit
+        :return: TrackCalibration
+        """
+        distances, offsets = [], []
+        for item in self.replay(limit=limit, labelled=True):
+            bx, _, _, piece_x = item.locate(mode=mode)
+            distances.append(bx - piece_x)
+            offsets.append(item.offset)
+        return TrackCalibration.fit(distances, offsets, tolerance=tolerance)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM corpus").fetchone()[0]
+
+    @property
+    def stats(self):
+        with self._lock:
+            count, labelled, images, grays = self._conn.execute("""
+            SELECT COUNT(*), COUNT(offset), COALESCE(SUM(LENGTH(background) + LENGTH(slider)), 0),
+                   COALESCE(SUM(COALESCE(LENGTH(gray), 0) + LENGTH(slider_gray)), 0)
+            FROM corpus
+            """).fetchone()
+        return {"count": count, "labelled": labelled, "image_bytes": images, "gray_bytes": grays}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def http_source(url="http://202.117.17.144:8080/gen", *, timeout=(3.05, 5)):
+    """
+    从/gen接口获取验证码的数据源，所有线程共享一个连接池
+    :return: 无参函数，返回/gen的JSON数据
+    """
+    session = requests.Session()
+
+    def fetch():
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    return fetch
+
+
+def synth_source(seed=0):
+    """
+    本地的合成验证码数据源（见AppFakeServer.synth_captcha），带有正确的偏移量标注
+    :return: 无参函数，返回与/gen格式相同的数据
+    """
+    from .AppFakeServer import synth_captcha
+
+    rng = np.random.default_rng(seed)
+    lock = threading.Lock()
+    counter = iter(range(1 << 62))
+
+    def fetch():
+        with lock:  # Generator不是线程安全的
+            captcha, offset = synth_captcha(rng)
+            num = next(counter)
+        return {"id": f"synth-{seed}-{num}", "captcha": captcha, "offset": offset}
+    return fetch
+
+
+class CaptchaHarvester:
+    def __init__(self, corpus, source, *, workers=4, batch=32):
+        """
+        并发地从数据源获取验证码，按批次写入语料库
+        :param corpus: CaptchaCorpus
+        :param source: 无参函数，返回/gen格式的数据，见http_source、synth_source
+        :param workers: 并发获取的线程数
+        :param batch: 每批写入的数量
+        """
+        self.corpus = corpus
+        self.source = source
+        self.workers = workers
+        self.batch = batch
+
+    def _fetch(self):
+        try:
+            return self.source()
+        except Exception as e:
+            print(f"获取验证码失败！{e}")
+            return None
+
+    def run(self, count):
+        """
+        获取count个验证码
+        :return: 统计结果字典
+        """
+        start = time.perf_counter()
+        fetched = errors = added = 0
+        pending = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="harvester") as executor:
+            futures = [executor.submit(self._fetch) for _ in range(count)]
+            for future in futures:
+                item = future.result()
+                if item is None:
+                    errors += 1
+                    continue
+                fetched += 1
+                pending.append(item)
+                if len(pending) >= self.batch:
+                    added += self.corpus.add_many(pending)
+                    pending = []
+        added += self.corpus.add_many(pending)
+        cost = time.perf_counter() - start
+        return {
+            "fetched": fetched,
+            "added": added,
+            "duplicates": fetched - added,
+            "errors": errors,
+            "seconds": cost,
+            "per_sec": fetched / cost if cost else 0.0,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="验证码语料库")
+    parser.add_argument("--db", default="captchas.db", help="数据库路径")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("harvest", help="从数据源获取验证码")
+    p.add_argument("--source", default="synth", help="synth为本地合成验证码，否则为/gen接口的网址")
+    p.add_argument("--count", type=int, default=100)
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--seed", type=int, default=0, help="synth数据源的随机种子")
+    p.add_argument("--store-gray", action="store_true", help="同时保存背景图的灰度图")
+
+    p = sub.add_parser("import", help="导入旧格式的CaptchaDatabase")
+    p.add_argument("source_db")
+    p.add_argument("--store-gray", action="store_true", help="同时保存背景图的灰度图")
+
+    p = sub.add_parser("calibrate", help="用有标注的验证码拟合滑动距离的换算，保存到数据库")
+    p.add_argument("--mode", default=None, choices=CaptchaLoader.MODES, help="求解模式")
+    p.add_argument("--limit", type=int, default=None, help="最多使用的验证码数量")
+    p.add_argument("--name", default="default", help="保存的名称，见TrackCalibration.load")
+
+    sub.add_parser("stats", help="显示语料库统计")
+
+    args = parser.parse_args(argv)
+    corpus = CaptchaCorpus(args.db, store_gray=getattr(args, "store_gray", False))
+    if args.command == "harvest":
+        source = synth_source(args.seed) if args.source == "synth" else http_source(args.source)
+        print(CaptchaHarvester(corpus, source, workers=args.workers).run(args.count))
+    elif args.command == "import":
+        print(f"导入了{corpus.import_database(args.source_db)}个验证码")
+    elif args.command == "calibrate":
+        calibration = corpus.calibrate(mode=args.mode, limit=args.limit)
+        calibration.save(args.db, args.name)
+        print(calibration.properties)
+    print(corpus.stats)
+    corpus.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import json
+import time
 import sqlite3
 import base64
 import random
@@ -17,6 +18,7 @@ class CaptchaDatabase:
         "sliderImageWidth",
         "sliderImageHeight",
         "data",
+        "offset",
     ]
 
     @staticmethod
@@ -36,16 +38,44 @@ class CaptchaDatabase:
           backgroundImageHeight INTEGER,
           sliderImageWidth INTEGER,
           sliderImageHeight INTEGER,
-          data TEXT
+          data TEXT,
+          offset INTEGER  -- 人工标注的滑块左边缘在背景图中的x坐标（像素），未标注为NULL
         );
         CREATE INDEX IF NOT EXISTS idx_captchas_bg_wh
           ON captchas (backgroundImageWidth, backgroundImageHeight);
         CREATE INDEX IF NOT EXISTS idx_captchas_slider_wh
           ON captchas (sliderImageWidth, sliderImageHeight);
+        CREATE TABLE IF NOT EXISTS solutions (
+          hash TEXT PRIMARY KEY,   -- 背景图和滑块图内容的哈希，见SolveCache.key
+          bx REAL,                 -- 亚像素精度
+          hx REAL,
+          confidence REAL,
+          verified INTEGER,        -- 预订时是否被服务器接受
+          updated TEXT,
+          piece_x REAL,            -- 拼图块在滑块图中的左边缘
+          rejections INTEGER       -- 验证后连续被服务器拒绝的次数
+        );
+        CREATE TABLE IF NOT EXISTS calibration (
+          name TEXT PRIMARY KEY,   -- 见TrackCalibration
+          scale REAL,
+          bias REAL,
+          samples INTEGER,         -- 拟合使用的标注验证码数量
+          updated TEXT
+        );
         """
         conn = sqlite3.connect(db_path)
         try:
             conn.executescript(sql)
+            # 兼容旧版本缺少offset、piece_x、rejections列的数据库
+            cols = [row[1] for row in conn.execute("PRAGMA table_info(captchas)")]
+            if "offset" not in cols:
+                conn.execute("ALTER TABLE captchas ADD COLUMN offset INTEGER")
+                conn.commit()
+            cols = [row[1] for row in conn.execute("PRAGMA table_info(solutions)")]
+            for col, kind in (("piece_x", "REAL"), ("rejections", "INTEGER")):
+                if col not in cols:
+                    conn.execute(f"ALTER TABLE solutions ADD COLUMN {col} {kind}")
+                    conn.commit()
         finally:
             conn.close()
 
@@ -95,6 +125,21 @@ class CaptchaDatabase:
         finally:
             conn.close()
 
+    @staticmethod
+    def set_offset(cid, offset, db_path: str = "captchas.db"):
+        """
+        标注验证码的正确偏移量，供离线测试计算准确率
+        :param cid: 验证码id
+        :param offset: 滑块左边缘在背景图中的x坐标（像素），为None时清除标注
+        """
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                cur = conn.execute("UPDATE captchas SET offset = ? WHERE id = ?", (offset, cid))
+                return cur.rowcount
+        finally:
+            conn.close()
+
     @staticmethod
     def load_many(db_path: str = "captchas.db"):
         conn = sqlite3.connect(db_path)
@@ -112,14 +157,45 @@ class CaptchaDatabase:
             conn.close()
 
 
+class StageTimer:
+    """按阶段累计耗时，timings为None时不做任何记录"""
+
+    def __init__(self, timings=None):
+        self.timings = timings
+        self._last = time.perf_counter() if timings is not None else 0.0
+
+    def lap(self, stage):
+        if self.timings is None:
+            return
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self._last
+        self._last = now
+
+
 class CaptchaLoader:
+    STAGES = ["b64decode", "imdecode", "hsv", "features", "match"]
+    # 求解模式：band只在滑块所在的水平带内先粗后精地搜索；full在整张背景图上穷举搜索；
+    # ensemble在水平带内分别用所有特征图搜索，取置信度最高的结果
+    MODES = ["band", "full", "ensemble"]
+    DEFAULT_MODE = "band"
+    FEATURES = ["raw", "edge", "grad"]
+    DEFAULT_FEATURE = "grad"
+    BAND_PAD = 2  # 水平带上下各扩展的像素
+    COARSE_SCALE = 2  # 粗搜索的缩小倍数
+    REFINE_RADIUS = 4  # 精搜索时在粗结果左右扩展的像素
+
     @staticmethod
-    def _change_to_cv2(img):
-        img = img.split(",")[-1]
-        img_data = base64.b64decode(img)
+    def _decode_base64(img):
+        return base64.b64decode(img.split(",")[-1])
+
+    @staticmethod
+    def _imdecode(img_data):
         np_arr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        return img
+        return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+    @classmethod
+    def _change_to_cv2(cls, img):
+        return cls._imdecode(cls._decode_base64(img))
 
     @staticmethod
     def to_float(gray):
@@ -143,29 +219,157 @@ class CaptchaLoader:
             return cls.to_float(mag)
         raise ValueError("mode must be raw/edge/grad")
 
+    @staticmethod
+    def _peak(res):
+        """
+        相关性曲面的最大值位置，x方向对最大值及其左右两点拟合抛物线，得到亚像素精度的位置
+        :return: x坐标（float）和最大相关性
+        """
+        _, confidence, _, (x, y) = cv2.minMaxLoc(res)
+        if 0 < x < res.shape[1] - 1:
+            left, center, right = float(res[y, x - 1]), float(res[y, x]), float(res[y, x + 1])
+            curvature = left - 2 * center + right
+            if curvature < 0:
+                return x + min(max(0.5 * (left - right) / curvature, -0.5), 0.5), confidence
+        return float(x), confidence
+
     @classmethod
-    def find_slider_pos(cls, captcha_img, slider_img):
-        captcha_img = cls._change_to_cv2(captcha_img)
-        slider_img = cls._change_to_cv2(slider_img)
+    def _match_band(cls, bg, sl, y_min, timer, feature=DEFAULT_FEATURE):
+        """
+        在滑块所在的水平带内搜索：先在缩小的特征图上粗搜索，再在粗结果附近的窄窗口内用原分辨率精搜索
+        :param bg: 背景图的灰度图
+        :param sl: 裁剪后的滑块灰度图
+        :param y_min: 滑块在背景图中的上边缘
+        :param feature: 使用的特征图，见FEATURES
+        :return: 滑块左边缘在背景图中的x坐标（亚像素精度），以及TM_CCOEFF_NORMED的匹配置信度
+        """
+        h, w = sl.shape
+        top = max(int(y_min) - cls.BAND_PAD, 0)
+        bottom = min(int(y_min) + h + cls.BAND_PAD, bg.shape[0])
+        band = cls.features(bg[top:bottom], feature)
+        sl = cls.features(sl, feature)
+        timer.lap("features")
 
-        c_hsv = cv2.cvtColor(captcha_img, cv2.COLOR_BGR2HSV)
-        _, _, bg = cv2.split(c_hsv)
+        scale = cls.COARSE_SCALE
+        if scale > 1 and w // scale >= 4 and h // scale >= 4:
+            band_small = cv2.resize(band, (band.shape[1] // scale, band.shape[0] // scale),
+                                    interpolation=cv2.INTER_AREA)
+            sl_small = cv2.resize(sl, (w // scale, h // scale), interpolation=cv2.INTER_AREA)
+            res = cv2.matchTemplate(band_small, sl_small, method=cv2.TM_CCOEFF_NORMED)
+            _, _, _, (cx, _) = cv2.minMaxLoc(res)
+            radius = cls.REFINE_RADIUS + scale
+            left = max(cx * scale - radius, 0)
+            right = min(cx * scale + radius + w, band.shape[1])
+        else:
+            left, right = 0, band.shape[1]
+
+        res = cv2.matchTemplate(band[:, left:right], sl, method=cv2.TM_CCOEFF_NORMED)
+        x, confidence = cls._peak(res)
+        timer.lap("match")
+        return left + x, confidence
+
+    @classmethod
+    def _match_full(cls, bg, sl, timer, feature=DEFAULT_FEATURE):
+        """
+        在整张背景图上穷举搜索
+        :return: 滑块左边缘在背景图中的x坐标（亚像素精度），以及TM_CCOEFF_NORMED的匹配置信度
+        """
+        bg = cls.features(bg, feature)
+        sl = cls.features(sl, feature)
+        timer.lap("features")
 
-        s_hsv = cv2.cvtColor(slider_img, cv2.COLOR_BGR2HSV)
-        _, _, sl = cv2.split(s_hsv)
+        res = cv2.matchTemplate(bg, sl, method=cv2.TM_CCOEFF_NORMED)
+        x, confidence = cls._peak(res)
+        timer.lap("match")
+        return x, confidence
+
+    @staticmethod
+    def to_gray(img):
+        """取HSV的V通道作为灰度图"""
+        return cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))[2]
+
+    @staticmethod
+    def crop_slider(sl):
+        """
+        裁剪出滑块灰度图中的拼图块
+        :return: 裁剪后的灰度图，以及拼图块在滑块图中的上边缘和左边缘
+        """
         mask = sl > 10
         coords = np.column_stack(np.where(mask))
         y_min, x_min = coords.min(axis=0)
         y_max, x_max = coords.max(axis=0)
-        sl = sl[y_min:y_max + 1, x_min:x_max + 1]
+        return sl[y_min:y_max + 1, x_min:x_max + 1], int(y_min), int(x_min)
+
+    @classmethod
+    def locate_slider(cls, captcha_img, slider_img, *, timings=None, mode=None):
+        """
+        计算滑块在背景图中的位置和匹配置信度
+        :param captcha_img: base64编码的背景图
+        :param slider_img: base64编码的滑块图
+        :param timings: 可选的字典，用于累计各阶段（见STAGES）的耗时（秒）
+        :param mode: 求解模式band/full/ensemble，默认为DEFAULT_MODE
+        :return: (bx, hx, confidence, piece_x)：拼图块左右边缘在背景图中的x坐标（亚像素精度的float），
+                 匹配置信度（-1~1，越大越可信），以及拼图块在滑块图中的左边缘（滑块图需要移动bx - piece_x）
+        """
+        timer = StageTimer(timings)
+        captcha_img = cls._decode_base64(captcha_img)
+        slider_img = cls._decode_base64(slider_img)
+        timer.lap("b64decode")
+        captcha_img = cls._imdecode(captcha_img)
+        slider_img = cls._imdecode(slider_img)
+        timer.lap("imdecode")
 
-        bg = cls.features(bg)
-        sl = cls.features(sl)
+        bg = cls.to_gray(captcha_img)
+        sl, y_min, piece_x = cls.crop_slider(cls.to_gray(slider_img))
+        timer.lap("hsv")
+        bx, hx, confidence = cls.locate_gray(bg, sl, y_min, same_height=slider_img.shape[0] == captcha_img.shape[0],
+                                             timings=timings, mode=mode)
+        return bx, hx, confidence, piece_x
 
-        res = cv2.matchTemplate(bg, sl, method=cv2.TM_CCOEFF_NORMED)
-        minVal, maxVal, minLoc, maxLoc = cv2.minMaxLoc(res)
-        x, y = maxLoc
-        return x, x + sl.shape[1]
+    @classmethod
+    def piece_offset(cls, slider_img):
+        """
+        拼图块在滑块图中的左边缘，用于求解结果中没有piece_x的情况（例如旧版本缓存的结果）
+        :param slider_img: base64编码的滑块图
+        """
+        return cls.crop_slider(cls.to_gray(cls._imdecode(cls._decode_base64(slider_img))))[2]
+
+    @classmethod
+    def locate_gray(cls, bg, sl, y_min, *, same_height=True, timings=None, mode=None):
+        """
+        在已经解码的灰度图上计算滑块的位置，可以直接使用CaptchaCorpus中预先计算的灰度图
+        :param bg: 背景图的灰度图，见to_gray
+        :param sl: 裁剪后的滑块灰度图，见crop_slider
+        :param y_min: 拼图块在滑块图中的上边缘
+        :param same_height: 滑块图与背景图是否等高
+        :return: (bx, hx, confidence)，见locate_slider
+        """
+        mode = mode or cls.DEFAULT_MODE
+        if mode not in cls.MODES:
+            raise ValueError(f"mode must be one of {cls.MODES}")
+        timer = StageTimer(timings)
+        # 滑块图与背景图等高时，滑块在滑块图中的纵向位置就是缺口在背景图中的纵向位置
+        in_band = mode != "full" and same_height
+        features = cls.FEATURES if mode == "ensemble" else [cls.DEFAULT_FEATURE]
+        best = None
+        for feature in features:
+            if in_band:
+                x, confidence = cls._match_band(bg, sl, y_min, timer, feature)
+            else:
+                x, confidence = cls._match_full(bg, sl, timer, feature)
+            if best is None or confidence > best[1]:
+                best = (x, confidence)
+        x, confidence = best
+        return x, x + sl.shape[1], float(confidence)
+
+    @classmethod
+    def find_slider_pos(cls, captcha_img, slider_img, *, timings=None, mode=None):
+        """
+        计算滑块在背景图中的位置，参数见locate_slider
+        :return: 滑块左右边缘在背景图中的x坐标
+        """
+        bx, hx, *_ = cls.locate_slider(captcha_img, slider_img, timings=timings, mode=mode)
+        return bx, hx
 
     @classmethod
     def show_captcha(cls, captcha_img, slider_img):
@@ -173,6 +377,7 @@ class CaptchaLoader:
         captcha_img = cls._change_to_cv2(captcha_img)
 
         h, w = captcha_img.shape[:2]
+        bx, hx = round(bx), round(hx)
         cv2.line(captcha_img, (bx, 0), (bx, h), (0, 0, 255), 2)
         cv2.line(captcha_img, (hx, 0), (hx, h), (0, 0, 255), 2)
         cv2.imshow("Captcha_S", captcha_img)
@@ -181,21 +386,108 @@ class CaptchaLoader:
         cv2.destroyAllWindows()
 
 
+class TrackCalibration:
+    TRACK_WIDTH = 260  # 网页中验证码窗口的宽度，滑动轨迹的x坐标以它为单位
+
+    def __init__(self, scale=1.0, bias=0.0, *, samples=0):
+        """
+        从求解结果到滑动距离的换算：滑动距离 = TRACK_WIDTH / 背景图宽度 * (scale * 像素距离 + bias)
+        像素距离为拼图块在背景图中的左边缘减去它在滑块图中的左边缘（bx - piece_x），即滑块图需要移动的距离，
+        默认不做修正就是正确的；scale和bias是可选的细调，用标注的验证码拟合（见fit），修正匹配的系统误差
+        :param samples: 拟合使用的标注验证码数量
+        """
+        self.scale = scale
+        self.bias = bias
+        self.samples = samples
+
+    def to_track(self, distance, background_width):
+        """
+        :param distance: 像素距离（float）
+        :return: 滑动距离（float），单位为网页中的像素
+        """
+        return self.TRACK_WIDTH / background_width * (self.scale * distance + self.bias)
+
+    @classmethod
+    def fit(cls, distances, offsets, *, tolerance=4):
+        """
+        最小二乘拟合 offset = scale * distance + bias，残差超过tolerance的样本（求解错误）不参与第二次拟合
+        :param distances: 求解结果的像素距离，见to_track
+        :param offsets: 标注的滑块（图）左边缘在背景图中的x坐标，即滑块图需要移动的距离
+        :return: TrackCalibration
+        """
+        distances = np.asarray(distances, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.float64)
+        if len(distances) < 2:
+            raise ValueError("至少需要2个标注的验证码！")
+        keep = np.ones(len(distances), dtype=bool)
+        for _ in range(2):
+            if np.ptp(distances[keep]) > 0:
+                scale, bias = np.polyfit(distances[keep], offsets[keep], 1)
+            else:  # 距离都相同时只能拟合偏移
+                scale, bias = 1.0, float(np.mean(offsets[keep] - distances[keep]))
+            residual = np.abs(scale * distances + bias - offsets)
+            if (residual <= tolerance).sum() < 2:
+                break
+            keep = residual <= tolerance
+        return cls(float(scale), float(bias), samples=int(keep.sum()))
+
+    @classmethod
+    def load(cls, db_path="captchas.db", name="default"):
+        """读取保存在CaptchaDatabase中的换算参数，不存在时返回不做修正的默认值"""
+        CaptchaDatabase.init_db(db_path)
+        conn = sqlite3.connect(db_path)
+        try:
+            row = conn.execute("SELECT scale, bias, samples FROM calibration WHERE name = ?", (name,)).fetchone()
+        finally:
+            conn.close()
+        return cls() if row is None else cls(row[0], row[1], samples=row[2])
+
+    def save(self, db_path="captchas.db", name="default"):
+        CaptchaDatabase.init_db(db_path)
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO calibration (name, scale, bias, samples, updated) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             (name, self.scale, self.bias, self.samples, time.strftime("%Y-%m-%d %H:%M:%S")))
+        finally:
+            conn.close()
+
+    @property
+    def properties(self):
+        return {"scale": self.scale, "bias": self.bias, "samples": self.samples}
+
+
 class CaptchaHandler(object):
-    def __init__(self, captcha_json_data):
+    def __init__(self, captcha_json_data, *, mode=None, position=None, calibration=None):
+        """
+        :param position: 已知的(bx, hx, confidence, piece_x)（例如来自SolveCache），为None时求解验证码；
+                         没有piece_x（或为None）时从滑块图中计算
+        :param calibration: TrackCalibration，为None时不做修正
+        """
         self.background_image_width = captcha_json_data["backgroundImageWidth"]
         self.background_image_height = captcha_json_data["backgroundImageHeight"]
         self.slider_image_width = captcha_json_data["sliderImageWidth"]
         self.slider_image_height = captcha_json_data["sliderImageHeight"]
 
-        self.bx, self.hx = CaptchaLoader.find_slider_pos(captcha_json_data["backgroundImage"],
-                                                             captcha_json_data["sliderImage"])
+        # confidence为匹配置信度，过低时说明结果很可能是错的，不如重新获取验证码
+        if position is None:
+            position = CaptchaLoader.locate_slider(captcha_json_data["backgroundImage"],
+                                                   captcha_json_data["sliderImage"], mode=mode)
+        self.bx, self.hx, self.confidence, *rest = position
+        self.piece_x = rest[0] if rest else None
+        if self.piece_x is None:
+            self.piece_x = CaptchaLoader.piece_offset(captcha_json_data["sliderImage"])
+        self.calibration = calibration or TrackCalibration()
 
-    def get_track(self):
-        center_x = (self.bx + self.hx) // 2
-        distance = center_x - self.slider_image_width // 2
+    @property
+    def distance(self):
+        """滑动距离（float），单位为网页中的像素"""
+        return self.calibration.to_track(self.bx - self.piece_x, self.background_image_width)
 
-        distance = int(260 / self.background_image_width * distance)  # 缩放窗口宽度
+    def get_track(self):
+        # 只在最后取整一次，并且最后一步停在目标位置，不越过
+        distance = round(self.distance)
         track = []
         current_x = 0  # 设置滑动起始位置
         current_v = 0  # 设置初始速度
@@ -219,7 +511,7 @@ class CaptchaHandler(object):
             else:
                 a = random.uniform(-2000, -1500)  # 设置减速阶段加速度
             current_t += sep_time
-            current_x += 1 / 2 * a * (sep_time / 1000) ** 2 + current_v * (sep_time / 1000)
+            current_x = min(current_x + 1 / 2 * a * (sep_time / 1000) ** 2 + current_v * (sep_time / 1000), distance)
             current_v += a * sep_time / 1000
             track.append({"x": int(current_x), "y": 0, "type": "move", "t": current_t})
         track.append({"x": int(current_x), "y": 0, "type": "up", "t": current_t + end_sep_time})
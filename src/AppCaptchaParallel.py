@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .AppCaptchaHandler import CaptchaLoader
+
+
+class CaptchaParallel:
+    @staticmethod
+    def _locate_chunk(backgrounds, sliders, y_mins, same_height, mode):
+        """在一个线程中逐个求解一段验证码"""
+        offsets = np.empty(len(backgrounds))
+        confidences = np.empty(len(backgrounds))
+        for i, (bg, sl, y_min) in enumerate(zip(backgrounds, sliders, y_mins)):
+            offsets[i], _, confidences[i] = CaptchaLoader.locate_gray(bg, sl, int(y_min), same_height=same_height,
+                                                                      mode=mode)
+        return offsets, confidences
+
+    @classmethod
+    def locate(cls, backgrounds, sliders, y_mins, *, same_height=True, mode=None, chunk=64, workers=1):
+        """
+        用线程池并行求解多个验证码，每个验证码仍然单独调用CaptchaLoader.locate_gray，结果与逐个调用相同
+        验证码按chunk分段，每段在线程池的一个线程中逐个求解；cv2在计算时会释放GIL，多核机器上可以并行，
+        实际的加速比用AppBenchmark parallel测量，单核上与逐个调用相同
+        :param backgrounds: 背景灰度图的序列（或(N, H, W)的uint8数组），见CaptchaLoader.to_gray
+        :param sliders: 裁剪后的滑块灰度图的序列，见CaptchaLoader.crop_slider
+        :param y_mins: 拼图块在滑块图中的上边缘
+        :param same_height: 滑块图与背景图是否等高
+        :param mode: 求解模式，见CaptchaLoader.MODES
+        :param chunk: 每个线程任务求解的验证码数量
+        :param workers: 并行求解的线程数
+        :return: (拼图块左边缘的x坐标（亚像素精度）, 匹配置信度)，均为(N,)的数组
+        """
+        mode = mode or CaptchaLoader.DEFAULT_MODE
+        if mode not in CaptchaLoader.MODES:
+            raise ValueError(f"mode must be one of {CaptchaLoader.MODES}")
+        if len(backgrounds) != len(sliders) or len(backgrounds) != len(y_mins):
+            raise ValueError("backgrounds, sliders and y_mins must have the same length")
+        chunk = max(int(chunk), 1)
+        bounds = [(i, min(i + chunk, len(backgrounds))) for i in range(0, len(backgrounds), chunk)]
+
+        def run(bound):
+            start, end = bound
+            return cls._locate_chunk(backgrounds[start:end], sliders[start:end], y_mins[start:end], same_height,
+                                     mode)
+
+        if workers > 1 and len(bounds) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(run, bounds))
+        else:
+            results = [run(bound) for bound in bounds]
+        if not results:
+            return np.zeros(0), np.zeros(0)
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
@@ -0,0 +1,159 @@
+import time
+import threading
+from collections import deque
+
+
+class CaptchaEntry:
+    __slots__ = ("captcha_id", "track_list", "created")
+
+    def __init__(self, captcha_id, track_list, created):
+        self.captcha_id = captcha_id
+        self.track_list = track_list
+        self.created = created
+
+
+class CaptchaPool:
+    def __init__(self, fetcher, *, size=2, max_age=50.0, clock=time.monotonic):
+        """
+        预先获取并求解的验证码池，预订时直接取用，省去获取和求解验证码的时间
+        :param fetcher: 无参函数，获取并求解一个验证码，返回(captcha_id, track_list)
+        :param size: 池中保持的验证码数量，也是池的上限，超出时丢弃最早的验证码
+        :param max_age: 验证码的最大有效时长（秒），超过后丢弃
+        :param clock: 时钟函数，默认为time.monotonic
+        """
+        self.fetcher = fetcher
+        self.size = size
+        self.max_age = max_age
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.fetched = 0
+        self.errors = 0
+        self.dropped = 0  # 池满时被丢弃的验证码数量
+        self.rejected = 0  # 求解队列已满被拒绝的次数
+
+    def _purge(self):
+        """丢弃过期的验证码，需要持有锁"""
+        now = self._clock()
+        while self._entries and now - self._entries[0].created >= self.max_age:
+            self._entries.popleft()
+            self.expired += 1
+
+    def take(self):
+        """
+        取出一个未过期的验证码
+        :return: CaptchaEntry，池为空时返回None
+        """
+        with self._lock:
+            self._purge()
+            if self._entries:
+                self.hits += 1
+                entry = self._entries.popleft()
+            else:
+                self.misses += 1
+                entry = None
+        self._wakeup.set()  # 通知后台线程补充
+        return entry
+
+    def put(self, captcha_id, track_list):
+        """放入一个验证码，池中已有size个时丢弃最早的（最先过期的）"""
+        with self._lock:
+            while self._entries and len(self._entries) >= self.size:
+                self._entries.popleft()
+                self.dropped += 1
+            self._entries.append(CaptchaEntry(captcha_id, track_list, self._clock()))
+
+    def _fetch_one(self):
+        try:
+            captcha_id, track_list = self.fetcher()
+        except RuntimeError as e:  # 求解队列已满（预取的优先级最低），稍后再预取
+            with self._lock:
+                self.rejected += 1
+            print(f"预取验证码被拒绝！{e}")
+            return False
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"预取验证码失败！{e}")
+            return False
+        with self._lock:
+            self.fetched += 1
+        self.put(captcha_id, track_list)
+        return True
+
+    def fill(self, count=None):
+        """
+        同步地把验证码池补充到size个（或补充count个）
+        :return: 成功补充的数量
+        """
+        if count is None:
+            with self._lock:
+                self._purge()
+                count = max(self.size - len(self._entries), 0)
+        added = 0
+        for _ in range(count):
+            if not self._fetch_one():
+                break
+            added += 1
+        return added
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def start(self):
+        """启动后台线程，持续保持池中有size个未过期的验证码"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+        self._wakeup.set()
+
+    def _run(self):
+        # stop之后立即start时旧线程可能还在获取验证码，它在下一轮循环时发现已被新线程替换而退出
+        while self._running and self._thread is threading.current_thread():
+            with self._lock:
+                self._purge()
+                missing = self.size - len(self._entries)
+                oldest = self._entries[0].created if self._entries else None
+            if missing > 0:
+                if not self._fetch_one():
+                    self._wakeup.wait(1)  # 获取失败时稍后重试
+                    self._wakeup.clear()
+                continue
+            # 池已满，等待有验证码被取走或最早的验证码过期
+            timeout = self.max_age - (self._clock() - oldest) if oldest is not None else None
+            self._wakeup.wait(max(timeout, 0) if timeout is not None else None)
+            self._wakeup.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "fetched": self.fetched,
+                "errors": self.errors,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+            }
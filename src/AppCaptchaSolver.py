@@ -0,0 +1,210 @@
+import time
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from .AppCaptchaHandler import CaptchaHandler, CaptchaLoader
+from .AppTransport import LatencyHistogram
+
+
+def locate_slider(captcha_json_data, mode=None):
+    """
+    求解一个验证码，定义在模块级别以便在子进程中执行
+    :return: (bx, hx, confidence, piece_x)，见CaptchaLoader.locate_slider
+    """
+    return CaptchaLoader.locate_slider(captcha_json_data["backgroundImage"], captcha_json_data["sliderImage"],
+                                       mode=mode)
+
+
+class CaptchaSolver:
+    # 任务优先级，数值越小越先求解
+    ORDER = 0  # 定时预订任务，开抢时刻的每一毫秒都很重要
+    MONITOR = 1  # 监听任务发现可预约场次后的预订
+    PREFETCH = 2  # 验证码池的后台预取
+    PRIORITIES = {ORDER: "order", MONITOR: "monitor", PREFETCH: "prefetch"}
+    SUBMIT_TIMEOUT = 5.0  # 队列满时非ORDER任务默认最多等待的时长（秒）
+
+    def __init__(self, workers=2, *, kind="thread", max_queue=16, mode=None, min_confidence=None, cache=None,
+                 calibration=None, submit_timeout=SUBMIT_TIMEOUT):
+        """
+        验证码求解的专用执行器，求解的CPU开销不再占用调度器和Flask的线程
+        排队的任务按优先级求解，队列有上限：队列满时ORDER任务仍然可以入队，其余任务等待或被拒绝
+        :param workers: 同时求解的数量
+        :param kind: thread在本进程的线程中求解，process在子进程中求解（不受GIL限制）
+        :param max_queue: 排队任务数的上限
+        :param mode: 求解模式，见CaptchaLoader.MODES
+        :param min_confidence: 匹配置信度低于该值的结果视为不可信（见confident），为None时总是可信
+        :param cache: SolveCache，命中已验证的结果时不需要排队求解
+        :param calibration: TrackCalibration，生成滑动轨迹时的距离换算，为None时不做修正
+        :param submit_timeout: 队列满时非ORDER任务默认最多等待的时长（秒），超时后被拒绝
+        """
+        if kind not in ("thread", "process"):
+            raise ValueError("kind must be thread/process")
+        self.workers = workers
+        self.kind = kind
+        self.max_queue = max_queue
+        self.mode = mode
+        self.min_confidence = min_confidence
+        self.cache = cache
+        self.calibration = calibration
+        self.submit_timeout = submit_timeout
+        self._tickets = OrderedDict()  # 验证码id -> SolveCache的key，用于report
+
+        self._cond = threading.Condition()
+        self._queue = []  # 堆，元素为(优先级, 序号, 入队时间, 验证码数据, Future)
+        self._seq = itertools.count()
+        self._running = True
+        self._processes = ProcessPoolExecutor(max_workers=workers) if kind == "process" else None
+        # process模式下每个线程把任务转交给子进程并等待结果，仍然由线程按优先级从队列中取任务
+        self._threads = [threading.Thread(target=self._run, name=f"captcha-solver-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.low_confidence = 0
+        self.max_depth = 0
+        self.busy = 0
+        self.wait_latency = {name: LatencyHistogram() for name in self.PRIORITIES.values()}
+        self.solve_latency = LatencyHistogram()
+
+    def submit(self, captcha_json_data, *, priority=MONITOR, timeout=None):
+        """
+        提交一个验证码
+        :param priority: ORDER、MONITOR或PREFETCH
+        :param timeout: 队列满时最多等待的时长（秒），为None时使用submit_timeout，为0时不等待（ORDER任务不等待）
+        :return: Future，结果为(bx, hx, confidence, piece_x)
+        :raise RuntimeError: 等待超时后队列仍然是满的，或求解器已停止
+        """
+        future = Future()
+        if timeout is None:
+            timeout = self.submit_timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while priority != self.ORDER and len(self._queue) >= self.max_queue and self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.rejected += 1
+                    raise RuntimeError("验证码求解队列已满！")
+                self._cond.wait(remaining)
+            if not self._running:
+                raise RuntimeError("验证码求解器已停止！")
+            heapq.heappush(self._queue, (priority, next(self._seq), time.perf_counter(), captcha_json_data, future))
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._cond.notify_all()
+        return future
+
+    def solve(self, captcha_json_data, *, priority=MONITOR, timeout=None, ticket=None):
+        """
+        求解验证码并生成滑动轨迹，配置了cache时先查询缓存
+        :param timeout: 队列满时最多等待的时长（秒），见submit
+        :raise RuntimeError: 见submit
+        :param ticket: 验证码id，之后用report告知预订结果，确认后的结果才会被缓存命中
+        :return: 滑动轨迹track_list和匹配置信度
+        """
+        key = position = None
+        if self.cache is not None:
+            key = self.cache.key(captcha_json_data)
+            if (position := self.cache.get(key)) is not None:
+                bx, hx, _, piece_x = position
+                position = (bx, hx, 1.0, piece_x)  # 已被服务器接受过，视为完全可信
+        if position is None:
+            position = self.submit(captcha_json_data, priority=priority, timeout=timeout).result()
+            if key is not None:
+                self.cache.put(key, *position)
+        if key is not None and ticket is not None:
+            with self._cond:
+                self._tickets[ticket] = key
+                while len(self._tickets) > 1024:
+                    self._tickets.popitem(last=False)
+        handler = CaptchaHandler(captcha_json_data, position=position, calibration=self.calibration)
+        return handler.get_track(), handler.confidence
+
+    def report(self, ticket, accepted):
+        """
+        告知验证码的预订结果
+        :param ticket: solve时传入的验证码id
+        :param accepted: 服务器是否接受了该验证码
+        """
+        with self._cond:
+            key = self._tickets.pop(ticket, None)
+        if key is not None:
+            self.cache.verify(key, accepted)
+
+    def confident(self, confidence):
+        """判断求解结果是否可信，不可信时应重新获取验证码而不是提交一个大概率错误的结果"""
+        if self.min_confidence is None or confidence >= self.min_confidence:
+            return True
+        with self._cond:
+            self.low_confidence += 1
+        return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and self._running:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                priority, _, queued, captcha_json_data, future = heapq.heappop(self._queue)
+                self.busy += 1
+                self._cond.notify_all()  # 通知等待入队的任务
+            start = time.perf_counter()
+            self.wait_latency[self.PRIORITIES[priority]].record((start - queued) * 1000)
+            try:
+                if self._processes is not None:
+                    result = self._processes.submit(locate_slider, captcha_json_data, self.mode).result()
+                else:
+                    result = locate_slider(captcha_json_data, self.mode)
+            except Exception as e:
+                self.solve_latency.record((time.perf_counter() - start) * 1000, type(e).__name__)
+                with self._cond:
+                    self.failed += 1
+                    self.busy -= 1
+                future.set_exception(e)
+                continue
+            self.solve_latency.record((time.perf_counter() - start) * 1000)
+            with self._cond:
+                self.completed += 1
+                self.busy -= 1
+            future.set_result(result)
+
+    def shutdown(self):
+        """停止求解，队列中尚未开始的任务会以异常结束"""
+        with self._cond:
+            self._running = False
+            pending, self._queue = self._queue, []
+            self._cond.notify_all()
+        for *_, future in pending:
+            future.set_exception(RuntimeError("验证码求解器已停止！"))
+        if self._processes is not None:
+            self._processes.shutdown(wait=False)
+
+    @property
+    def stats(self):
+        with self._cond:
+            counters = {
+                "kind": self.kind,
+                "workers": self.workers,
+                "depth": len(self._queue),
+                "max_depth": self.max_depth,
+                "busy": self.busy,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "low_confidence": self.low_confidence,
+            }
+        return {
+            **counters,
+            "wait": {name: h.snapshot() for name, h in self.wait_latency.items()},
+            "solve": self.solve_latency.snapshot(),
+            "cache": self.cache.stats if self.cache is not None else None,
+            "calibration": self.calibration.properties if self.calibration is not None else None,
+        }
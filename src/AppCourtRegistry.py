@@ -0,0 +1,93 @@
+class _Snapshot:
+    """场馆目录的一次不可变快照，刷新时整体替换"""
+    __slots__ = ("courts", "by_id", "properties", "haystacks", "grams")
+
+    def __init__(self, courts, gram_size):
+        self.courts = list(courts)
+        self.by_id = {}
+        self.properties = {}
+        self.haystacks = []  # 与courts一一对应的(小写名称, 小写备注)
+        self.grams = {}  # n-gram -> 包含它的场馆在courts中的位置集合
+
+        for pos, court in enumerate(self.courts):
+            props = court.properties
+            self.by_id.setdefault(str(court.id), court)
+            self.properties.setdefault(str(court.id), props)
+            texts = ((props.get("name") or "").lower(), (props.get("memo") or "").lower())
+            self.haystacks.append(texts)
+            for text in texts:
+                for n in range(1, gram_size + 1):
+                    for i in range(len(text) - n + 1):
+                        self.grams.setdefault(text[i:i + n], set()).add(pos)
+
+
+class CourtRegistry:
+    def __init__(self, courts=None, *, gram_size=2):
+        """
+        场馆目录，提供按id的O(1)查找、缓存的properties字典和预先建立的搜索索引
+        :param courts: CourtProperties列表
+        :param gram_size: 搜索索引的n-gram最大长度
+        """
+        self.gram_size = gram_size
+        self._snapshot = _Snapshot(courts or [], gram_size)
+
+    def replace(self, courts):
+        """
+        用新的场馆列表整体替换目录，读取方始终看到完整的新快照或旧快照
+        :param courts: CourtProperties列表，为None时保持原目录不变
+        :return: 是否替换成功
+        """
+        if courts is None:
+            return False
+        self._snapshot = _Snapshot(courts, self.gram_size)
+        return True
+
+    def get(self, court_id):
+        """按id获取场馆对象，不存在时返回None"""
+        return self._snapshot.by_id.get(str(court_id))
+
+    def get_properties(self, court_id):
+        """按id获取场馆的properties字典，不存在时返回None"""
+        return self._snapshot.properties.get(str(court_id))
+
+    @property
+    def properties(self):
+        snapshot = self._snapshot
+        return [snapshot.properties[str(c.id)] for c in snapshot.courts]
+
+    def search(self, q):
+        """
+        按名称或备注搜索场馆（不区分大小写）
+        :param q: 关键字，为空时返回所有场馆
+        :return: 匹配的场馆properties列表，保持目录中的顺序
+        """
+        snapshot = self._snapshot
+        q = (q or "").strip().lower()
+        if not q:
+            return self.properties
+
+        n = min(len(q), self.gram_size)
+        candidates = None
+        for i in range(len(q) - n + 1):
+            positions = snapshot.grams.get(q[i:i + n])
+            if not positions:
+                return []
+            candidates = set(positions) if candidates is None else candidates & positions
+            if not candidates:
+                return []
+
+        result = []
+        for pos in sorted(candidates):
+            name, memo = snapshot.haystacks[pos]
+            if q in name or q in memo:
+                result.append(snapshot.properties[str(snapshot.courts[pos].id)])
+        return result
+
+    def __iter__(self):
+        return iter(self._snapshot.courts)
+
+    def __len__(self):
+        return len(self._snapshot.courts)
+
+    def __contains__(self, court_id):
+        return str(court_id) in self._snapshot.by_id
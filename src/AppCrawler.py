@@ -1,7 +1,9 @@
 import enum
 import re
+import hmac
 import base64
 import json
+from functools import partial
 from datetime import timezone, timedelta, datetime
 from json import JSONDecodeError
 
@@ -12,8 +14,14 @@ from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 from flask import flash
 
-from .AppDataBase import CourtProperties, FieldProperties, OrderProperties
-from .AppCaptchaHandler import CaptchaHandler
+from .AppDataBase import CourtProperties, FieldTable, OrderProperties
+from .AppCaptchaHandler import StageTimer
+from .AppFieldCache import FieldCache
+from .AppCourtRegistry import CourtRegistry
+from .AppCaptchaPool import CaptchaPool
+from .AppCaptchaSolver import CaptchaSolver
+from .AppTransport import HttpTransport
+from .AppCredentialCache import CredentialCache
 
 
 
@@ -30,6 +38,8 @@ class BaseUrl(enum.Enum):
     VALID_URL = "https://login.xjtu.edu.cn/attest/api/guard/securephone/valid"
     # 进行登录验证的网址
     LOGIN_URL = "https://login.xjtu.edu.cn/token/password/passwordLogin"
+    # 使用refresh_token换取新的id_token的网址（尚未确认，只在AppCrawler的use_refresh_token为True时使用）
+    REFRESH_URL = "https://login.xjtu.edu.cn/token/refreshToken"
     # 跳转到场馆预定应用的网址
     JUMP_URL = "http://org.xjtu.edu.cn/openplatform/oauth/authorize"
     # 获取不同场馆数据的网址
@@ -44,22 +54,70 @@ class BaseUrl(enum.Enum):
     PAY_URL = "http://202.117.17.144:8080/web/order/tobook.html"
 
 
-class AppCrawler:
-    def __init__(self, username: str, password: str, encrypt_password=True):
-        self.session = requests.Session()
+# 各接口的(连接超时, 读取超时)，单位为秒，未列出的接口使用HttpTransport的默认超时
+ENDPOINT_TIMEOUTS = {
+    BaseUrl.PUBLIC_KEY_URL.name: (3.05, 5),
+    BaseUrl.MFA_URL.name: (3.05, 10),
+    BaseUrl.LOGIN_URL.name: (3.05, 10),
+    BaseUrl.REFRESH_URL.name: (3.05, 5),
+    BaseUrl.JUMP_URL.name: (3.05, 10),
+    BaseUrl.PLACE_URL.name: (3.05, 10),
+    BaseUrl.FIELD_URL.name: (3.05, 5),
+    BaseUrl.LOCKED_FIELD_URL.name: (3.05, 5),
+    BaseUrl.CAPTCHA_URL.name: (3.05, 5),
+    BaseUrl.PAY_URL.name: (3.05, 10),
+}
 
-        self.public_key = self.get_public_key()
 
+class AppCrawler:
+    def __init__(self, username: str, password: str, encrypt_password=True, *, field_cache=None,
+                 captcha_pool_size=2, captcha_max_age=50.0, timeouts=None, pool_maxsize=16, base_url=None,
+                 credential_cache=None, captcha_solver=None, captcha_refetch=2, use_refresh_token=False):
+        # 所有线程共享的HTTP连接池，timeouts可以覆盖ENDPOINT_TIMEOUTS中各接口的超时
+        # base_url不为None时所有接口都发往该地址（例如本地的AppFakeServer）
+        self.transport = HttpTransport(timeouts={**ENDPOINT_TIMEOUTS, **(timeouts or {})}, pool_maxsize=pool_maxsize,
+                                       base_url=base_url)
+        self.session = self.transport.session
+        self.field_cache = field_cache if field_cache is not None else FieldCache()  # 场次数据的共享缓存
+        # 求解验证码的专用执行器，多账号时由SchedulerPool传入共享的CaptchaSolver
+        self.captcha_solver = captcha_solver if captcha_solver is not None else CaptchaSolver()
+        self.captcha_refetch = captcha_refetch  # 求解结果置信度过低时最多重新获取验证码的次数
+        # 预先获取并求解的验证码池，需要调用captcha_pool.start()或fill()后才会开始获取
+        self.captcha_pool = CaptchaPool(partial(self.get_captcha_result, priority=CaptchaSolver.PREFETCH),
+                                        size=captcha_pool_size, max_age=captcha_max_age)
+
+        # 公钥和加密后的用户名、密码只在完整登录时才需要，第一次使用时再获取
+        self._public_key = None
         self.raw_username = username
-        self.username = self.encrypt_with_rsa(username)
-        if encrypt_password:
-            self.password = self.encrypt_with_rsa(password)
-        else:
-            self.password = password
+        self._username = None
+        self._raw_password = password if encrypt_password else None
+        self._password = None if encrypt_password else password
+        self._password_hash = None  # 通过认证的明文密码的哈希，见check_password
         self.deviceId = "YSmx0xA4NGYDALXeG11BophG"  # TODO: 考虑随机生成
 
         self.id_token = None
         self._refresh_token = None
+        # REFRESH_URL尚未确认，默认不使用，id_token过期时完整登录
+        self.use_refresh_token = use_refresh_token
+        self.credential_cache = credential_cache  # CredentialCache，为None时不缓存登录凭证
+
+    @property
+    def public_key(self):
+        if self._public_key is None:
+            self._public_key = self.get_public_key()
+        return self._public_key
+
+    @property
+    def username(self):
+        if self._username is None:
+            self._username = self.encrypt_with_rsa(self.raw_username)
+        return self._username
+
+    @property
+    def password(self):
+        if self._password is None:
+            self._password = self.encrypt_with_rsa(self._raw_password)
+        return self._password
 
     def get_public_key(self):
         """
@@ -67,7 +125,7 @@ class AppCrawler:
         :return: 公钥
         """
         try:
-            response = self.session.get(BaseUrl.PUBLIC_KEY_URL.value)
+            response = self.transport.get(BaseUrl.PUBLIC_KEY_URL)
         except RequestException as e:
             print("移动交大APP公钥请求失败！")
             raise e
@@ -97,7 +155,7 @@ class AppCrawler:
         :return: MFA验证码
         """
         try:
-            response = self.session.post(BaseUrl.MFA_URL.value, params={
+            response = self.transport.post(BaseUrl.MFA_URL, params={
                 "username": self.username,
                 "password": self.password,
                 "deviceId": self.deviceId
@@ -116,10 +174,10 @@ class AppCrawler:
 
     def get_secure_phone(self, mfa_state):
         try:
-            response = self.session.get(BaseUrl.STATE_URL.value, params={"state": mfa_state})
+            response = self.transport.get(BaseUrl.STATE_URL, params={"state": mfa_state})
             gid = response.json().get("data", {}).get("gid", None)
             phone = response.json().get("data", {}).get("securePhone", None)
-            response = self.session.post(BaseUrl.SEND_URL.value, json={"gid": gid})
+            response = self.transport.post(BaseUrl.SEND_URL, json={"gid": gid})
             if response.json().get("code") != 0:
                 raise ValueError("发送手机验证码失败！")
             return gid, phone
@@ -139,20 +197,20 @@ class AppCrawler:
             gid, phone = self.get_secure_phone(mfa_state)
             phone_code = input(f"请输入手机({phone})验证码: ")
             try:
-                response = self.session.post(BaseUrl.VALID_URL.value, json={"code": phone_code, "gid": gid})
+                response = self.transport.post(BaseUrl.VALID_URL, json={"code": phone_code, "gid": gid})
             except Exception as e:
                 print("验证码验证失败！")
                 flash("验证码验证失败！", "error")
                 raise e
 
         try:
-            response = self.session.post(BaseUrl.LOGIN_URL.value, params={
+            response = self.transport.post(BaseUrl.LOGIN_URL, params={
                 "username": self.username,
                 "password": self.password,
                 "deviceId": self.deviceId,
                 "appId": "com.supwisdom.xjtu",
                 "mfaState": mfa_state
-            }, timeout=10)
+            })
         except requests.exceptions.Timeout as e:
             print("登录超时！请检查网络连接！")
             raise e
@@ -181,14 +239,113 @@ class AppCrawler:
         try:
             # 获取id_token
             self.id_token = response.json()["data"]["idToken"]
-            # TODO: 此处refresh_token用于当id_token失效时向服务器请求新的id_token，请求逻辑有待更新
+            # refresh_token用于当id_token失效时向服务器请求新的id_token，见refresh_id_token
             self._refresh_token = response.json()["data"]["refreshToken"]
         except (JSONDecodeError, AttributeError) as e:
             print("解析登录返回信息失败！")
             raise e
+        # 记录通过认证的密码，之后只有提交相同的密码才能使用缓存的凭证
+        if self._raw_password is not None:
+            self._password_hash = CredentialCache.hash_password(self._raw_password)
+        self.save_credentials(verifier={"password_hash": self._password_hash, "encrypted_password": self.password})
         return self
 
-    def jump_to_app(self):
+    def check_password(self, password, encrypt_password=True):
+        """
+        判断提交的密码是否与通过认证的密码一致
+        :param password: 明文密码，encrypt_password为False时为加密后的密码（例如users.json中保存的）
+        :return: 无法判断（例如只用加密后的密码登录过）时返回False
+        """
+        if encrypt_password:
+            return CredentialCache.check_password(self._password_hash, password)
+        return self._password is not None and hmac.compare_digest(self._password.encode(), password.encode())
+
+    def refresh_id_token(self):
+        """
+        使用refresh_token换取新的id_token，不需要密码和MFA验证
+        :return: 是否刷新成功，未启用use_refresh_token时总是False
+        """
+        if not self.use_refresh_token or self._refresh_token is None:
+            return False
+        try:
+            response = self.transport.post(BaseUrl.REFRESH_URL, params={
+                "refreshToken": self._refresh_token,
+                "deviceId": self.deviceId,
+                "appId": "com.supwisdom.xjtu",
+            })
+            if response.status_code != 200:
+                print(f"刷新登录凭证失败！[{response.status_code}]")
+                return False
+            data = response.json()["data"]
+            self.id_token = data["idToken"]
+            self._refresh_token = data.get("refreshToken") or self._refresh_token
+        except (RequestException, JSONDecodeError, KeyError, TypeError) as e:
+            print(f"刷新登录凭证失败！{e}")
+            return False
+        print(f"用户{self.raw_username}的登录凭证已刷新")
+        self.save_credentials()
+        return True
+
+    def save_credentials(self, *, verifier=None):
+        """
+        把id_token、refresh_token和当前的cookies写入凭证缓存
+        :param verifier: 见CredentialCache.save，为None时保留原来的密码校验信息
+        """
+        if self.credential_cache is None or self.id_token is None:
+            return
+        cookies = [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+                   for c in self.session.cookies]
+        self.credential_cache.save(self.raw_username, id_token=self.id_token, refresh_token=self._refresh_token,
+                                   cookies=cookies, verifier=verifier)
+
+    def restore_credentials(self):
+        """
+        从凭证缓存中恢复id_token、refresh_token和cookies，提交的密码与缓存凭证时通过认证的密码不一致时不恢复
+        :return: 是否恢复了缓存的凭证
+        """
+        if self.credential_cache is None:
+            return False
+        cached = self.credential_cache.load(self.raw_username)
+        if not cached or not cached.get("id_token"):
+            return False
+        encrypted = cached.get("encrypted_password")
+        if self._raw_password is not None:
+            matched = CredentialCache.check_password(cached.get("password_hash"), self._raw_password)
+        else:
+            matched = bool(encrypted) and hmac.compare_digest(encrypted.encode(), self._password.encode())
+        if not matched:
+            print(f"用户{self.raw_username}提交的密码与缓存的登录凭证不一致，需要重新登录")
+            return False
+        # 沿用通过认证的加密密码（写入users.json），不需要再获取公钥加密
+        self._password = encrypted
+        self._password_hash = cached.get("password_hash")
+        self.id_token = cached["id_token"]
+        self._refresh_token = cached.get("refresh_token")
+        for c in cached.get("cookies") or []:
+            self.session.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path") or "/")
+        return True
+
+    def authenticate(self):
+        """
+        建立可用的会话：优先使用缓存的凭证（必要时用refresh_token刷新），都失败时才完整登录（可能需要MFA验证）
+        缓存的凭证只有在跳转后check_session确认SESSION可用时才算恢复成功
+        :return: 使用的方式，"cached"或"login"
+        """
+        if self.restore_credentials():
+            try:
+                self.jump_to_app()
+                if not self.check_session():
+                    raise ValueError("跳转后的SESSION不可用")
+                print(f"用户{self.raw_username}已使用缓存的登录凭证恢复会话")
+                return "cached"
+            except (ValueError, RequestException) as e:
+                print(f"缓存的登录凭证已失效，重新登录！{e}")
+                self.credential_cache.clear(self.raw_username)
+        self.login()
+        self.jump_to_app()
+        return "login"
+
+    def jump_to_app(self, *, _retry=True):
         """
         自动跳转至体育场馆预约界面，在此过程中自动获取服务器set的SESSION等cookies
         :return: None
@@ -211,18 +368,41 @@ class AppCrawler:
         }
 
         try:
-            self.session.get(BaseUrl.JUMP_URL.value,
-                             headers=headers, params=params,
-                             allow_redirects=True, timeout=10)  # 允许自动跳转
+            response = self.transport.get(BaseUrl.JUMP_URL,
+                                          headers=headers, params=params,
+                                          allow_redirects=True)  # 允许自动跳转
         except RequestException as e:
             print("跳转到体育场馆预约应用失败！")
             raise e
+        if response.status_code == 401:
+            # id_token过期，用refresh_token换取新的id_token后再跳转一次
+            if not _retry or not self.refresh_id_token():
+                print("登录凭证已失效，请重新登录！")
+                raise ValueError("登录凭证已失效，请重新登录！")
+            return self.jump_to_app(_retry=False)
+        if response.status_code >= 400:
+            print(f"跳转到体育场馆预约应用失败！[{response.status_code}]")
+            raise ValueError(f"跳转到体育场馆预约应用失败！[{response.status_code}]")
+        self.save_credentials()  # 保存新的SESSION
         return self
 
+    def check_session(self):
+        """
+        用一次需要登录的轻量请求（只取一个场馆）确认SESSION可用
+        过期的SESSION可能返回跳转到统一认证的登录页、200的HTML页面或5xx，只有返回场馆列表才算可用
+        :return: SESSION是否可用
+        """
+        params = {"page": 1, "rows": 1, "merccode": 100001, "remark": "defaultProList"}
+        try:
+            response = self.transport.get(BaseUrl.PLACE_URL, params=params, allow_redirects=False)
+            return response.status_code == 200 and isinstance(response.json(), list)
+        except (RequestException, JSONDecodeError):
+            return False
+
     def get_courts(self):
         """
         获取所有体育场馆的数据信息
-        :return: 场馆数据对象
+        :return: 场馆目录CourtRegistry
         """
         params = {
             "page": 1,
@@ -231,35 +411,45 @@ class AppCrawler:
             "remark": "defaultProList"
         }
         try:
-            response = self.session.get(BaseUrl.PLACE_URL.value, params=params, timeout=10)
+            response = self.transport.get(BaseUrl.PLACE_URL, params=params)
         except RequestException as e:
             print("获取场馆信息失败！")
             return None
         try:
             places = response.json()
-            return [CourtProperties(i) for i in places]
+            return CourtRegistry([CourtProperties(i) for i in places])
         except JSONDecodeError as e:  # TODO: 此处异常处理逻辑有待完善
             print("获取场馆信息失败！可能是由于当前时间系统未开放（开放时间：08:40-21:40）")
             return None
 
-    def get_fields(self, date, court_id):
+    def get_fields(self, date, court_id, *, use_cache=True, max_age=None, allow_stale=True):
         """
         获取id为field_id的场馆中的日期为date的所有场次
         :param date: 日期，格式为YYYY-MM-DD
         :param court_id: 场次的id
-        :return: None
+        :param use_cache: 是否使用共享缓存，并发的相同请求只会访问一次服务器
+        :param max_age: 可接受的缓存数据最大时长（秒），默认为缓存的ttl
+        :param allow_stale: 缓存超过max_age时是否先返回旧数据（同时在后台刷新）
+        :return: 场次表FieldTable，获取失败时返回None
         """
         pattern = r'^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])$'
         if not bool(re.match(pattern, str(date))):
             print("日期格式错误！应为YYYY-MM-DD")
             raise ValueError("日期格式错误！应为YYYY-MM-DD")
 
+        if not use_cache:
+            return self._fetch_fields(date, court_id)
+        key = FieldCache.make_key(date, court_id)
+        return self.field_cache.get(key, partial(self._fetch_fields, date, court_id), max_age=max_age,
+                                    allow_stale=allow_stale)
+
+    def _fetch_fields(self, date, court_id):
         params = {
             "s_date": date,  # 根据日期获取球场场次预约数据
             "serviceid": court_id
         }
         try:
-            response = self.session.get(BaseUrl.FIELD_URL.value, params=params, timeout=10)
+            response = self.transport.get(BaseUrl.FIELD_URL, params=params)
         except RequestException as e:
             print(f"获取{date}时间{court_id}场馆的场次信息失败！")
             return None
@@ -268,32 +458,56 @@ class AppCrawler:
             objects = field_data.get("object")
             if objects is None:
                 return None
-            return [FieldProperties(i) for i in objects]
+            return FieldTable.from_objects(objects)
         except JSONDecodeError as e:
             print(f"获取{date}时间{court_id}场馆的场次信息失败！")
             return None
 
-    def get_captcha_result(self):
+    def get_captcha_result(self, *, timings=None, priority=CaptchaSolver.MONITOR):
         """
         获取验证码
-        :return: 验证码id和验证码背景图片，滑块图片
+        :param timings: 可选的字典，用于累计获取验证码（captcha_fetch）和求解（captcha_solve，包括排队）的耗时（秒）
+        :param priority: 在CaptchaSolver中排队的优先级
+        :return: 验证码id和滑动轨迹，置信度过低时重新获取验证码，重试captcha_refetch次后仍然过低则返回最后一个
         """
-        response = self.session.get(BaseUrl.CAPTCHA_URL.value)
-        try:
-            captcha_result = response.json()
-        except JSONDecodeError as e:
-            print("获取验证码失败！")
-            raise e
-        captcha_id = captcha_result["id"]
-        h = CaptchaHandler(captcha_result["captcha"])
-        track_list = h.get_track()
+        timer = StageTimer(timings)
+        for attempt in range(self.captcha_refetch + 1):
+            response = self.transport.get(BaseUrl.CAPTCHA_URL)
+            try:
+                captcha_result = response.json()
+            except JSONDecodeError as e:
+                print("获取验证码失败！")
+                raise e
+            timer.lap("captcha_fetch")
+            captcha_id = captcha_result["id"]
+            track_list, confidence = self.captcha_solver.solve(captcha_result["captcha"], priority=priority,
+                                                               ticket=captcha_id)
+            timer.lap("captcha_solve")
+            if self.captcha_solver.confident(confidence):
+                break
+            if attempt < self.captcha_refetch:
+                print(f"验证码求解置信度过低（{confidence:.2f}），重新获取验证码")
         return captcha_id, track_list
 
-    def pay_field(self, court_id, field_id, stock_id):
-        try:
-            captcha_id, track_list = self.get_captcha_result()
-        except:
-            return None, "100"
+    def pay_field(self, court_id, field_id, stock_id, *, timings=None, priority=CaptchaSolver.MONITOR):
+        """
+        预定场次
+        :param timings: 可选的字典，用于累计获取验证码、求解验证码和预订请求（book）的耗时（秒）
+        :param priority: 验证码池为空时，现场求解验证码的优先级
+        :return: 订单和状态码，'1'成功，'100'验证码错误，'0'预订失败，'-1'需要重新获取SESSION
+        :raise RuntimeError: 现场求解验证码时CaptchaSolver拒绝了任务，见CaptchaSolver.submit
+        """
+        entry = self.captcha_pool.take()  # 优先使用预先求解的验证码
+        if entry is not None:
+            captcha_id, track_list = entry.captcha_id, entry.track_list
+        else:
+            try:
+                captcha_id, track_list = self.get_captcha_result(timings=timings, priority=priority)
+            except RuntimeError:
+                raise  # 求解队列已满或求解器已停止，重试也无法很快求解，由调用者放弃本次预订
+            except:
+                return None, "100"
+        timer = StageTimer(timings)
         start_time = datetime.now(timezone.utc)
         slide_duration = track_list[-1]["t"] / 1000
         end_time = start_time + timedelta(seconds=slide_duration)
@@ -327,7 +541,8 @@ class AppCrawler:
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
         }
         try:
-            response = self.session.post(BaseUrl.PAY_URL.value, data=data, headers=headers)
+            response = self.transport.post(BaseUrl.PAY_URL, data=data, headers=headers)
+            timer.lap("book")
         except RequestException as e:
             print(f"预定场馆{court_id}-场地{field_id}-场次{stock_id}失败！message[未知网络请求问题]")
             return None, None
@@ -336,8 +551,13 @@ class AppCrawler:
             result_id = result.get("result")
             message = result.get("message")
             objects = result.get("object")
+            if result_id in ('1', '100'):
+                # 只有'1'能确认验证码被接受，'100'表示验证码错误，据此确认或删除缓存的求解结果；
+                # '0'不一定说明验证码正确（例如场次已被预订），不作为依据
+                self.captcha_solver.report(captcha_id, result_id == '1')
             if result_id == '1':
                 print(f"预定场馆{court_id}-场地{field_id}-场次{stock_id}成功！message[{message}]")
+                self.field_cache.invalidate(court_id=court_id)  # 场次状态已改变
                 result_info = objects.get("order", {})
                 return OrderProperties(result_info), '1'
             elif result_id == '100':
@@ -346,6 +566,7 @@ class AppCrawler:
             elif result_id == '0':
                 print(f"预定场馆{court_id}-场地{field_id}-场次{stock_id}失败！message[{message}]")
                 if message == "未支付":  # 未支付也算预定成功
+                    self.field_cache.invalidate(court_id=court_id)
                     return None, "1"
                 return None, '0'  # 各种原因，例如已被预订，不在预订时间内
             elif result_id is None:
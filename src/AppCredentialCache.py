@@ -0,0 +1,86 @@
+import os
+import hmac
+import json
+import hashlib
+import secrets
+import threading
+from datetime import datetime
+
+
+class CredentialCache:
+    def __init__(self, path="data/credentials.json"):
+        """
+        登录凭证的本地缓存，保存每个用户的id_token、refresh_token和会话cookies
+        程序重启后可以直接用缓存的凭证恢复会话，不需要重新登录（以及MFA验证）
+        :param path: 缓存文件路径，文件权限为仅当前用户可读写
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def hash_password(password):
+        """加盐的PBKDF2哈希，格式为 盐$哈希"""
+        salt = secrets.token_hex(16)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), 100_000).hex()
+        return salt + "$" + digest
+
+    @staticmethod
+    def check_password(password_hash, password):
+        """
+        :param password_hash: hash_password的结果，为None时总是返回False
+        """
+        if not password_hash or password is None:
+            return False
+        salt, digest = password_hash.split("$", 1)
+        actual = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), 100_000).hex()
+        return hmac.compare_digest(actual, digest)
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, data):
+        tmp = self.path + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            json.dump(data, file, indent=2)
+        os.replace(tmp, self.path)  # 原子替换，写入中途退出不会损坏原文件
+
+    def load(self, username):
+        """
+        :return: {"id_token", "refresh_token", "cookies", "password_hash", "encrypted_password", "saved_at"}，
+                 不存在时返回None
+        """
+        with self._lock:
+            return self._read().get(username)
+
+    def save(self, username, *, id_token, refresh_token, cookies, verifier=None):
+        """
+        :param cookies: [{"name", "value", "domain", "path"}]
+        :param verifier: 完整登录成功时使用的密码的校验信息{"password_hash", "encrypted_password"}，
+                         只有提交的密码与之一致时才能使用缓存的凭证；为None时保留原来的校验信息
+        """
+        with self._lock:
+            data = self._read()
+            previous = data.get(username) or {}
+            if verifier is None:
+                verifier = {"password_hash": previous.get("password_hash"),
+                            "encrypted_password": previous.get("encrypted_password")}
+            data[username] = {
+                "id_token": id_token,
+                "refresh_token": refresh_token,
+                "cookies": cookies,
+                "password_hash": verifier.get("password_hash"),
+                "encrypted_password": verifier.get("encrypted_password"),
+                "saved_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            self._write(data)
+
+    def clear(self, username):
+        with self._lock:
+            data = self._read()
+            if data.pop(username, None) is not None:
+                self._write(data)
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class BaseProperty:
     def __init__(self, name, describe="", *, value_type=None):
         self.name = name
@@ -122,6 +125,126 @@ class FieldProperties:
         return result_dict
 
 
+def _to_int(value, default=-1):
+    """静默地把上游返回的数字或数字字符串转换为int，无法转换时返回default"""
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return default
+
+
+class FieldRecord:
+    """FieldTable中的一行，属性名与FieldProperties一致"""
+    __slots__ = ("id", "name", "sname", "status", "stockid", "s_date", "time_no", "price")
+
+    def __init__(self, id, name, sname, status, stockid, s_date, time_no, price):
+        self.id = id
+        self.name = name
+        self.sname = sname
+        self.status = status
+        self.stockid = stockid
+        self.s_date = s_date
+        self.time_no = time_no
+        self.price = price
+
+    @property
+    def properties(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class FieldTable:
+    """
+    场次数据的列式存储：数值列为numpy数组，sname/time_no/s_date/name为去重后的编码
+    可以用向量化的掩码进行筛选，例如table[table.status == 1]
+    缺失的数值以-1表示
+    """
+
+    def __init__(self, ids, stockids, status, price, name_codes, sname_codes, time_codes, date_codes,
+                 names, snames, times, dates):
+        self.ids = ids
+        self.stockids = stockids
+        self.status = status
+        self.price = price
+        self.name_codes = name_codes
+        self.sname_codes = sname_codes
+        self.time_codes = time_codes
+        self.date_codes = date_codes
+
+        # 编码对应的取值
+        self.names = names
+        self.snames = snames
+        self.times = times
+        self.dates = dates
+
+    @classmethod
+    def empty(cls):
+        return cls.from_objects([])
+
+    @classmethod
+    def from_objects(cls, objects):
+        """
+        一次遍历findOkArea返回的object列表，构建列式场次表
+        :param objects: 场次字典列表
+        :return: FieldTable
+        """
+        n = len(objects)
+        ids = np.empty(n, dtype=np.int64)
+        stockids = np.empty(n, dtype=np.int64)
+        status = np.empty(n, dtype=np.int16)
+        price = np.empty(n, dtype=np.int64)
+        name_codes = np.empty(n, dtype=np.int32)
+        sname_codes = np.empty(n, dtype=np.int32)
+        time_codes = np.empty(n, dtype=np.int32)
+        date_codes = np.empty(n, dtype=np.int32)
+
+        tables = ({}, {}, {}, {})  # name, sname, time_no, s_date -> code
+        name_index, sname_index, time_index, date_index = tables
+        for i, obj in enumerate(objects):
+            stock = obj.get("stock") or {}
+            ids[i] = _to_int(obj.get("id"))
+            stockids[i] = _to_int(obj.get("stockid"))
+            status[i] = _to_int(obj.get("status"))
+            price[i] = _to_int(stock.get("price"))
+            name_codes[i] = name_index.setdefault(obj.get("name"), len(name_index))
+            sname_codes[i] = sname_index.setdefault(obj.get("sname"), len(sname_index))
+            time_codes[i] = time_index.setdefault(stock.get("time_no"), len(time_index))
+            date_codes[i] = date_index.setdefault(stock.get("s_date"), len(date_index))
+
+        values = [[None if v is None else str(v) for v in index] for index in tables]
+        return cls(ids, stockids, status, price, name_codes, sname_codes, time_codes, date_codes, *values)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.record(int(item))
+        # 布尔掩码、下标数组或切片，返回共享编码表的子表
+        return self.__class__(self.ids[item], self.stockids[item], self.status[item], self.price[item],
+                              self.name_codes[item], self.sname_codes[item], self.time_codes[item],
+                              self.date_codes[item], self.names, self.snames, self.times, self.dates)
+
+    def record(self, i):
+        return FieldRecord(int(self.ids[i]), self.names[self.name_codes[i]], self.snames[self.sname_codes[i]],
+                           int(self.status[i]), int(self.stockids[i]), self.dates[self.date_codes[i]],
+                           self.times[self.time_codes[i]], int(self.price[i]))
+
+    def __iter__(self):
+        columns = (self.ids.tolist(), self.name_codes.tolist(), self.sname_codes.tolist(), self.status.tolist(),
+                   self.stockids.tolist(), self.date_codes.tolist(), self.time_codes.tolist(), self.price.tolist())
+        for i, nc, sc, st, sid, dc, tc, pr in zip(*columns):
+            yield FieldRecord(i, self.names[nc], self.snames[sc], st, sid, self.dates[dc], self.times[tc], pr)
+
+    @property
+    def properties(self):
+        return [r.properties for r in self]
+
+
 class OrderProperties:
     orderid = BaseProperty("orderid", "", value_type=str)
     userid = BaseProperty("userid", "", value_type=str)
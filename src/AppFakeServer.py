@@ -0,0 +1,479 @@
+import json
+import time
+import uuid
+import base64
+import random
+import argparse
+import threading
+
+import numpy as np
+import cv2
+from flask import Flask, request, jsonify, make_response, redirect
+from werkzeug.serving import make_server, WSGIRequestHandler
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives import serialization
+
+from .AppCaptchaHandler import CaptchaDatabase
+from .AppCaptchaCorpus import CaptchaCorpus
+
+
+def synth_captcha(rng, width=590, height=360, piece=70, margin=(0, 0)):
+    """
+    生成一张合成的滑块验证码，滑块图为拼图块本身（宽度等于拼图块宽度，高度与背景图相同）
+    :param margin: 滑块图在拼图块左右两侧留出的空白列数，模拟拼图块不在滑块图左边缘（也不居中）的验证码
+    :return: 与/gen返回的captcha字段格式相同的字典，以及滑块左边缘在背景图中的x坐标
+    """
+    small = rng.integers(0, 255, (height // 20, width // 20, 3), dtype=np.uint8)
+    bg = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(30):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = [int(v) for v in rng.integers(0, 255, 3)]
+        cv2.circle(bg, center, int(rng.integers(5, 40)), color, -1)
+
+    # 拼图块形状：方块加上方的凸起，右侧的凹陷
+    mask = np.zeros((piece, piece), np.uint8)
+    cv2.rectangle(mask, (8, 8), (piece - 9, piece - 9), 255, -1)
+    cv2.circle(mask, (piece // 2, 8), 8, 255, -1)
+    cv2.circle(mask, (piece - 9, piece // 2), 8, 0, -1)
+    edge = cv2.morphologyEx(mask, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8)) > 0
+    shape = (mask > 0) | edge
+    cols = np.where(shape.any(axis=0))[0]
+    x0, x1 = int(cols.min()), int(cols.max()) + 1
+
+    x = int(rng.integers(piece + 20, width - piece - 5))
+    y = int(rng.integers(10, height - piece - 10))
+    content = bg[y:y + piece, x:x + piece].copy()
+    content[edge] = 255
+
+    left, right = margin
+    slider = np.zeros((height, left + x1 - x0 + right, 3), np.uint8)
+    region = slider[y:y + piece, left:left + x1 - x0]
+    region[shape[:, x0:x1]] = np.maximum(content[:, x0:x1][shape[:, x0:x1]], 20)
+    hole = bg[y:y + piece, x:x + piece]
+    hole[mask > 0] = (hole[mask > 0] * 0.4 + 150).astype(np.uint8)
+    hole[edge] = 255
+
+    captcha = {
+        "backgroundImage": "data:image/jpeg;base64," + base64.b64encode(cv2.imencode(".jpg", bg)[1]).decode(),
+        "sliderImage": "data:image/png;base64," + base64.b64encode(cv2.imencode(".png", slider)[1]).decode(),
+        "backgroundImageWidth": width,
+        "backgroundImageHeight": height,
+        "sliderImageWidth": slider.shape[1],
+        "sliderImageHeight": height,
+        "data": None,
+    }
+    return captcha, x + x0 - left
+
+
+class FakeConfig:
+    def __init__(self, *, latency=0.0, jitter=0.0, latencies=None, failure_rate=0.0, failure_rates=None,
+                 num_courts=3, num_fields=6, open_hour=8, close_hour=22, slot_minutes=60, days=3,
+                 available_ratio=0.3, release_rate=0.0, contention=0.0, advancenum=2,
+                 captcha_db=None, num_synth_captchas=16, captcha_tolerance=6, captcha_pass_rate=1.0,
+                 need_mfa=False, accounts=None, token_ttl=None, unpaid_rate=0.0, seed=0):
+        """
+        模拟服务器的配置
+        :param latency: 所有接口的基础延迟（秒）
+        :param jitter: 延迟的随机波动（秒）
+        :param latencies: 接口名 -> 延迟（秒），接口名与BaseUrl的成员名相同，覆盖latency
+        :param failure_rate: 所有接口返回HTTP 500的概率
+        :param failure_rates: 接口名 -> 失败概率，覆盖failure_rate
+        :param num_courts: 场馆数量
+        :param num_fields: 每个场馆的场地数量
+        :param available_ratio: 初始可预约场次的比例
+        :param release_rate: 每次查询场次时随机释放一个已占用场次的概率（模拟退订）
+        :param contention: 预订时场次已被他人抢走的概率（模拟竞争）
+        :param advancenum: 每个账号在每个场馆每天最多预订的场次数量
+        :param captcha_db: 提供验证码的CaptchaCorpus或CaptchaDatabase路径，为None时使用合成的验证码
+        :param captcha_tolerance: 验证码允许的误差（按260像素宽度换算）
+        :param captcha_pass_rate: 未标注偏移量的验证码的通过概率
+        :param need_mfa: 登录时是否需要手机验证码
+        :param accounts: 用户名 -> 密码，为None时接受任意账号
+        :param token_ttl: idToken的有效时长（秒），过期后跳转返回401，需要用refreshToken刷新；为None时不过期
+        :param unpaid_rate: 预订成功时返回result为'0'、message为"未支付"（不返回订单）的概率
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.latencies = dict(latencies or {})
+        self.failure_rate = failure_rate
+        self.failure_rates = dict(failure_rates or {})
+        self.num_courts = num_courts
+        self.num_fields = num_fields
+        self.open_hour = open_hour
+        self.close_hour = close_hour
+        self.slot_minutes = slot_minutes
+        self.days = days
+        self.available_ratio = available_ratio
+        self.release_rate = release_rate
+        self.contention = contention
+        self.advancenum = advancenum
+        self.captcha_db = captcha_db
+        self.num_synth_captchas = num_synth_captchas
+        self.captcha_tolerance = captcha_tolerance
+        self.captcha_pass_rate = captcha_pass_rate
+        self.need_mfa = need_mfa
+        self.accounts = accounts
+        self.token_ttl = token_ttl
+        self.unpaid_rate = unpaid_rate
+        self.seed = seed
+
+
+class FakeBackend:
+    def __init__(self, config=None):
+        self.config = config or FakeConfig()
+        self.rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.public_pem = self.private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+
+        self.courts = [{
+            "id": str(100 + i),
+            "name": f"模拟场馆{i + 1}",
+            "address": "本地",
+            "memo": "AppFakeServer",
+            "image": None,
+            "advanceday": self.config.days - 1,
+            "advancenum": self.config.advancenum,
+            "status": 1,
+            "expirydate": "10",
+        } for i in range(self.config.num_courts)]
+        self.fields = {}  # (s_date, court_id) -> 场次列表
+        self.tokens = {}  # id_token -> (用户名, 签发时间)
+        self.refresh_tokens = {}  # refresh_token -> 用户名，使用一次后作废
+        self.sessions = {}  # SESSION -> 用户名
+        self.bookings = {}  # (用户名, court_id, s_date) -> 预订数量
+        self.issued = {}  # captcha_id -> 标注的偏移量和背景图宽度
+        self.captchas = self._load_captchas()
+        self.counters = {}  # 接口名 -> 请求次数
+
+    def _load_captchas(self):
+        captchas = []
+        if self.config.captcha_db:
+            # 优先使用CaptchaCorpus，没有语料时读取旧格式的captchas表
+            corpus = CaptchaCorpus(self.config.captcha_db)
+            captchas = [(item.to_captcha(), item.offset) for item in corpus.replay()]
+            corpus.close()
+        if self.config.captcha_db and not captchas:
+            for row in CaptchaDatabase.load_many(self.config.captcha_db):
+                captcha = {col: row[col] for col in CaptchaDatabase.CAPTCHA_COLS if col in row.keys()}
+                captchas.append((captcha, captcha.pop("offset", None)))
+        if not captchas:
+            np_rng = np.random.default_rng(self.config.seed)
+            captchas = [synth_captcha(np_rng) for _ in range(self.config.num_synth_captchas)]
+        return captchas
+
+    def _times(self):
+        minutes = self.config.open_hour * 60
+        while minutes + self.config.slot_minutes <= self.config.close_hour * 60:
+            end = minutes + self.config.slot_minutes
+            yield f"{minutes // 60:02d}:{minutes % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+            minutes = end
+
+    def get_fields(self, s_date, court_id):
+        """返回(s_date, court_id)的场次列表，首次访问时生成，需要持有锁"""
+        key = (s_date, court_id)
+        if key not in self.fields:
+            fields = []
+            for t, time_no in enumerate(self._times()):
+                for n in range(1, self.config.num_fields + 1):
+                    fields.append({
+                        "id": int(court_id) * 1000 + n,
+                        "name": str(n),
+                        "sname": f"场地{n}",
+                        "status": 1 if self.rng.random() < self.config.available_ratio else 2,
+                        "stockid": (len(self.fields) + 1) * 100000 + t * 100 + n,
+                        "stock": {"s_date": s_date, "time_no": time_no, "price": 20},
+                    })
+            self.fields[key] = fields
+        return self.fields[key]
+
+    def find_stock(self, stock_id):
+        for fields in self.fields.values():
+            for f in fields:
+                if str(f["stockid"]) == str(stock_id):
+                    return f
+        return None
+
+    def decrypt(self, value):
+        if not value or not value.startswith("__RSA__"):
+            return value
+        data = base64.b64decode(value[len("__RSA__"):])
+        return self.private_key.decrypt(data, padding.PKCS1v15()).decode("utf-8")
+
+    def issue_tokens(self, username):
+        """签发新的idToken和refreshToken"""
+        id_token, refresh_token = uuid.uuid4().hex, uuid.uuid4().hex
+        with self._lock:
+            self.tokens[id_token] = (username, time.time())
+            self.refresh_tokens[refresh_token] = username
+        return {"idToken": id_token, "refreshToken": refresh_token}
+
+    def issue_captcha(self):
+        captcha, offset = self.rng.choice(self.captchas)
+        captcha_id = uuid.uuid4().hex
+        with self._lock:
+            self.issued[captcha_id] = (offset, captcha.get("backgroundImageWidth") or 260)
+        return captcha_id, captcha
+
+    def verify_captcha(self, captcha_id, track_list):
+        with self._lock:
+            issued = self.issued.pop(captcha_id, None)  # 每个验证码只能使用一次
+        if issued is None or not track_list:
+            return False
+        offset, width = issued
+        if offset is None:
+            return self.rng.random() < self.config.captcha_pass_rate
+        expected = offset * 260 / width
+        return abs(track_list[-1]["x"] - expected) <= self.config.captcha_tolerance
+
+
+def create_app(backend=None):
+    """
+    创建模拟服务器的Flask应用，接口路径与BaseUrl中的路径一致
+    :param backend: FakeBackend，为None时使用默认配置
+    """
+    backend = backend or FakeBackend()
+    config = backend.config
+    fake = Flask(__name__)
+    fake.config["backend"] = backend
+
+    def simulate(name):
+        """按配置注入延迟和失败，返回None表示继续处理"""
+        with backend._lock:
+            backend.counters[name] = backend.counters.get(name, 0) + 1
+            delay = config.latencies.get(name, config.latency)
+            if config.jitter:
+                delay = max(delay + backend.rng.uniform(-config.jitter, config.jitter), 0)
+            failed = backend.rng.random() < config.failure_rates.get(name, config.failure_rate)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return make_response("injected failure", 500)
+        return None
+
+    def current_user():
+        return backend.sessions.get(request.cookies.get("SESSION"))
+
+    @fake.get("/token/jwt/publicKey")
+    def public_key():
+        return simulate("PUBLIC_KEY_URL") or make_response(backend.public_pem)
+
+    @fake.post("/token/mfa/detect")
+    def mfa_detect():
+        return simulate("MFA_URL") or jsonify({"code": 0, "data": {"state": uuid.uuid4().hex,
+                                                                     "need": config.need_mfa}})
+
+    @fake.get("/token/mfa/initByType/securephone")
+    def mfa_state():
+        return simulate("STATE_URL") or jsonify({"code": 0, "data": {"gid": uuid.uuid4().hex,
+                                                                       "securePhone": "138****0000"}})
+
+    @fake.post("/attest/api/guard/securephone/send")
+    def mfa_send():
+        return simulate("SEND_URL") or jsonify({"code": 0})
+
+    @fake.post("/attest/api/guard/securephone/valid")
+    def mfa_valid():
+        return simulate("VALID_URL") or jsonify({"code": 0})
+
+    @fake.post("/token/password/passwordLogin")
+    def password_login():
+        if (failure := simulate("LOGIN_URL")) is not None:
+            return failure
+        username = backend.decrypt(request.args.get("username"))
+        password = backend.decrypt(request.args.get("password"))
+        if config.accounts is not None and config.accounts.get(username) != password:
+            return jsonify({"code": 401, "message": "用户名或密码错误"}), 401
+        return jsonify({"code": 0, "data": backend.issue_tokens(username)})
+
+    @fake.post("/token/refreshToken")
+    def refresh_token():
+        if (failure := simulate("REFRESH_URL")) is not None:
+            return failure
+        with backend._lock:
+            username = backend.refresh_tokens.pop(request.args.get("refreshToken"), None)
+        if username is None:
+            return jsonify({"code": 401, "message": "refreshToken无效"}), 401
+        return jsonify({"code": 0, "data": backend.issue_tokens(username)})
+
+    @fake.get("/openplatform/oauth/authorize")
+    def oauth_jump():
+        if (failure := simulate("JUMP_URL")) is not None:
+            return failure
+        username, issued = backend.tokens.get(request.headers.get("x-id-token"), (None, None))
+        if username is None or (config.token_ttl is not None and time.time() - issued > config.token_ttl):
+            return jsonify({"code": 401, "message": "idToken无效"}), 401
+        session_id = uuid.uuid4().hex
+        with backend._lock:
+            backend.sessions[session_id] = username
+        response = make_response("ok")
+        response.set_cookie("SESSION", session_id)
+        return response
+
+    @fake.get("/web/product/productData.html")
+    def product_data():
+        if (failure := simulate("PLACE_URL")) is not None:
+            return failure
+        if current_user() is None:  # 与真实服务器一样，SESSION无效时跳转到统一认证的登录页
+            return redirect("/cas/login")
+        return jsonify(backend.courts)
+
+    @fake.get("/web/product/findOkArea.html")
+    def find_ok_area():
+        if (failure := simulate("FIELD_URL")) is not None:
+            return failure
+        s_date = request.args.get("s_date")
+        court_id = request.args.get("serviceid")
+        with backend._lock:
+            fields = backend.get_fields(s_date, court_id)
+            occupied = [f for f in fields if f["status"] == 2]
+            if occupied and backend.rng.random() < config.release_rate:
+                backend.rng.choice(occupied)["status"] = 1
+            payload = json.loads(json.dumps(fields))
+        return jsonify({"object": payload})
+
+    @fake.get("/web/product/findLockArea.html")
+    def find_lock_area():
+        return simulate("LOCKED_FIELD_URL") or jsonify({"object": []})
+
+    @fake.get("/gen")
+    def gen_captcha():
+        if (failure := simulate("CAPTCHA_URL")) is not None:
+            return failure
+        captcha_id, captcha = backend.issue_captcha()
+        return jsonify({"id": captcha_id, "captcha": captcha})
+
+    @fake.post("/web/order/tobook.html")
+    def to_book():
+        if (failure := simulate("PAY_URL")) is not None:
+            return failure
+        username = current_user()
+        if username is None:
+            return jsonify({"message": "请先登录"})
+        try:
+            param = json.loads(request.form.get("param") or "{}")
+            yzm = request.form.get("yzm") or ""
+            track = json.loads(yzm[:yzm.rindex("}") + 1])
+            captcha_id = yzm[yzm.rindex("}") + 1:].split("synjones")[1]
+            (stock_id, field_id), = param["stockdetail"].items()
+            court_id = str(param.get("address"))
+        except (ValueError, KeyError, IndexError):
+            return jsonify({"result": "0", "message": "参数错误"})
+
+        if not backend.verify_captcha(captcha_id, track.get("trackList")):
+            return jsonify({"result": "100", "message": "验证码错误"})
+
+        with backend._lock:
+            field = backend.find_stock(stock_id)
+            if field is None:
+                return jsonify({"result": "0", "message": "场次不存在"})
+            s_date = field["stock"]["s_date"]
+            key = (username, court_id, s_date)
+            if backend.bookings.get(key, 0) >= config.advancenum:
+                return jsonify({"result": "0", "message": "超过最大预订数量"})
+            if field["status"] == 1 and backend.rng.random() < config.contention:
+                field["status"] = 2  # 被他人抢先预订
+            if field["status"] != 1:
+                return jsonify({"result": "0", "message": "该场次已被预订"})
+            field["status"] = 2
+            backend.bookings[key] = backend.bookings.get(key, 0) + 1
+            unpaid = backend.rng.random() < config.unpaid_rate
+        if unpaid:
+            return jsonify({"result": "0", "message": "未支付"})
+        order = {"orderid": uuid.uuid4().hex[:16], "userid": username, "status": 1}
+        return jsonify({"result": "1", "message": "预订成功", "object": {"order": order}})
+
+    return fake
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class BackgroundServer:
+    def __init__(self, app, *, host="127.0.0.1", port=0, quiet=True):
+        """
+        在后台线程中运行的WSGI服务器，port为0时自动选择可用端口
+        :param app: WSGI应用，例如Flask应用
+        :param quiet: 是否关闭每个请求的访问日志
+        """
+        self.app = app
+        self._server = make_server(host, port, app, threaded=True,
+                                   request_handler=_QuietHandler if quiet else WSGIRequestHandler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self._server.host}:{self._server.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class FakeServer(BackgroundServer):
+    def __init__(self, config=None, *, host="127.0.0.1", port=0, quiet=True):
+        """在后台线程中运行的模拟服务器"""
+        self.backend = FakeBackend(config)
+        super(FakeServer, self).__init__(create_app(self.backend), host=host, port=port, quiet=quiet)
+
+    def open_fields(self, s_date, court_id, count):
+        """
+        把(s_date, court_id)的场次重置为只有count个可预约，并清空所有账号的预订记录
+        :return: 可预约场次的(field_id, stock_id)列表
+        """
+        backend = self.backend
+        with backend._lock:
+            fields = backend.get_fields(s_date, court_id)
+            for f in fields:
+                f["status"] = 2
+            opened = backend.rng.sample(fields, min(count, len(fields)))
+            for f in opened:
+                f["status"] = 1
+            backend.bookings.clear()
+            return [(f["id"], f["stockid"]) for f in opened]
+
+
+def main(argv=None):
+    # 启动后设置环境变量COURT_BASE_URL=http://127.0.0.1:5001运行app.py，即可让整个应用连接模拟服务器
+    parser = argparse.ArgumentParser(description="本地模拟的场馆预约服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency", type=float, default=0.0, help="所有接口的基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机波动（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="接口返回HTTP 500的概率")
+    parser.add_argument("--courts", type=int, default=3, help="场馆数量")
+    parser.add_argument("--fields", type=int, default=6, help="每个场馆的场地数量")
+    parser.add_argument("--available", type=float, default=0.3, help="初始可预约场次的比例")
+    parser.add_argument("--release-rate", type=float, default=0.0, help="每次查询时释放一个场次的概率")
+    parser.add_argument("--contention", type=float, default=0.0, help="预订时场次已被抢走的概率")
+    parser.add_argument("--captcha-db", default=None, help="提供验证码的CaptchaDatabase路径")
+    parser.add_argument("--need-mfa", action="store_true", help="登录时需要手机验证码")
+    args = parser.parse_args(argv)
+
+    config = FakeConfig(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                        num_courts=args.courts, num_fields=args.fields, available_ratio=args.available,
+                        release_rate=args.release_rate, contention=args.contention,
+                        captcha_db=args.captcha_db, need_mfa=args.need_mfa)
+    create_app(FakeBackend(config)).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import time
+import threading
+
+
+class _Entry:
+    __slots__ = ("value", "created")
+
+    def __init__(self, value, created):
+        self.value = value
+        self.created = created
+
+
+class _Flight:
+    """同一个key正在进行中的上游请求，其余调用者等待其结果"""
+    __slots__ = ("event", "value", "generation")
+
+    def __init__(self, generation):
+        self.event = threading.Event()
+        self.value = None
+        self.generation = generation  # 发起请求时该key的缓存版本，期间若该key被清除则不写入结果
+
+
+class FieldCache:
+    def __init__(self, ttl=5.0, stale_ttl=60.0, *, clock=time.monotonic):
+        """
+        findOkArea场次数据的共享缓存，以(date, court_id)为key
+        :param ttl: 数据新鲜的时长（秒），在此时间内直接返回缓存
+        :param stale_ttl: 过期后仍可返回旧数据的时长（秒），返回旧数据的同时在后台重新获取，
+                          超过ttl + stale_ttl的条目不会再被返回，定期从缓存中删除
+        :param clock: 时钟函数，默认为time.monotonic
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> _Entry
+        self._flights = {}  # key -> _Flight
+        self._generations = {}  # key -> 缓存版本，invalidate时只增加被清除的key的版本
+        self._next_sweep = clock() + ttl + stale_ttl  # 下次清理过期条目的时间
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @staticmethod
+    def make_key(date, court_id):
+        return str(date), str(court_id)
+
+    def get(self, key, loader, *, max_age=None, allow_stale=True):
+        """
+        获取key对应的数据，缓存缺失时调用loader，并发的调用只会触发一次loader
+        :param key: (date, court_id)
+        :param loader: 无参函数，返回上游数据，失败时返回None
+        :param max_age: 调用者可接受的最大数据时长（秒），默认为ttl
+        :param allow_stale: 数据超过max_age时是否先返回旧数据，为False时同步等待新数据
+        :return: 场次数据，获取失败时返回None
+        """
+        ttl = self.ttl if max_age is None else max_age
+        with self._lock:
+            self._sweep()
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = self._clock() - entry.created
+                if age < ttl:
+                    self.hits += 1
+                    return entry.value
+                if allow_stale and age < ttl + self.stale_ttl:
+                    # 返回旧数据，同时在后台重新获取
+                    self.stale_hits += 1
+                    if key not in self._flights:
+                        self._flights[key] = _Flight(self._generations.get(key, 0))
+                        threading.Thread(target=self._load, args=(key, loader), daemon=True).start()
+                    return entry.value
+
+            self.misses += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight(self._generations.get(key, 0))
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            return self._load(key, loader)
+        flight.event.wait()
+        return flight.value
+
+    def _load(self, key, loader):
+        value = None
+        try:
+            value = loader()
+        finally:
+            with self._lock:
+                flight = self._flights.pop(key, None)
+                # 版本只用于判断进行中的请求，请求结束后不再需要（同一个key同时只有一个请求）
+                generation = self._generations.pop(key, 0)
+                if value is None:
+                    if (entry := self._entries.get(key)) is not None:
+                        value = entry.value  # 上游请求失败时沿用旧数据
+                elif flight is not None and flight.generation == generation:
+                    self._entries[key] = _Entry(value, self._clock())
+            if flight is not None:
+                flight.value = value
+                flight.event.set()
+        return value
+
+    def _sweep(self):
+        """
+        删除超过ttl + stale_ttl的条目（正在重新获取的除外，请求失败时仍沿用旧数据），需要持有锁
+        每ttl + stale_ttl最多执行一次，均摊到每次get是O(1)的
+        """
+        now = self._clock()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.ttl + self.stale_ttl
+        expire = now - self.ttl - self.stale_ttl
+        keys = [k for k, e in self._entries.items() if e.created <= expire and k not in self._flights]
+        for k in keys:
+            del self._entries[k]
+        self.evicted += len(keys)
+
+    def peek(self, key):
+        """返回当前缓存的数据（不触发请求），不存在时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry.value
+
+    def invalidate(self, *, date=None, court_id=None):
+        """
+        使缓存失效，不指定参数时清空所有缓存
+        :param date: 只清除该日期的缓存
+        :param court_id: 只清除该场馆的缓存
+        :return: 被清除的条目数量
+        """
+        date = None if date is None else str(date)
+        court_id = None if court_id is None else str(court_id)
+        with self._lock:
+            def match(k):
+                return (date is None or k[0] == date) and (court_id is None or k[1] == court_id)
+
+            keys = [k for k in self._entries if match(k)]
+            for k in keys:
+                del self._entries[k]
+            # 只有被清除的key上进行中的请求的结果作废，其他场馆和日期的请求不受影响
+            for k in self._flights:
+                if match(k):
+                    self._generations[k] = self._generations.get(k, 0) + 1
+        return len(keys)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,122 @@
+import threading
+
+
+class TaskEntry:
+    __slots__ = ("id", "key", "kind", "court_id", "date", "field_id", "stock_id", "num", "status", "handle")
+
+    def __init__(self, id, key, kind):
+        self.id = id
+        self.key = key
+        self.kind = kind  # order或monitor
+        self.court_id = None
+        self.date = None
+        self.field_id = None
+        self.stock_id = None
+        self.num = None
+        self.status = None
+        self.handle = None  # 定时预订任务为APScheduler的Job，监听任务为PollerHub中的Watch
+
+    @property
+    def properties(self):
+        return {
+            "id": self.id,
+            "key": self.key,
+            "kind": self.kind,
+            "court_id": self.court_id,
+            "date": self.date,
+            "field_id": self.field_id,
+            "stock_id": self.stock_id,
+            "num": self.num,
+            "status": self.status,
+        }
+
+
+class JobRegistry:
+    META = ("court_id", "date", "field_id", "stock_id", "num")
+
+    def __init__(self):
+        """
+        一个账号的任务登记表，任务id在任务的整个生命周期内不变（配置了JobStore时与数据库中的id一致）
+        按id或key查询、修改状态和删除都是O(1)的
+        """
+        self._lock = threading.Lock()
+        self._by_id = {}  # id -> TaskEntry，按创建顺序排列
+        self._by_key = {}  # key -> TaskEntry
+        self._next_id = 1
+
+    def upsert(self, key, kind, *, id=None, status=None, **meta):
+        """
+        登记任务，同一个key重复登记时更新原来的任务并保留其id
+        :param id: 指定任务id（例如JobStore中的id），为None时自动分配
+        :param meta: court_id、date、field_id、stock_id、num
+        :return: TaskEntry
+        """
+        with self._lock:
+            entry = self._by_key.get(key)
+            if entry is None:
+                if id is None:
+                    id = self._next_id
+                entry = self._by_id[id] = self._by_key[key] = TaskEntry(id, key, kind)
+                self._next_id = max(self._next_id, id + 1)
+            entry.kind = kind
+            entry.status = status
+            for name in self.META:
+                if name in meta:
+                    setattr(entry, name, meta[name])
+            return entry
+
+    def attach(self, key, handle):
+        """记录任务对应的Job或Watch"""
+        with self._lock:
+            if (entry := self._by_key.get(key)) is not None:
+                entry.handle = handle
+            return entry
+
+    def set_status(self, key, status):
+        with self._lock:
+            if (entry := self._by_key.get(key)) is not None:
+                entry.status = status
+            return entry
+
+    def get(self, task_id):
+        with self._lock:
+            return self._by_id.get(task_id)
+
+    def find(self, key):
+        with self._lock:
+            return self._by_key.get(key)
+
+    def pop(self, task_id):
+        with self._lock:
+            entry = self._by_id.pop(task_id, None)
+            if entry is not None:
+                del self._by_key[entry.key]
+            return entry
+
+    def page(self, *, offset=0, limit=50, kind=None, status=None, date=None, court_id=None):
+        """
+        按创建顺序分页列出任务
+        :param kind: 只返回该类型的任务
+        :param status: 只返回该状态的任务，可以是状态的列表
+        :return: (符合条件的任务总数, 当前页的TaskEntry列表)
+        """
+        statuses = None if status is None else {status} if isinstance(status, str) else set(status)
+        with self._lock:
+            entries = [e for e in self._by_id.values()
+                       if (kind is None or e.kind == kind)
+                       and (statuses is None or e.status in statuses)
+                       and (date is None or e.date == date)
+                       and (court_id is None or e.court_id == str(court_id))]
+        return len(entries), entries[offset:offset + limit]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._by_key
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._by_key))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_id)
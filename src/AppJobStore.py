@@ -0,0 +1,175 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class JobRecord:
+    __slots__ = ("id", "username", "key", "kind", "court_id", "date", "field_id", "stock_id", "num", "run_at",
+                 "status", "options", "created", "updated")
+
+    def __init__(self, row):
+        for name, value in zip(self.__slots__, row):
+            setattr(self, name, value)
+        self.options = json.loads(self.options) if self.options else {}
+
+    @property
+    def properties(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class JobStore:
+    # 任务状态
+    PENDING = "pending"  # 定时预订任务等待执行
+    LISTENING = "listening"  # 监听任务正在运行
+    SUCCESS = "success"
+    FAILED = "failed"
+    MISSED = "missed"  # 重启时已错过执行时间
+    ACTIVE = (PENDING, LISTENING)
+
+    JOB_COLS = "id, username, key, kind, court_id, date, field_id, stock_id, num, run_at, status, options, " \
+               "created, updated"
+
+    def __init__(self, db_path="data/jobs.db"):
+        """
+        任务和订单的本地SQLite存储，程序重启后据此恢复未完成的任务
+        所有线程共享同一个连接，写操作由锁串行化
+        :param db_path: 数据库文件路径
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.init_db()
+
+    def init_db(self):
+        sql = """
+        PRAGMA journal_mode=WAL;
+        CREATE TABLE IF NOT EXISTS jobs (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          username TEXT NOT NULL,
+          key TEXT NOT NULL,        -- 与AppScheduler.jobs的key一致
+          kind TEXT NOT NULL,       -- order或monitor
+          court_id TEXT,
+          date TEXT,
+          field_id TEXT,
+          stock_id TEXT,
+          num INTEGER,              -- 监听任务需要预订的场次总数
+          run_at TEXT,              -- 定时预订任务的执行时间，按调度器时区，格式为YYYY-MM-DD HH:MM:SS
+          status TEXT NOT NULL,
+          options TEXT,             -- 其余参数，JSON
+          created TEXT,
+          updated TEXT,
+          UNIQUE (username, key)
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs (username, status);
+        CREATE TABLE IF NOT EXISTS orders (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          job_id INTEGER NOT NULL,
+          orderid TEXT,
+          userid TEXT,
+          status INTEGER,
+          created TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_orders_job ON orders (job_id);
+        """
+        with self._lock:
+            self._conn.executescript(sql)
+
+    @staticmethod
+    def _now():
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def save_job(self, username, key, kind, *, court_id=None, date=None, field_id=None, stock_id=None, num=None,
+                 run_at=None, status=PENDING, options=None):
+        """
+        新建或覆盖(username, key)对应的任务，覆盖时保留原有的id和订单
+        :return: 任务id
+        """
+        if isinstance(run_at, datetime):
+            run_at = run_at.strftime("%Y-%m-%d %H:%M:%S")
+        now = self._now()
+        with self._lock, self._conn:
+            self._conn.execute("""
+            INSERT INTO jobs (username, key, kind, court_id, date, field_id, stock_id, num, run_at, status,
+                              options, created, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (username, key) DO UPDATE SET
+              kind=excluded.kind, court_id=excluded.court_id, date=excluded.date, field_id=excluded.field_id,
+              stock_id=excluded.stock_id, num=excluded.num, run_at=excluded.run_at, status=excluded.status,
+              options=excluded.options, updated=excluded.updated
+            """, (username, key, kind, court_id, date, field_id, stock_id, num, run_at, status,
+                  json.dumps(options or {}, ensure_ascii=False), now, now))
+            row = self._conn.execute("SELECT id FROM jobs WHERE username = ? AND key = ?", (username, key)).fetchone()
+        return row[0]
+
+    def set_status(self, username, key, status):
+        with self._lock, self._conn:
+            cur = self._conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE username = ? AND key = ?",
+                                     (status, self._now(), username, key))
+        return cur.rowcount > 0
+
+    def add_order(self, username, key, order):
+        """
+        记录任务预订成功的订单
+        :param order: OrderProperties，为None时（例如预订结果为"未支付"，没有返回订单）记录一个空订单
+        :return: 是否找到对应的任务
+        """
+        orderid, userid, status = (None, None, None) if order is None else (order.orderid, order.userid, order.status)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM jobs WHERE username = ? AND key = ?", (username, key)).fetchone()
+            if row is None:
+                return False
+            self._conn.execute("INSERT INTO orders (job_id, orderid, userid, status, created) VALUES (?, ?, ?, ?, ?)",
+                               (row[0], orderid, userid, status, self._now()))
+        return True
+
+    def get_job(self, username, key):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {self.JOB_COLS} FROM jobs WHERE username = ? AND key = ?",
+                                     (username, key)).fetchone()
+        return None if row is None else JobRecord(row)
+
+    def list_jobs(self, username, *, statuses=None):
+        """
+        按创建顺序列出用户的任务
+        :param statuses: 只返回这些状态的任务
+        :return: list[JobRecord]
+        """
+        sql = f"SELECT {self.JOB_COLS} FROM jobs WHERE username = ?"
+        params = [username]
+        if statuses:
+            sql += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params.extend(statuses)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY id", params).fetchall()
+        return [JobRecord(row) for row in rows]
+
+    def orders_by_job(self, job_ids):
+        """
+        一次查询多个任务的订单
+        :return: 任务id -> [{"orderid", "userid", "status"}]
+        """
+        job_ids = list(job_ids)
+        result = {i: [] for i in job_ids}
+        if not job_ids:
+            return result
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT job_id, orderid, userid, status FROM orders WHERE job_id IN ({', '.join('?' * len(job_ids))})"
+                " ORDER BY id", job_ids).fetchall()
+        for job_id, orderid, userid, status in rows:
+            result[job_id].append({"orderid": orderid, "userid": userid, "status": status})
+        return result
+
+    def delete_job(self, username, key):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM jobs WHERE username = ? AND key = ?", (username, key)).fetchone()
+            if row is None:
+                return False
+            self._conn.execute("DELETE FROM orders WHERE job_id = ?", (row[0],))
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (row[0],))
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,263 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.util import astimezone
+from apscheduler.jobstores.base import JobLookupError
+
+from .AppDataBase import FieldTable
+
+# 场次状态，与ScheduleGrid中格子的状态一致
+STATES = ("closed", "available", "occupied")
+CLOSED, AVAILABLE, OCCUPIED = STATES
+
+
+def field_states(status):
+    """把status数组转换为状态编号（STATES的下标）：<=0为关闭，2为已被预订，其余为可预约"""
+    states = np.ones(len(status), dtype=np.int8)
+    states[status <= 0] = 0
+    states[status == 2] = 2
+    return states
+
+
+class FieldEvent:
+    __slots__ = ("stockid", "before", "after", "field")
+
+    def __init__(self, stockid, before, after, field):
+        self.stockid = stockid
+        self.before = before  # 变化前的状态，见STATES
+        self.after = after  # 变化后的状态
+        self.field = field  # FieldRecord，场次消失时为旧快照中的记录
+
+    def __repr__(self):
+        return f"FieldEvent({self.stockid}: {self.before}->{self.after})"
+
+
+def diff_fields(old, new):
+    """
+    以stockid为key比较两次场次快照，返回状态发生变化的场次
+    快照中不存在的场次视为关闭，因此第一次快照（old为None）中的开放场次都是closed->available
+    :param old: 上一次的FieldTable，可以为None
+    :param new: 本次的FieldTable
+    :return: list[FieldEvent]
+    """
+    if old is None:
+        old = FieldTable.empty()
+    if old is new:
+        return []
+    old_states = field_states(old.status)
+    new_states = field_states(new.status)
+
+    if len(old) == len(new) and np.array_equal(old.stockids, new.stockids):
+        # 常见情况：场次列表和顺序都没有变化，直接逐个比较状态
+        before = old_states
+        removed = np.empty(0, dtype=np.intp)
+    else:
+        before = np.zeros(len(new), dtype=np.int8)
+        if len(old):
+            order = np.argsort(old.stockids, kind="stable")
+            sorted_ids = old.stockids[order]
+            pos = np.minimum(np.searchsorted(sorted_ids, new.stockids), len(sorted_ids) - 1)
+            found = sorted_ids[pos] == new.stockids
+            before[found] = old_states[order[pos[found]]]
+        removed = np.flatnonzero(~np.isin(old.stockids, new.stockids) & (old_states != 0))
+
+    events = [FieldEvent(int(new.stockids[i]), STATES[before[i]], STATES[new_states[i]], new.record(i))
+              for i in np.flatnonzero(before != new_states)]
+    events.extend(FieldEvent(int(old.stockids[i]), STATES[old_states[i]], CLOSED, old.record(i))
+                  for i in removed)
+    return events
+
+
+class Watch:
+    __slots__ = ("key", "court_id", "date", "callback")
+
+    def __init__(self, key, court_id, date, callback):
+        self.key = key
+        self.court_id = court_id
+        self.date = date
+        self.callback = callback  # callback(fields, events)，fields为FieldTable，events为list[FieldEvent]
+
+
+class FieldPoller:
+    def __init__(self, hub, court_id, date):
+        """
+        一个(court_id, date)的共享轮询器，每次查询场次后把结果分发给所有监听者
+        """
+        self.hub = hub
+        self.court_id = court_id
+        self.date = date
+        self.watches = {}  # watch key -> Watch
+        self.interval = hub.min_interval  # 新建的轮询器先以最短间隔运行
+        self.job = None
+        self.snapshot = None  # 上一次的场次数据，用于计算变化
+        self.last_change = None
+        self.polls = 0
+        self.changes = 0
+        self.failures = 0  # 连续查询失败的次数，不为0时退避
+
+    @property
+    def job_id(self):
+        return f"poller/{self.court_id}/{self.date}"
+
+    def poll(self):
+        try:
+            fields = self.hub.crawler.get_fields(self.date, self.court_id,
+                                                 max_age=self.hub.min_interval / 2, allow_stale=False)
+        except Exception as e:
+            print(f"轮询{self.court_id}场馆{self.date}的场次失败！{e}")
+            fields = None
+        self.polls += 1
+        self.failures = 0 if fields is not None else self.failures + 1
+        if fields is not None:
+            events = diff_fields(self.snapshot, fields)
+            if events and self.snapshot is not None:
+                self.changes += 1
+                self.last_change = datetime.now(self.hub.timezone)
+            self.snapshot = fields
+            with self.hub._lock:
+                watches = list(self.watches.values())
+            self.hub._dispatch(watches, fields, events)
+        self.hub._adapt(self)
+        return fields
+
+
+class PollerHub:
+    def __init__(self, scheduler, crawler, *, min_interval=10.0, max_interval=60.0, backoff=1.5, jitter=0.2,
+                 release_times=("08:40",), release_window=(60, 300), change_window=120, dispatch_workers=4,
+                 timezone=None):
+        """
+        管理所有(court_id, date)的共享轮询器，同一个场馆同一天只会有一个轮询任务
+        轮询间隔会自适应：临近放票时间或最近场次有变化时使用最短间隔，之后逐渐退避到最长间隔，
+        查询失败（上游出错或返回空数据）时无论是否临近放票都退避，避免在服务器繁忙时加重负载
+        :param scheduler: 运行轮询任务的APScheduler调度器
+        :param crawler: 用于查询场次的AppCrawler
+        :param min_interval: 最短轮询间隔（秒）
+        :param max_interval: 最长轮询间隔（秒）
+        :param backoff: 场次没有变化或查询失败时间隔的增长倍数
+        :param jitter: 每次轮询的随机延迟占间隔的比例，多个轮询任务不会在同一时刻请求上游
+        :param release_times: 每天放票的时间（HH:MM）
+        :param release_window: 放票前后使用最短间隔的时间范围（秒），(提前, 延后)
+        :param change_window: 场次变化后保持最短间隔的时长（秒）
+        :param dispatch_workers: 并发调用监听者回调的线程数，多个账号监听同一场馆时可以同时预订
+        :param timezone: 放票时间所在的时区，应与调度器的时区一致，为None时使用本机时区
+        """
+        self.scheduler = scheduler
+        self.crawler = crawler
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.release_times = [datetime.strptime(t, "%H:%M").time() for t in release_times]
+        self.release_window = release_window
+        self.change_window = change_window
+        self.timezone = astimezone(timezone)
+
+        self._lock = threading.RLock()
+        self.pollers = {}  # (court_id, date) -> FieldPoller
+        self._executor = ThreadPoolExecutor(max_workers=dispatch_workers, thread_name_prefix="poller") \
+            if dispatch_workers > 1 else None
+
+    def _dispatch(self, watches, fields, events):
+        """把一次轮询的结果分发给所有监听者，回调中的异常不影响其他监听者"""
+        def call(watch):
+            try:
+                watch.callback(fields, events)
+            except Exception as e:
+                print(f"监听任务{watch.key}处理场次数据失败！{e}")
+
+        if self._executor is None or len(watches) < 2:
+            for watch in watches:
+                call(watch)
+        else:
+            list(self._executor.map(call, watches))
+
+    def _near_release(self, now):
+        before, after = self.release_window
+        for t in self.release_times:
+            release = now.replace(hour=t.hour, minute=t.minute, second=0, microsecond=0)
+            if release - timedelta(seconds=before) <= now <= release + timedelta(seconds=after):
+                return True
+        return False
+
+    def next_interval(self, poller, now=None):
+        """根据放票时间和最近的变化计算下一次轮询的间隔，now为timezone时区的时间"""
+        now = now or datetime.now(self.timezone)
+        if poller.failures:
+            return min(max(poller.interval, self.min_interval) * self.backoff, self.max_interval)
+        if self._near_release(now):
+            return self.min_interval
+        if poller.last_change is not None and now - poller.last_change <= timedelta(seconds=self.change_window):
+            return self.min_interval
+        return min(poller.interval * self.backoff, self.max_interval)
+
+    def _adapt(self, poller):
+        interval = self.next_interval(poller)
+        if interval == poller.interval:
+            return
+        poller.interval = interval
+        with self._lock:
+            if poller.job is None:
+                return
+            try:
+                self.scheduler.reschedule_job(poller.job_id, trigger=self._trigger(interval))
+            except JobLookupError:
+                pass
+
+    def _trigger(self, interval):
+        return IntervalTrigger(seconds=interval, jitter=interval * self.jitter or None)
+
+    def subscribe(self, court_id, date, key, callback):
+        """
+        注册一个监听者，必要时创建(court_id, date)的轮询任务
+        :param key: 监听者的唯一标识，与AppScheduler.jobs的key一致
+        :param callback: 每次轮询后以(FieldTable, list[FieldEvent])为参数调用
+        :return: Watch
+        """
+        watch = Watch(key, court_id, date, callback)
+        with self._lock:
+            poller = self.pollers.get((court_id, date))
+            if poller is None:
+                poller = self.pollers[(court_id, date)] = FieldPoller(self, court_id, date)
+                poller.job = self.scheduler.add_job(
+                    poller.poll,
+                    self._trigger(poller.interval),
+                    id=poller.job_id,
+                    replace_existing=True,
+                    max_instances=1,
+                    coalesce=True,
+                    misfire_grace_time=60,
+                )
+            poller.watches[key] = watch
+        return watch
+
+    def unsubscribe(self, key):
+        """
+        注销监听者，(court_id, date)没有监听者时停止轮询
+        :return: 是否找到该监听者
+        """
+        with self._lock:
+            for pos, poller in list(self.pollers.items()):
+                if poller.watches.pop(key, None) is None:
+                    continue
+                if not poller.watches:
+                    del self.pollers[pos]
+                    try:
+                        self.scheduler.remove_job(poller.job_id)
+                    except JobLookupError:
+                        pass
+                return True
+        return False
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {f"{p.court_id}/{p.date}": {
+                "watches": len(p.watches),
+                "interval": p.interval,
+                "polls": p.polls,
+                "changes": p.changes,
+                "failures": p.failures,
+            } for p in self.pollers.values()}
@@ -0,0 +1,202 @@
+import re
+import json
+import uuid
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+from .AppDataBase import FieldTable
+
+
+@lru_cache(maxsize=1024)
+def _time_sort_key(time_no: str):
+    """
+    场次时间的排序键，例如'08:00-09:00' -> (8, 0, '08:00-09:00')
+    同一个时间字符串只解析一次
+    """
+    match = re.match(r"\s*(\d+)(?::(\d+))?", str(time_no))
+    if match is None:
+        return float("inf"), 0, str(time_no)
+    return int(match.group(1)), int(match.group(2) or 0), str(time_no)
+
+
+@lru_cache(maxsize=1024)
+def _court_sort_key(sname: str):
+    """
+    场地名称的排序键，例如'场地12' -> (12, '场地12')
+    """
+    match = re.search(r"(\d+)", str(sname))
+    if match is None:
+        return float("inf"), str(sname)
+    return int(match.group(1)), str(sname)
+
+
+def _cell_status(status):
+    if status is None or status <= 0:
+        return "closed"
+    elif status == 2:
+        return "occupied"
+    return "available"
+
+
+class ScheduleGrid:
+    EMPTY_CELL = {"price": -1, "status": "closed", "stock_id": -1, "court_id": -1}
+
+    @classmethod
+    def build(cls, fields):
+        """
+        一次遍历场次列表，按(sname, time_no)建立索引后生成场地×时间的表格
+        :param fields: FieldTable或FieldProperties列表
+        :return: courts, times, cells，与/api/venues/<id>/schedule的返回格式一致
+        """
+        if isinstance(fields, FieldTable):
+            return cls._build_from_table(fields)
+
+        index = {}
+        for f in fields or []:
+            # 同一场地同一时间存在多条记录时保留第一条，与原先的线性查找一致
+            index.setdefault((f.sname, f.time_no), f)
+
+        court_names = sorted({k[0] for k in index}, key=_court_sort_key)
+        time_labels = sorted({k[1] for k in index}, key=_time_sort_key)
+
+        courts = [{"id": c, "name": c} for c in court_names]
+        times = [{"id": t, "label": t} for t in time_labels]
+
+        cells = {}
+        for c in court_names:
+            for t in time_labels:
+                f = index.get((c, t))
+                if f is None:
+                    cells[f"{c}|{t}"] = dict(cls.EMPTY_CELL)
+                else:
+                    cells[f"{c}|{t}"] = {"price": f.price, "status": _cell_status(f.status),
+                                         "stock_id": f.stockid,
+                                         "court_id": f.id}
+        return courts, times, cells
+
+    @classmethod
+    def changed_cells(cls, events):
+        """
+        把场次快照的变化事件转换为需要更新的格子，格式与build返回的cells一致
+        :param events: list[FieldEvent]
+        :return: {"场地|时间": cell}
+        """
+        cells = {}
+        for e in events:
+            f = e.field
+            cells[f"{f.sname}|{f.time_no}"] = {"price": f.price, "status": e.after,
+                                               "stock_id": f.stockid,
+                                               "court_id": f.id}
+        return cells
+
+    @classmethod
+    def _build_from_table(cls, table):
+        """直接在FieldTable的编码上建立索引，不需要为每个场次创建对象"""
+        if len(table) == 0:
+            return [], [], {}
+        # 同一(sname, time_no)的多条记录保留第一条
+        num_times = len(table.times)
+        keys = table.sname_codes.astype(np.int64) * num_times + table.time_codes
+        _, first = np.unique(keys, return_index=True)
+        sname_codes = table.sname_codes[first].tolist()
+        time_codes = table.time_codes[first].tolist()
+        prices = table.price[first].tolist()
+        status = table.status[first].tolist()
+        stockids = table.stockids[first].tolist()
+        ids = table.ids[first].tolist()
+
+        index = {(sc, tc): pos for pos, (sc, tc) in enumerate(zip(sname_codes, time_codes))}
+        court_codes = sorted(set(sname_codes), key=lambda c: _court_sort_key(table.snames[c]))
+        time_order = sorted(set(time_codes), key=lambda t: _time_sort_key(table.times[t]))
+
+        courts = [{"id": table.snames[c], "name": table.snames[c]} for c in court_codes]
+        times = [{"id": table.times[t], "label": table.times[t]} for t in time_order]
+
+        cells = {}
+        for sc in court_codes:
+            c = table.snames[sc]
+            for tc in time_order:
+                t = table.times[tc]
+                pos = index.get((sc, tc))
+                if pos is None:
+                    cells[f"{c}|{t}"] = dict(cls.EMPTY_CELL)
+                else:
+                    cells[f"{c}|{t}"] = {"price": prices[pos], "status": _cell_status(status[pos]),
+                                         "stock_id": stockids[pos],
+                                         "court_id": ids[pos]}
+        return courts, times, cells
+
+
+class ScheduleStream:
+    def __init__(self, hub, court_id, date, initial, *, heartbeat=15.0):
+        """
+        场馆某一天的场次表格推送流，由PollerHub中该(court_id, date)共享的轮询器驱动
+        先推送完整表格，之后只推送状态发生变化的格子，因此打开多少个页面都不会增加上游请求
+        轮询线程只合并变化的格子并记录最新的场次数据，客户端读取较慢时多次变化合并为一条消息，不会积压旧的状态
+        :param hub: PollerHub
+        :param initial: 无参函数，返回用于生成第一份表格的FieldTable
+        :param heartbeat: 没有变化时发送心跳的间隔（秒），防止连接被代理断开
+        """
+        self.hub = hub
+        self.court_id = court_id
+        self.date = date
+        self.initial = initial
+        self.heartbeat = heartbeat
+        self.key = f"stream/{court_id}/{date}/{uuid.uuid4().hex}"
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._latest = None  # 最新的场次数据
+        self._changed = {}  # 尚未发送的变化格子，同一格子只保留最新的状态
+        self._cells = {}  # 客户端当前显示的格子
+
+    def _on_fields(self, fields, events):
+        if not events:
+            return
+        cells = ScheduleGrid.changed_cells(events)
+        with self._lock:
+            self._latest = fields
+            self._changed.update(cells)
+            self._wakeup.set()
+
+    def _take(self):
+        """取出最新的场次数据和合并后的变化格子"""
+        with self._lock:
+            self._wakeup.clear()
+            fields, cells = self._latest, self._changed
+            self._changed = {}
+        return fields, cells
+
+    @staticmethod
+    def _message(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def _grid_message(self, fields):
+        courts, times, cells = ScheduleGrid.build(fields)
+        self._cells = dict(cells)
+        return self._message("grid", {"venue_id": self.court_id, "date": self.date,
+                                      "courts": courts, "times": times, "cells": cells})
+
+    def __iter__(self):
+        """生成SSE消息，客户端断开连接时注销监听者"""
+        self.hub.subscribe(self.court_id, self.date, self.key, self._on_fields)
+        try:
+            yield self._grid_message(self.initial() or FieldTable.empty())
+            while True:
+                if not self._wakeup.wait(self.heartbeat):
+                    yield ": keepalive\n\n"
+                    continue
+                fields, cells = self._take()
+                if not cells:
+                    continue
+                if not cells.keys() <= self._cells.keys():
+                    yield self._grid_message(fields)  # 出现了新的场地或时间，用最新的数据重新发送完整表格
+                    continue
+                # 轮询器的第一次快照会把所有场次视为变化，只发送与客户端不同的格子
+                cells = {k: c for k, c in cells.items() if self._cells[k] != c}
+                if cells:
+                    self._cells.update(cells)
+                    yield self._message("cells", {"cells": cells})
+        finally:
+            self.hub.unsubscribe(self.key)
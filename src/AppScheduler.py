@@ -1,104 +1,415 @@
+import time
+import threading
 from functools import partial
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.date import DateTrigger
+from apscheduler.jobstores.base import JobLookupError
 from flask import flash
+from requests import RequestException
 
 from .AppCrawler import AppCrawler
+from .AppCaptchaSolver import CaptchaSolver
+from .AppDataBase import FieldTable, OrderProperties
+from .AppJobStore import JobStore
+from .AppJobRegistry import JobRegistry
+from .AppPoller import PollerHub, AVAILABLE
+from .AppSlotRanking import SlotPreferences, rank_fields
 
 
 class AppScheduler(BackgroundScheduler):
-    def __init__(self, username, password, *, timezone="Asia/Shanghai", encrypt_password=True):
+    def __init__(self, username, password, *, timezone="Asia/Shanghai", encrypt_password=True, field_cache=None,
+                 courts_refresh_minutes=30, prepare_seconds=30, booking_workers=3, base_url=None, poller_options=None,
+                 failed_cooldown=60, job_store=None, order_misfire_grace=600, credential_cache=None, courts=None,
+                 pollers=None, claims=None, captcha_solver=None, use_refresh_token=False):
         super(AppScheduler, self).__init__(timezone=timezone)
-        self.crawler = AppCrawler(username, password, encrypt_password=encrypt_password)
+        self.crawler = AppCrawler(username, password, encrypt_password=encrypt_password, field_cache=field_cache,
+                                  base_url=base_url, credential_cache=credential_cache,
+                                  captcha_solver=captcha_solver, use_refresh_token=use_refresh_token)
 
-        self.user_order = {}  # 用户的订单字典
-        self.jobs = {}  # 正在运行的任务字典
+        self.username = username
+        self.job_store = job_store  # JobStore，为None时任务只保存在内存中
+        self.order_misfire_grace = order_misfire_grace  # 定时预订任务错过执行时间后仍然执行的时长（秒）
+
+        self.user_order = {}  # 用户的订单字典，监听任务的值为预订成功的订单列表
+        self.jobs = JobRegistry()  # 任务登记表，按任务id或key查询
+        self.monitor_targets = {}  # 监听任务需要预订的场次总数
+        self.booking_workers = booking_workers  # 监听任务并发预订的线程数
+        self._order_lock = threading.RLock()  # 保护user_order、monitor_targets、jobs和_failed_stocks
+        self.failed_cooldown = failed_cooldown  # 预订失败的场次在多少秒内不再尝试
+        self._failed_stocks = {}  # stockid -> 最近一次预订失败的时间（time.monotonic）
+        self.prepare_seconds = prepare_seconds  # 预订任务开始前多少秒刷新SESSION并预取验证码
+        self._prepared_at = None  # 最近一次刷新SESSION的时间
+        # 同一场馆同一日期的所有监听任务共享一个自适应间隔的轮询任务，多账号时由SchedulerPool传入共享的PollerHub
+        self.pollers = pollers if pollers is not None else \
+            PollerHub(self, self.crawler, timezone=self.timezone, **(poller_options or {}))
+        self.claims = claims  # 多账号之间的场次认领表StockClaims，为None时不认领
 
         # 完成爬虫的初始配置
-        self.crawler.login()
-        self.crawler.jump_to_app()
-        self.courts = self.crawler.get_courts()
+        self.crawler.authenticate()  # 有缓存的登录凭证时只需要一次请求
+        self.courts = courts if courts is not None else self.crawler.get_courts()
 
         self.start()  # 启动任务
+        if courts_refresh_minutes:
+            # 定期在后台刷新场馆目录，只需要有效的SESSION，不需要重新登录
+            self.add_job(
+                self.refresh_courts,
+                IntervalTrigger(minutes=courts_refresh_minutes),
+                max_instances=1,
+                coalesce=True,
+            )
+        if self.job_store is not None:
+            self.resume_jobs()
+
+    def _store(self, method, *args, **kwargs):
+        """写入当前用户的任务存储，未配置存储时忽略"""
+        if self.job_store is not None:
+            return getattr(self.job_store, method)(self.username, *args, **kwargs)
+        return None
+
+    def _register(self, job_key, kind, status, *, options=None, **meta):
+        """在任务存储和任务登记表中新建或覆盖任务，两者使用同一个任务id"""
+        job_id = self._store("save_job", job_key, kind, status=status, options=options, **meta)
+        meta.pop("run_at", None)
+        return self.jobs.upsert(job_key, kind, id=job_id, status=status, **meta)
+
+    def _set_status(self, job_key, status):
+        self.jobs.set_status(job_key, status)
+        self._store("set_status", job_key, status)
+
+    def cancel(self, task_id):
+        """
+        取消任务：移除对应的APScheduler任务或监听者，并从任务登记表和任务存储中删除
+        :return: 是否找到该任务
+        """
+        entry = self.jobs.pop(task_id)
+        if entry is None:
+            return False
+        if entry.kind == "monitor":
+            self.pollers.unsubscribe(self.watch_key(entry.key))
+            job_ids = (entry.key + "/resume",)  # 尚未开始的恢复任务
+        else:
+            job_ids = (entry.key, entry.key + "/prepare")
+        for job_id in job_ids:
+            try:
+                self.remove_job(job_id)
+            except JobLookupError:
+                pass
+        with self._order_lock:
+            self.user_order.pop(entry.key, None)
+            self.monitor_targets.pop(entry.key, None)
+        if entry.kind == "monitor":
+            self._release_captcha_pool()
+        self._store("delete_job", entry.key)
+        return True
+
+    def resume_jobs(self):
+        """
+        从任务存储中恢复上次运行时未完成的任务
+        定时预订任务：执行时间未到的重新定时；错过不超过order_misfire_grace秒的立即执行；否则标记为missed
+        监听任务：日期已过的标记为failed，其余以已预订的订单继续监听
+        :return: 恢复的任务数量
+        """
+        records = self.job_store.list_jobs(self.username)
+        for record in records:  # 已结束的任务也登记，使任务列表包含历史任务
+            self.jobs.upsert(record.key, record.kind, id=record.id, status=record.status, court_id=record.court_id,
+                             date=record.date, field_id=record.field_id, stock_id=record.stock_id, num=record.num)
+        records = [r for r in records if r.status in JobStore.ACTIVE]
+        orders = self.job_store.orders_by_job(r.id for r in records)
+        now = datetime.now(self.timezone).replace(tzinfo=None)
+        today = now.strftime("%Y-%m-%d")
+        resumed = 0
+        for record in records:
+            try:
+                if record.kind == "order":
+                    run_at = datetime.strptime(record.run_at, "%Y-%m-%d %H:%M:%S")
+                    if (now - run_at).total_seconds() > self.order_misfire_grace:
+                        print(f"预订任务{record.key}已错过执行时间{record.run_at}")
+                        self._set_status(record.key, JobStore.MISSED)
+                        continue
+                    self._schedule_order(record.date, record.court_id, record.field_id, record.stock_id,
+                                         max(run_at, now))
+                else:
+                    if record.date < today:
+                        self._set_status(record.key, JobStore.FAILED)
+                        continue
+                    booked = [OrderProperties(o) for o in orders[record.id]]
+                    with self._order_lock:
+                        self.user_order[record.key] = booked
+                    num = record.num - len(booked)
+                    if num <= 0:
+                        self._set_status(record.key, JobStore.SUCCESS)
+                        continue
+                    # 在调度器的线程中立即继续监听，不阻塞登录，也不会在对象未构造完成时开始预订
+                    self.add_job(
+                        self._resume_monitor,
+                        DateTrigger(run_date=datetime.now(self.timezone), timezone=self.timezone),
+                        args=(record.key, record.court_id, record.date, num, record.options),
+                        id=record.key + "/resume",
+                        replace_existing=True,
+                        misfire_grace_time=None
+                    )
+                resumed += 1
+            except Exception as e:
+                print(f"恢复任务{record.key}失败！{e}")
+        print(f"已恢复{resumed}个任务")
+        return resumed
+
+    def _resume_monitor(self, job_key, court_id, date, num, options):
+        """继续监听恢复的监听任务，失败时只记录该任务，不影响其他任务"""
+        try:
+            self.monitor_court(court_id, date, num, **options)
+        except Exception as e:
+            print(f"恢复任务{job_key}失败！{e}")
+
+    def refresh_courts(self):
+        """
+        重新获取场馆目录并整体替换，获取失败时保留原目录
+        :return: 是否刷新成功
+        """
+        courts = self.crawler.get_courts()
+        if courts is None:
+            self._recover_session()  # SESSION可能过期，重新获取后再试一次
+            courts = self.crawler.get_courts()
+        if courts is None:
+            print("刷新场馆目录失败！")
+            return False
+        if self.courts is None:
+            self.courts = courts
+        else:
+            self.courts.replace(list(courts))
+        return True
+
+    def _book_field(self, court_id, field_id, stock_id, max_retry):
+        """
+        带重试地预订一个场次
+        :return: 最后一次预订的结果和状态码，状态码为'1'表示成功
+        """
+        result, code = None, None
+        max_retry_ = max_retry
+        while max_retry_:
+            result, code = self.crawler.pay_field(court_id, field_id, stock_id)
+            if code == '1':
+                break  # 退出retry循环
+            elif code == '100':
+                max_retry_ -= 1
+            elif code == '0':
+                max_retry_ -= 1
+                # TODO: 有时候系统不会显示预订成功，已经被预订也可能代表成功，需要加入检验订单列表的逻辑
+            elif code == '-1':
+                max_retry_ -= 1  # 如果SESSION过期也要减掉重试次数，防止无限循环
+                self._recover_session()  # 获取新的SESSION
+            else:
+                max_retry_ -= 1
+            print(f"重试[{max_retry - max_retry_}]")
+        return result, code
 
-    def monitor_court(self, court_id, date, num, *, max_retry=10, if_monitor=False):
-        for court in self.courts:
-            if court.id == court_id:
-                break
+    def _recover_session(self):
+        """
+        SESSION过期时重新跳转获取（id_token过期时会先用refresh_token刷新）
+        :return: 是否恢复成功，失败时不抛出异常，由调用者继续按重试次数处理
+        """
+        try:
+            self.crawler.jump_to_app()
+            return True
+        except (ValueError, RequestException) as e:
+            print(f"恢复会话失败！{e}")
+            return False
+
+    def watch_key(self, job_key):
+        """监听任务在PollerHub中的key，PollerHub可能由多个账号共享，因此加上用户名"""
+        return self.username + ":" + job_key
+
+    def _monitor_remaining(self, job_key):
+        """监听任务还需要预订的场次数量，需要持有_order_lock"""
+        return self.monitor_targets.get(job_key, 0) - len(self.user_order.get(job_key) or [])
+
+    def _record_monitor_order(self, job_key, result):
+        """
+        记录监听任务预订成功的订单，达到目标数量时在同一把锁内取消监听任务
+        :return: 还需要预订的场次数量
+        """
+        with self._order_lock:
+            self.user_order.setdefault(job_key, []).append(result)
+            self._store("add_order", job_key, result)
+            remaining = self._monitor_remaining(job_key)
+            if remaining <= 0:
+                self._set_status(job_key, JobStore.SUCCESS)
+                if self.pollers.unsubscribe(self.watch_key(job_key)):
+                    print("场次预订完毕！")
+                self._release_captcha_pool()
+            return remaining
+
+    def _release_captcha_pool(self):
+        """没有正在监听的任务时停止验证码池的后台预取，与monitor_court中的start在同一把锁内"""
+        with self._order_lock:
+            listening, _ = self.jobs.page(kind="monitor", status=JobStore.LISTENING, limit=0)
+            if not listening:
+                self.crawler.captcha_pool.stop()
+
+    def _book_fields(self, court_id, job_key, fields, remaining, max_retry, workers):
+        """
+        通过有界的线程池并发预订多个场次，按fields的顺序尝试（见rank_fields）
+        同时在途的预订数量与已成功的数量之和不超过remaining，因此不会多订
+        :return: 本次成功预订的数量
+        """
+        candidates = iter(fields)
+        state = {"booked": 0, "in_flight": 0}
+
+        def worker():
+            while True:
+                with self._order_lock:
+                    if state["booked"] + state["in_flight"] >= remaining:
+                        return
+                    field = next(candidates, None)
+                    if field is None:
+                        return
+                    if self.claims is not None and not self.claims.claim(field.stockid, self.username):
+                        continue  # 其他账号正在预订该场次
+                    state["in_flight"] += 1
+                result, code = None, None
+                try:
+                    result, code = self._book_field(court_id, field.id, field.stockid, max_retry)
+                except Exception as e:  # 一个场次出错时不影响其他线程继续预订
+                    print(f"预订场次{field.stockid}失败！{e}")
+                finally:
+                    with self._order_lock:
+                        state["in_flight"] -= 1
+                        if code == '1':
+                            state["booked"] += 1
+                            self._failed_stocks.pop(field.stockid, None)
+                            self._record_monitor_order(job_key, result)
+                        else:
+                            self._failed_stocks[field.stockid] = time.monotonic()
+                            if self.claims is not None:
+                                self.claims.release(field.stockid, self.username)
+
+        workers = max(min(workers, remaining, len(fields)), 1)
+        if workers == 1:
+            worker()
         else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="booking") as executor:
+                for future in [executor.submit(worker) for _ in range(workers)]:
+                    future.result()
+        return state["booked"]
+
+    def monitor_court(self, court_id, date, num, *, max_retry=10, if_monitor=False, workers=None, preferences=None):
+        """
+        预订场馆court_id在date的num个开放场次，不足时进入监听模式
+        :param workers: 并发预订的线程数，默认为booking_workers，为1时逐个预订
+        :param preferences: SlotPreferences或其字典形式，按偏好的分数从高到低尝试预订，为None时按上游的顺序
+        """
+        preferences = SlotPreferences.from_dict(preferences)
+        court = self.courts.get(court_id)
+        if court is None:
             raise ValueError(f"没有名为{court_id}的场馆")
         if court.advancenum < num:
             print("设置预订数量超过最大预订数量！")
             num = court.advancenum
 
+        job_key = court_id + "/" + date + "/" + "monitor"
+        with self._order_lock:
+            if not if_monitor:
+                booked = len(self.user_order.get(job_key) or [])
+                self.monitor_targets[job_key] = min(booked + num, court.advancenum)
+                self._register(job_key, "monitor", JobStore.LISTENING, court_id=court_id, date=date,
+                               num=self.monitor_targets[job_key],
+                               options={"max_retry": max_retry, "workers": workers,
+                                        "preferences": preferences and preferences.properties})
+
         fields = self.crawler.get_fields(date, court_id)
-        status = [i.status == 1 for i in fields]
-        if any(status):
-            print(f"场地{court_id}存在空闲场次，开始预订")
-            for pos, s in enumerate(status):
-                if s:  # 如果场次开放
-                    field = fields[pos]
-                    field_id = field.id
-                    stock_id = field.stockid
-
-                    max_retry_ = max_retry
-                    while max_retry_:
-                        # TODO: 可以加入智能计算优先抢哪些场次的算法
-                        result, code = self.crawler.pay_field(court_id, field_id, stock_id)
-                        if code == '1':
-                            job_key = court_id + "/" + date + "/" + "monitor"
-                            self.user_order[job_key] = result
-                            num -= 1
-                            break  # 退出retry循环
-                        elif code == '100':
-                            max_retry_ -= 1
-                        elif code == '0':
-                            max_retry_ -= 1
-                            # TODO: 有时候系统不会显示预订成功，已经被预订也可能代表成功，需要加入检验订单列表的逻辑
-                        elif code == '-1':
-                            max_retry_ -= 1  # 如果SESSION过期也要减掉重试次数，防止无限循环
-                            self.crawler.jump_to_app()  # 获取新的SESSION
-                        else:
-                            max_retry_ -= 1
-                        print(f"重试[{max_retry - max_retry_}]")
-                if num == 0:
-                    job_key = court_id + "/" + date + "/" + "monitor"
-                    if (job := self.jobs.get(job_key)) is not None:
-                        self.pause_job(job.id)
-                        self.remove_job(job.id)
-                    print("场次预订完毕！")
-                    break
+        remaining = self._monitor_fields(court_id, job_key, fields, max_retry, workers, preferences=preferences)
         if not if_monitor:
-            print(f"需要监听的场次数量：{num}")
-            if num > 0:  # 如果还剩余，则进入监听模式
+            print(f"需要监听的场次数量：{remaining}")
+            if remaining > 0:  # 如果还剩余，则进入监听模式
                 print("开始监听")
-                job = self.add_job(
-                    partial(self.monitor_court, court_id=court_id, date=date, num=num, if_monitor=True),
-                    IntervalTrigger(seconds=30),
-                    max_instances=1,
-                    coalesce=True,
-                    misfire_grace_time=60,
-                    jitter=2
-                )
-                job_key = court_id + "/" + date + "/" + "monitor"
-                self.jobs[job_key] = job
-                return job
+                with self._order_lock:
+                    self.crawler.captcha_pool.start()  # 监听期间保持验证码池可用，见_release_captcha_pool
+                    # 同一场馆同一日期只保留一个监听任务，重复订阅会替换原来的Watch
+                    watch = self.pollers.subscribe(
+                        court_id, date, self.watch_key(job_key),
+                        partial(self._on_fields, court_id=court_id, job_key=job_key, max_retry=max_retry,
+                                workers=workers, preferences=preferences)
+                    )
+                    self.jobs.attach(job_key, watch)
+                return watch
             else:
+                self._set_status(job_key, JobStore.SUCCESS)
                 print("场次预订完毕！")
         return None
 
+    def _candidate_fields(self, fields, events=None):
+        """
+        筛选需要尝试预订的场次：开放且不在失败冷却期内
+        :param events: 轮询得到的变化事件，不为None时只保留新开放的场次和冷却期已过、需要重试的场次
+        :return: FieldTable
+        """
+        open_fields = fields[fields.status == 1]  # 开放的场次
+        now = time.monotonic()
+        # 冷却期过后经过两个最长轮询间隔仍未被重试的场次已不再开放，重新开放时会有新的事件，不需要继续保留
+        expire = self.failed_cooldown + 2 * self.pollers.max_interval
+        with self._order_lock:
+            for stockid in [s for s, t in self._failed_stocks.items() if now - t >= expire]:
+                del self._failed_stocks[stockid]
+            failed = list(self._failed_stocks.items())
+        cooling = [s for s, t in failed if now - t < self.failed_cooldown]
+        mask = ~np.isin(open_fields.stockids, cooling)
+        if events is not None:
+            opened = [e.stockid for e in events if e.after == AVAILABLE]
+            retry = [s for s, t in failed if now - t >= self.failed_cooldown]
+            mask &= np.isin(open_fields.stockids, opened) | np.isin(open_fields.stockids, retry)
+        return open_fields[mask]
+
+    def _monitor_fields(self, court_id, job_key, fields, max_retry, workers, events=None, preferences=None):
+        """
+        预订fields中开放的场次，直到达到监听任务的目标数量
+        :param events: 见_candidate_fields
+        :param preferences: SlotPreferences，为None时按上游的顺序预订
+        :return: 还需要预订的场次数量
+        """
+        with self._order_lock:
+            remaining = self._monitor_remaining(job_key)
+        if fields is None:
+            fields = FieldTable.empty()
+        open_fields = rank_fields(self._candidate_fields(fields, events), preferences, remaining)
+        if remaining > 0 and len(open_fields):
+            print(f"场地{court_id}存在空闲场次，开始预订")
+            self._book_fields(court_id, job_key, open_fields, remaining, max_retry,
+                              workers or self.booking_workers)
+            with self._order_lock:
+                remaining = self._monitor_remaining(job_key)
+        return remaining
+
+    def _on_fields(self, fields, events, *, court_id, job_key, max_retry, workers, preferences=None):
+        """共享轮询器的回调，只对新开放的场次做出反应，任务已被删除时取消订阅"""
+        if job_key not in self.jobs:
+            self.pollers.unsubscribe(self.watch_key(job_key))
+            return
+        self._monitor_fields(court_id, job_key, fields, max_retry, workers, events, preferences)
+
+    def _prepare_order(self):
+        """预订任务开始前刷新SESSION并填满验证码池，使开抢时只需要发送预订请求"""
+        self._recover_session()
+        self._prepared_at = datetime.now()
+        added = self.crawler.captcha_pool.fill()
+        print(f"已预取{added}个验证码")
+
     def _order_stock(self, date, court_id, field_id, stock_id):
         max_retry = 10
         max_retry_ = max_retry
+        job_key = court_id + "/" + date + "/" + field_id + "/" + stock_id + "/" + "order"
+        if self._prepared_at is None or datetime.now() - self._prepared_at > timedelta(seconds=2 * self.prepare_seconds):
+            self._recover_session()  # 预订任务隔夜，SESSION必然过期，需要重新获取
         while max_retry_ > 0:
-            self.crawler.jump_to_app()  # 预订任务隔夜，SESSION必然过期，需要重新获取
-            result, code = self.crawler.pay_field(court_id, field_id, stock_id)
+            result, code = self.crawler.pay_field(court_id, field_id, stock_id, priority=CaptchaSolver.ORDER)
             if code == '1':
-                job_key = court_id + "/" + date + "/" + stock_id + "/" + "order"
                 self.user_order[job_key] = result
+                self._store("add_order", job_key, result)
+                self._set_status(job_key, JobStore.SUCCESS)
                 print("场次预订完毕！")
                 return  # 退出retry循环
             elif code == '100':
@@ -108,18 +419,16 @@ class AppScheduler(BackgroundScheduler):
                 # TODO: 有时候系统不会显示预订成功，已经被预订也可能代表成功，需要加入检验订单列表的逻辑
             elif code == '-1':
                 max_retry_ -= 1  # 如果SESSION过期也要减掉重试次数，防止无限循环
-                self.crawler.jump_to_app()  # 获取新的SESSION
+                self._recover_session()  # 获取新的SESSION
             else:
                 max_retry_ -= 1
             print(f"重试[{max_retry - max_retry_}]")
-        job_key = court_id + "/" + date + "/" + field_id + "/" + stock_id + "/" + "order"
         self.user_order[job_key] = False
+        self._set_status(job_key, JobStore.FAILED)
 
     def order_stock(self, date, court_id, field_id, stock_id, *, order_date=None):
-        for court in self.courts:
-            if court.id == court_id:
-                break
-        else:
+        court = self.courts.get(court_id)
+        if court is None:
             raise ValueError(f"没有名为{court_id}的场馆")
 
         if order_date is None:
@@ -129,15 +438,35 @@ class AppScheduler(BackgroundScheduler):
         else:
             order_date = datetime.strptime(order_date, '%Y-%m-%d %H:%M:%S')
         flash(f"订单将在{order_date}执行", "info")
+        return self._schedule_order(date, court_id, field_id, stock_id, order_date)
 
+    def _schedule_order(self, date, court_id, field_id, stock_id, order_date):
+        """添加定时预订任务（以及提前刷新SESSION的准备任务），并写入任务存储"""
         job_key = court_id + "/" + date + "/" + field_id + "/" + stock_id + "/" + "order"
+        self._register(job_key, "order", JobStore.PENDING, court_id=court_id, date=date, field_id=field_id,
+                       stock_id=stock_id, run_at=order_date)
+        now = datetime.now(self.timezone).replace(tzinfo=None)
+        if (now - order_date).total_seconds() > self.order_misfire_grace:
+            print(f"预订任务{job_key}的执行时间{order_date}已过！")
+            self._set_status(job_key, JobStore.MISSED)
+            return None
+        prepare_date = order_date - timedelta(seconds=self.prepare_seconds)
+        if self.prepare_seconds and prepare_date > now:
+            self.add_job(
+                self._prepare_order,
+                DateTrigger(run_date=prepare_date, timezone=self.timezone),
+                id=job_key + "/prepare",
+                replace_existing=True
+            )
         job = self.add_job(
             partial(self._order_stock, date=date, court_id=court_id, field_id=field_id, stock_id=stock_id),
-            DateTrigger(run_date=order_date),
+            DateTrigger(run_date=order_date, timezone=self.timezone),  # 按调度器的时区解释开抢时间
             id=job_key,
-            replace_existing=True
+            replace_existing=True,
+            misfire_grace_time=self.order_misfire_grace  # 调度器繁忙导致延迟时仍然执行
         )
-        self.jobs[job_key] = job
+        self.jobs.attach(job_key, job)
+        return job
 
 
 if __name__ == '__main__':
@@ -0,0 +1,207 @@
+import time
+import itertools
+import threading
+from concurrent.futures import Future
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from .AppScheduler import AppScheduler
+from .AppFieldCache import FieldCache
+from .AppPoller import PollerHub
+from .AppCaptchaSolver import CaptchaSolver
+
+
+class StockClaims:
+    def __init__(self, ttl=30.0, *, clock=time.monotonic):
+        """
+        多个账号之间的场次认领表，同一时间一个场次只由一个账号尝试预订，避免账号之间互相抢同一个场次
+        :param ttl: 认领的有效时长（秒），超过后其他账号可以重新认领
+        :param clock: 时钟函数，默认为time.monotonic
+        """
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._claims = {}  # stockid -> (账号, 认领时间)
+
+    def claim(self, stockid, owner):
+        """
+        :return: 是否认领成功，owner已经认领过时也返回True
+        """
+        now = self._clock()
+        with self._lock:
+            current = self._claims.get(stockid)
+            if current is not None and current[0] != owner and now - current[1] < self.ttl:
+                return False
+            self._claims[stockid] = (owner, now)
+            if len(self._claims) > 4096:
+                # 清理过期的认领，防止无限增长
+                self._claims = {s: c for s, c in self._claims.items() if now - c[1] < self.ttl}
+            return True
+
+    def release(self, stockid, owner):
+        with self._lock:
+            if (current := self._claims.get(stockid)) is not None and current[0] == owner:
+                del self._claims[stockid]
+
+
+class SchedulerPool:
+    def __init__(self, *, timezone="Asia/Shanghai", field_cache=None, courts_refresh_minutes=30, poller_options=None,
+                 claim_ttl=30.0, solver_options=None, cache_prune_minutes=60, **scheduler_options):
+        """
+        多账号的调度器池，每个账号一个AppScheduler（各自的登录会话、验证码池和任务）
+        场馆目录、场次缓存和场次轮询器由所有账号共享，N个账号监听同一场馆不会产生N倍的上游请求
+        :param field_cache: 所有账号共享的FieldCache
+        :param courts_refresh_minutes: 刷新共享场馆目录的间隔（分钟）
+        :param poller_options: 共享PollerHub的参数
+        :param claim_ttl: 场次认领的有效时长（秒），见StockClaims
+        :param solver_options: 所有账号共享的CaptchaSolver的参数，例如workers、kind、max_queue
+        :param cache_prune_minutes: 清理CaptchaSolver的SolveCache中过期结果的间隔（分钟）
+        :param scheduler_options: 创建每个AppScheduler时使用的其余参数，例如base_url、job_store、credential_cache
+        """
+        self.timezone = timezone
+        self.field_cache = field_cache if field_cache is not None else FieldCache()
+        self.claims = StockClaims(claim_ttl)
+        self.captcha_solver = CaptchaSolver(**(solver_options or {}))
+        self.scheduler_options = scheduler_options
+        self.courts = None
+
+        self._lock = threading.RLock()
+        self._accounts = {}  # 用户名 -> AppScheduler
+        self._pending = {}  # 用户名 -> 正在创建的调度器的Future
+        self._turn = itertools.count()
+
+        # 共享的轮询任务和场馆目录刷新任务运行在独立的调度器中，不随某个账号退出而停止
+        self.shared = BackgroundScheduler(timezone=timezone)
+        self.pollers = PollerHub(self.shared, self, timezone=self.shared.timezone, **(poller_options or {}))
+        self.shared.start()
+        if courts_refresh_minutes:
+            self.shared.add_job(
+                self.refresh_courts,
+                IntervalTrigger(minutes=courts_refresh_minutes),
+                max_instances=1,
+                coalesce=True,
+            )
+        if self.captcha_solver.cache is not None and cache_prune_minutes:
+            self.shared.add_job(
+                self.captcha_solver.cache.prune,
+                IntervalTrigger(minutes=cache_prune_minutes),
+                max_instances=1,
+                coalesce=True,
+            )
+
+    def add(self, username, password, **kwargs):
+        """
+        登录账号并加入池中，已经登录的账号校验密码后返回原来的调度器
+        同一个账号同时登录时只创建一个调度器，其余请求等待创建完成后校验密码
+        :param kwargs: 覆盖scheduler_options，例如encrypt_password
+        :return: AppScheduler
+        :raise ValueError: 密码与账号登录时通过认证的密码不一致
+        """
+        options = {**self.scheduler_options, **kwargs}
+        encrypt_password = options.get("encrypt_password", True)
+        while True:
+            with self._lock:
+                scheduler = self._accounts.get(username)
+                pending = self._pending.get(username) if scheduler is None else None
+                owner = scheduler is None and pending is None
+                if owner:
+                    pending = self._pending[username] = Future()
+            if scheduler is None and not owner:
+                try:
+                    scheduler = pending.result()
+                except Exception:
+                    continue  # 其他请求创建失败（例如密码错误），重新尝试
+            if scheduler is not None:
+                if not scheduler.crawler.check_password(password, encrypt_password):
+                    raise ValueError("用户名或密码错误！")
+                return scheduler
+            break
+
+        try:
+            scheduler = AppScheduler(username, password, timezone=self.timezone, field_cache=self.field_cache,
+                                     courts=self.courts, pollers=self.pollers, claims=self.claims,
+                                     captcha_solver=self.captcha_solver,
+                                     courts_refresh_minutes=None, **options)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[username]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            if self.courts is None:
+                self.courts = scheduler.courts  # 第一个账号获取的目录由所有账号共享
+            self._accounts[username] = scheduler
+            del self._pending[username]
+        pending.set_result(scheduler)
+        return scheduler
+
+    def get(self, username):
+        with self._lock:
+            return self._accounts.get(username)
+
+    def remove(self, username):
+        """
+        停止账号的所有任务并移出池，共享的轮询器在没有监听者时自动停止
+        :return: 是否找到该账号
+        """
+        with self._lock:
+            scheduler = self._accounts.pop(username, None)
+        if scheduler is None:
+            return False
+        for key in list(scheduler.jobs):
+            self.pollers.unsubscribe(scheduler.watch_key(key))
+        scheduler.crawler.captcha_pool.stop()
+        scheduler.shutdown(wait=False)
+        return True
+
+    def shutdown(self):
+        """移除所有账号并停止共享的调度器"""
+        for username in self.accounts:
+            self.remove(username)
+        self.shared.shutdown(wait=False)
+        self.captcha_solver.shutdown()
+
+    @property
+    def accounts(self):
+        with self._lock:
+            return list(self._accounts)
+
+    def _reader(self):
+        """轮流选择一个账号的爬虫执行共享的读请求"""
+        with self._lock:
+            schedulers = list(self._accounts.values())
+        if not schedulers:
+            return None
+        return schedulers[next(self._turn) % len(schedulers)].crawler
+
+    def get_fields(self, date, court_id, **kwargs):
+        """共享轮询器使用的查询接口，所有账号的爬虫共享同一个FieldCache"""
+        crawler = self._reader()
+        return None if crawler is None else crawler.get_fields(date, court_id, **kwargs)
+
+    def refresh_courts(self):
+        """
+        使用任意一个账号重新获取场馆目录并整体替换
+        :return: 是否刷新成功
+        """
+        crawler = self._reader()
+        courts = None if crawler is None else crawler.get_courts()
+        if courts is None:
+            print("刷新场馆目录失败！")
+            return False
+        with self._lock:
+            if self.courts is None:
+                self.courts = courts
+            else:
+                self.courts.replace(list(courts))
+        return True
+
+    @property
+    def stats(self):
+        return {
+            "accounts": self.accounts,
+            "field_cache": self.field_cache.stats,
+            "pollers": self.pollers.stats,
+            "captcha_solver": self.captcha_solver.stats,
+        }
@@ -0,0 +1,194 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=1024)
+def _parse_time_range(time_no):
+    """
+    场次时间的起止分钟数，例如'08:00-09:30' -> (480, 570)，无法解析的部分为nan
+    同一个时间字符串只解析一次
+    """
+    minutes = [int(h) * 60 + int(m or 0) for h, m in re.findall(r"(\d{1,2})(?::(\d{2}))?", str(time_no))[:2]]
+    if not minutes:
+        return np.nan, np.nan
+    return float(minutes[0]), float(minutes[1]) if len(minutes) > 1 else np.nan
+
+
+@lru_cache(maxsize=1024)
+def _parse_court_number(name):
+    """场地编号，例如'12'或'场地12' -> 12，没有数字时为nan"""
+    match = re.search(r"(\d+)", str(name))
+    return float(match.group(1)) if match else np.nan
+
+
+def _to_minutes(value):
+    """'18:30' -> 1110，None保持为None"""
+    if value is None:
+        return None
+    start, _ = _parse_time_range(value)
+    if np.isnan(start):
+        raise ValueError(f"无法解析时间{value}")
+    return start
+
+
+class SlotPreferences:
+    FIELDS = ("start", "end", "strict", "window", "consecutive", "price", "courts", "court", "low_court")
+
+    def __init__(self, *, start=None, end=None, strict=False, window=1.0, consecutive=0.0, price=0.0, courts=None,
+                 court=0.0, low_court=None):
+        """
+        场次的偏好评分，分数越高越先尝试预订，使有限的预订次数用在最有价值的场次上
+        :param start: 期望时间段的开始，例如'18:00'，为None时不限制
+        :param end: 期望时间段的结束，例如'21:00'，为None时不限制
+        :param strict: 是否直接排除不完全在期望时间段内的场次
+        :param window: 时间段的权重，场次在时间段内得分为window，在时间段外每差一小时扣window
+        :param consecutive: 连续场次的权重，同一场地上相邻的开放场次连成一段，每个场次得分为
+                            consecutive * (min(段长, 需要预订的数量) - 1)，同分时同一段的场次排在一起
+        :param price: 价格的权重，最便宜的场次得分为price，最贵的为0
+        :param courts: 偏好的场地编号列表，越靠前越优先
+        :param court: 场地的权重，courts中第一个场地得分为court，依次递减，不在courts中的为0；
+                      courts为空时按low_court对场地编号排序打分
+        :param low_court: True偏好编号小的场地，False偏好编号大的场地，None时不考虑场地编号
+        """
+        self.start = start
+        self.end = end
+        self._start = _to_minutes(start)
+        self._end = _to_minutes(end)
+        self.strict = bool(strict)
+        self.window = float(window)
+        self.consecutive = float(consecutive)
+        self.price = float(price)
+        self.courts = [str(c) for c in courts or []]
+        self.court = float(court)
+        self.low_court = low_court
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        从/listen接口的preferences或JobStore中保存的options构造
+        :raise ValueError: 包含未知的偏好或取值不合法
+        """
+        if data is None:
+            return None
+        if isinstance(data, cls):
+            return data
+        if not isinstance(data, dict):
+            raise ValueError("preferences must be an object")
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"unknown preferences: {sorted(unknown)}")
+        try:
+            return cls(**data)
+        except TypeError as e:
+            raise ValueError(str(e))
+
+    @property
+    def properties(self):
+        """可以写入JSON的字典，from_dict的逆操作"""
+        return {
+            "start": self.start,
+            "end": self.end,
+            "strict": self.strict,
+            "window": self.window,
+            "consecutive": self.consecutive,
+            "price": self.price,
+            "courts": self.courts,
+            "court": self.court,
+            "low_court": self.low_court,
+        }
+
+    def _window_score(self, begin, finish):
+        """在时间段内为window，在时间段外按相差的小时数扣分，时间无法解析的为0"""
+        if self._start is None and self._end is None:
+            return np.zeros(len(begin)), np.ones(len(begin), dtype=bool)
+        early = np.zeros(len(begin)) if self._start is None else np.maximum(self._start - begin, 0)
+        late = (np.zeros(len(begin)) if self._end is None
+                else np.maximum(np.where(np.isnan(finish), begin, finish) - self._end, 0))
+        outside = (early + late) / 60
+        known = ~np.isnan(begin)
+        inside = known & (outside == 0)
+        score = np.where(known, np.where(inside, self.window, -self.window * outside), 0.0)
+        return score, inside | ~known
+
+    @staticmethod
+    def _runs(court, begin, finish):
+        """
+        把同一场地上首尾相接的场次连成段
+        :return: 每个场次所在段的编号和段长
+        """
+        n = len(court)
+        order = np.lexsort((begin, court))
+        c, b, f = court[order], begin[order], finish[order]
+        # 与前一个场次在同一场地且前一个场次的结束时间等于本场次的开始时间时，属于同一段
+        joined = np.zeros(n, dtype=bool)
+        joined[1:] = (c[1:] == c[:-1]) & (f[:-1] == b[1:])
+        run_sorted = np.cumsum(~joined) - 1
+        lengths = np.bincount(run_sorted)
+        runs = np.empty(n, dtype=np.int64)
+        runs[order] = run_sorted
+        return runs, lengths[runs]
+
+    def score(self, fields, budget=1):
+        """
+        对场次表中的每个场次打分，全部为向量化计算
+        :param fields: FieldTable，通常是开放的场次
+        :param budget: 还需要预订的场次数量，连续场次的段长超过它时不再加分
+        :return: (分数, 段编号, 开始时间（分钟）, 是否满足strict)，均为与fields等长的数组
+        """
+        ranges = np.array([_parse_time_range(t) for t in fields.times], dtype=np.float64).reshape(-1, 2)
+        begin, finish = ranges[fields.time_codes, 0], ranges[fields.time_codes, 1]
+        numbers = np.array([_parse_court_number(n) for n in fields.names], dtype=np.float64)[fields.name_codes]
+
+        score, allowed = self._window_score(begin, finish)
+
+        runs, lengths = self._runs(fields.name_codes, np.nan_to_num(begin, nan=-1.0), np.nan_to_num(finish, nan=-2.0))
+        if self.consecutive:
+            score += self.consecutive * (np.minimum(lengths, max(budget, 1)) - 1)
+
+        if self.price and len(fields):
+            price = fields.price.astype(np.float64)
+            known = price >= 0  # 缺失的价格为-1
+            if known.any():
+                low, high = price[known].min(), price[known].max()
+                cheap = (high - price) / (high - low) if high > low else np.ones(len(price))
+                score += np.where(known, self.price * cheap, 0.0)
+
+        if self.court and len(fields):
+            if self.courts:
+                rank = {name: i for i, name in enumerate(self.courts)}
+                bonus = np.array([(len(rank) - rank[n]) / len(rank) if n in rank else 0.0 for n in fields.names])
+                score += self.court * bonus[fields.name_codes]
+            elif self.low_court is not None and not np.isnan(numbers).all():
+                low, high = np.nanmin(numbers), np.nanmax(numbers)
+                rel = (numbers - low) / (high - low) if high > low else np.zeros(len(numbers))
+                rel = 1 - rel if self.low_court else rel
+                score += self.court * np.nan_to_num(rel, nan=0.0)
+
+        return score, runs, begin, allowed
+
+    def rank(self, fields, budget=1):
+        """
+        按分数从高到低排列场次，同分时同一段的场次排在一起并按时间先后排列
+        :return: FieldTable，strict时不包含期望时间段外的场次
+        """
+        if not len(fields):
+            return fields
+        score, runs, begin, allowed = self.score(fields, budget)
+        order = np.lexsort((np.nan_to_num(begin, nan=np.inf), runs, -score))
+        if self.strict:
+            order = order[allowed[order]]
+        return fields[order]
+
+
+def rank_fields(fields, preferences=None, budget=1):
+    """
+    按偏好排列需要尝试预订的场次，preferences为None时保持上游的顺序
+    :param preferences: SlotPreferences或其字典形式
+    :return: FieldTable
+    """
+    preferences = SlotPreferences.from_dict(preferences)
+    if preferences is None:
+        return fields
+    return preferences.rank(fields, budget)
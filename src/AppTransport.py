@@ -0,0 +1,129 @@
+import time
+import bisect
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class LatencyHistogram:
+    # 延迟分桶的上界（毫秒），最后一个桶收纳所有更慢的请求
+    BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf")]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * len(self.BUCKETS_MS)
+        self.errors = {}  # 错误类型 -> 次数
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, cost_ms, error=None):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BUCKETS_MS, cost_ms)] += 1
+            self.count += 1
+            self.total_ms += cost_ms
+            self.max_ms = max(self.max_ms, cost_ms)
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def quantile(self, q):
+        """根据分桶估计分位数（返回所在桶的上界，毫秒）"""
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            target = q * self.count
+            seen = 0
+            for bound, c in zip(self.BUCKETS_MS, self.counts):
+                seen += c
+                if seen >= target:
+                    return min(bound, self.max_ms)
+            return self.max_ms
+
+    def snapshot(self):
+        p50, p95, p99 = self.quantile(0.5), self.quantile(0.95), self.quantile(0.99)
+        with self._lock:
+            return {
+                "count": self.count,
+                "mean_ms": self.total_ms / self.count if self.count else 0.0,
+                "max_ms": self.max_ms,
+                "p50_ms": p50,
+                "p95_ms": p95,
+                "p99_ms": p99,
+                "buckets": {("+inf" if b == float("inf") else str(b)): c
+                            for b, c in zip(self.BUCKETS_MS, self.counts)},
+                "errors": dict(self.errors),
+            }
+
+
+class HttpTransport:
+    def __init__(self, *, timeouts=None, default_timeout=(3.05, 10), pool_connections=4, pool_maxsize=16,
+                 max_retries=0, base_url=None):
+        """
+        带连接池、分接口超时和延迟统计的HTTP传输层，多个线程共享同一个Session及其keep-alive连接
+        :param timeouts: 接口名 -> (连接超时, 读取超时)，接口名为BaseUrl的成员名
+        :param default_timeout: 未单独配置的接口使用的超时
+        :param pool_connections: 缓存连接池的主机数量
+        :param pool_maxsize: 每个主机保持的最大连接数，应不小于并发请求的线程数
+        :param max_retries: 连接失败时的重试次数
+        :param base_url: 替换所有接口的协议和主机，例如"http://127.0.0.1:5001"，用于连接本地的模拟服务器
+        """
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def url(self, endpoint):
+        """接口对应的完整网址"""
+        if self.base_url is None:
+            return endpoint.value
+        return self.base_url + urlsplit(endpoint.value).path
+
+    def timeout(self, endpoint):
+        return self.timeouts.get(endpoint.name, self.default_timeout)
+
+    def histogram(self, endpoint):
+        with self._lock:
+            hist = self._histograms.get(endpoint.name)
+            if hist is None:
+                hist = self._histograms[endpoint.name] = LatencyHistogram()
+            return hist
+
+    def request(self, method, endpoint, **kwargs):
+        """
+        请求endpoint并记录耗时，未指定timeout时使用该接口配置的超时
+        :param method: HTTP方法
+        :param endpoint: BaseUrl的成员
+        :return: requests.Response
+        """
+        kwargs.setdefault("timeout", self.timeout(endpoint))
+        hist = self.histogram(endpoint)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.url(endpoint), **kwargs)
+        except requests.RequestException as e:
+            hist.record((time.perf_counter() - start) * 1000, type(e).__name__)
+            raise
+        error = f"HTTP{response.status_code}" if response.status_code >= 400 else None
+        hist.record((time.perf_counter() - start) * 1000, error)
+        return response
+
+    def get(self, endpoint, **kwargs):
+        return self.request("GET", endpoint, **kwargs)
+
+    def post(self, endpoint, **kwargs):
+        return self.request("POST", endpoint, **kwargs)
+
+    def stats(self):
+        """所有接口的延迟和错误统计"""
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {name: hist.snapshot() for name, hist in histograms.items()}
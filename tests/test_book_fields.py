@@ -0,0 +1,30 @@
+from datetime import date
+
+from src.AppFakeServer import FakeServer, FakeConfig
+from src.AppSchedulerPool import SchedulerPool
+
+
+def test_failing_booking_releases_claim():
+    """一个场次预订时抛出异常：计数和认领都要恢复，其他线程继续预订"""
+    with FakeServer(FakeConfig(advancenum=4)) as server:
+        pool = SchedulerPool(base_url=server.base_url, courts_refresh_minutes=0)
+        try:
+            scheduler = pool.add("user", "password")
+            court_id = next(iter(scheduler.courts)).id
+            date_str = date.today().isoformat()
+            server.open_fields(date_str, court_id, 4)
+            fields = scheduler._candidate_fields(scheduler.crawler.get_fields(date_str, court_id))
+            broken = int(fields.stockids[0])
+
+            def book_field(court_id, field_id, stock_id, max_retry):
+                if stock_id == broken:
+                    raise ConnectionError("连接被重置")
+                return None, '1'
+
+            scheduler._book_field = book_field
+            job_key = court_id + "/" + date_str + "/monitor"
+            assert scheduler._book_fields(court_id, job_key, fields, 3, 1, 2) == 3
+            assert broken in scheduler._failed_stocks
+            assert pool.claims.claim(broken, "other")  # 认领已释放
+        finally:
+            pool.shutdown()
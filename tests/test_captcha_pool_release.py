@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+
+from src.AppFakeServer import FakeServer, FakeConfig
+from src.AppSchedulerPool import SchedulerPool
+
+
+def test_captcha_pool_stops_without_listening_monitors():
+    with FakeServer(FakeConfig(available_ratio=0.0)) as server:
+        pool = SchedulerPool(base_url=server.base_url, courts_refresh_minutes=0)
+        try:
+            scheduler = pool.add("user", "password")
+            captcha_pool = scheduler.crawler.captcha_pool
+            court_id = next(iter(scheduler.courts)).id
+            first, second = date.today().isoformat(), (date.today() + timedelta(days=1)).isoformat()
+
+            # 没有开放的场次，两个任务都进入监听
+            assert scheduler.monitor_court(court_id, first, 1, workers=1) is not None
+            assert scheduler.monitor_court(court_id, second, 1, workers=1) is not None
+            assert captcha_pool._running
+
+            assert scheduler.cancel(scheduler.jobs.find(court_id + "/" + first + "/monitor").id)
+            assert captcha_pool._running  # 还有一个监听任务
+
+            assert scheduler._record_monitor_order(court_id + "/" + second + "/monitor", None) == 0
+            assert not captcha_pool._running
+        finally:
+            pool.shutdown()
@@ -0,0 +1,11 @@
+from src.AppCaptchaPool import CaptchaPool
+
+
+def test_put_keeps_pool_within_size():
+    ids = iter(range(10))
+    pool = CaptchaPool(lambda: (next(ids), []), size=2)
+    assert pool.fill(5) == 5
+    assert len(pool) == 2
+    assert pool.take().captcha_id == 3  # 丢弃最早的验证码
+    assert pool.take().captcha_id == 4
+    assert pool.stats["dropped"] == 3
@@ -0,0 +1,24 @@
+import time
+
+import pytest
+
+from src.AppCaptchaPool import CaptchaPool
+from src.AppCaptchaSolver import CaptchaSolver
+
+
+def test_full_queue_rejects_non_order_tasks():
+    solver = CaptchaSolver(0, max_queue=1, submit_timeout=0.05)  # 没有求解线程，队列不会变短
+    try:
+        solver.submit({}, priority=CaptchaSolver.PREFETCH)
+        start = time.monotonic()
+        with pytest.raises(RuntimeError):
+            solver.submit({}, priority=CaptchaSolver.MONITOR)
+        assert time.monotonic() - start < 1
+        solver.submit({}, priority=CaptchaSolver.ORDER)  # ORDER任务不受队列上限限制
+        assert solver.rejected == 1
+
+        pool = CaptchaPool(lambda: solver.submit({}, priority=CaptchaSolver.PREFETCH).result())
+        assert pool.fill() == 0
+        assert pool.stats["rejected"] == 1 and pool.stats["errors"] == 0
+    finally:
+        solver.shutdown()
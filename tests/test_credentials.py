@@ -0,0 +1,66 @@
+import pytest
+
+from src.AppFakeServer import FakeServer, FakeConfig
+from src.AppCrawler import AppCrawler
+from src.AppCredentialCache import CredentialCache
+
+
+@pytest.fixture
+def server():
+    with FakeServer(FakeConfig(accounts={"user": "password"})) as server:
+        yield server
+
+
+def test_cached_credentials_require_same_password(server, tmp_path):
+    cache = CredentialCache(str(tmp_path / "credentials.json"))
+
+    def crawler(password, encrypt_password=True):
+        return AppCrawler("user", password, encrypt_password, base_url=server.base_url, credential_cache=cache)
+
+    first = crawler("password")
+    assert first.authenticate() == "login"
+    encrypted = first.password
+
+    with pytest.raises(ValueError):
+        crawler("wrong").authenticate()  # 不使用缓存的凭证，完整登录失败
+    with pytest.raises(ValueError):
+        crawler(first.encrypt_with_rsa("wrong"), encrypt_password=False).authenticate()
+
+    again = crawler("password")
+    assert again.authenticate() == "cached"
+    assert again.password == encrypted  # 保存通过认证的加密密码，不需要重新获取公钥
+    assert crawler(encrypted, encrypt_password=False).authenticate() == "cached"
+
+
+def test_cached_credentials_require_working_session(server, tmp_path):
+    cache = CredentialCache(str(tmp_path / "credentials.json"))
+
+    def crawler(**kwargs):
+        return AppCrawler("user", "password", base_url=server.base_url, credential_cache=cache, **kwargs)
+
+    first = crawler()
+    assert first.authenticate() == "login"
+    assert first.check_session()
+    server.backend.sessions.clear()  # SESSION过期：场馆列表跳转到登录页
+    assert not first.check_session()
+
+    # 跳转返回5xx时不算恢复了会话，清除缓存后完整登录（这里登录后的跳转同样失败）
+    server.backend.config.failure_rates = {"JUMP_URL": 1.0}
+    logins = server.backend.counters["LOGIN_URL"]
+    with pytest.raises(ValueError):
+        crawler().authenticate()
+    assert server.backend.counters["LOGIN_URL"] == logins + 1
+    server.backend.config.failure_rates = {}
+    assert crawler().authenticate() == "cached"  # 上一次登录成功时已保存了新的凭证
+
+
+def test_refresh_token_is_opt_in(tmp_path):
+    with FakeServer(FakeConfig(accounts={"user": "password"}, token_ttl=0)) as server:
+        cache = CredentialCache(str(tmp_path / "credentials.json"))
+
+        def crawler(**kwargs):
+            return AppCrawler("user", "password", base_url=server.base_url, credential_cache=cache, **kwargs)
+
+        with pytest.raises(ValueError):
+            crawler().authenticate()  # id_token立即过期，登录后的跳转也会失败
+        assert server.backend.counters.get("REFRESH_URL") is None  # 默认不请求未确认的接口
@@ -0,0 +1,38 @@
+from src.AppDataBase import FieldTable
+from src.AppPoller import diff_fields
+
+
+def table(rows):
+    """rows为[(stockid, status)]"""
+    return FieldTable.from_objects([
+        {"id": stockid + 1000, "name": "1", "sname": "场地1", "status": status, "stockid": stockid,
+         "stock": {"s_date": "2026-01-01", "time_no": f"{8 + i:02d}:00-{9 + i:02d}:00", "price": 20}}
+        for i, (stockid, status) in enumerate(rows)
+    ])
+
+
+def changes(events):
+    return sorted((e.stockid, e.before, e.after) for e in events)
+
+
+def test_first_snapshot_opens_available_fields():
+    new = table([(1, 1), (2, 2), (3, 0)])
+    assert changes(diff_fields(None, new)) == [(1, "closed", "available"), (2, "closed", "occupied")]
+
+
+def test_same_layout():
+    old = table([(1, 1), (2, 1), (3, 0)])
+    new = table([(1, 2), (2, 1), (3, 1)])
+    assert changes(diff_fields(old, new)) == [(1, "available", "occupied"), (3, "closed", "available")]
+    assert diff_fields(new, new) == []
+    assert diff_fields(old, table([(1, 1), (2, 1), (3, -1)])) == []  # 0和-1都是关闭
+
+
+def test_reordered_added_and_removed_fields():
+    old = table([(1, 1), (2, 2), (3, 1), (4, 0)])
+    new = table([(5, 1), (3, 1), (1, 2), (4, 0)])
+    events = diff_fields(old, new)
+    assert changes(events) == [(1, "available", "occupied"), (2, "occupied", "closed"), (5, "closed", "available")]
+    fields = {e.stockid: e.field for e in events}
+    assert fields[2].time_no == "09:00-10:00"  # 消失的场次使用旧快照中的记录
+    assert fields[5].id == 1005
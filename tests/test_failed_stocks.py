@@ -0,0 +1,20 @@
+import time
+
+from src.AppDataBase import FieldTable
+from src.AppFakeServer import FakeServer, FakeConfig
+from src.AppSchedulerPool import SchedulerPool
+
+
+def test_expired_failed_stocks_are_pruned():
+    with FakeServer(FakeConfig()) as server:
+        pool = SchedulerPool(base_url=server.base_url, courts_refresh_minutes=0)
+        try:
+            scheduler = pool.add("user", "password")
+            expire = scheduler.failed_cooldown + 2 * scheduler.pollers.max_interval
+            now = time.monotonic()
+            scheduler._failed_stocks.update({1: now - expire - 1, 2: now - scheduler.failed_cooldown - 1, 3: now})
+
+            scheduler._candidate_fields(FieldTable.empty(), [])
+            assert set(scheduler._failed_stocks) == {2, 3}  # 冷却中和等待重试的场次保留
+        finally:
+            pool.shutdown()
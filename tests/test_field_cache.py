@@ -0,0 +1,47 @@
+import threading
+
+from src.AppFieldCache import FieldCache
+
+
+def test_invalidate_only_discards_matching_flights():
+    cache = FieldCache(ttl=60.0)
+    a, b = cache.make_key("2026-01-01", "100"), cache.make_key("2026-01-01", "200")
+    started = {key: threading.Event() for key in (a, b)}
+    release = threading.Event()
+
+    def loader(key):
+        def load():
+            started[key].set()
+            release.wait(5)
+            return key
+        return load
+
+    threads = [threading.Thread(target=cache.get, args=(key, loader(key))) for key in (a, b)]
+    for thread in threads:
+        thread.start()
+    for event in started.values():
+        assert event.wait(5)
+
+    cache.invalidate(court_id="100")  # 预订了场馆100的场次，请求期间的场次数据已过时
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert cache.peek(a) is None
+    assert cache.peek(b) == b  # 其他场馆的请求结果照常写入缓存
+    assert not cache._generations
+
+
+def test_expired_entries_are_evicted():
+    now = [0.0]
+    cache = FieldCache(ttl=5.0, stale_ttl=60.0, clock=lambda: now[0])
+    for i in range(100):
+        cache.get(cache.make_key("2026-01-01", str(i)), lambda: "fields")
+    now[0] = 30.0
+    assert cache.get(cache.make_key("2026-01-02", "100"), lambda: "new") == "new"
+    assert cache.stats["entries"] == 101  # 仍可作为旧数据返回
+
+    now[0] = 70.0
+    assert cache.get(cache.make_key("2026-01-02", "100"), lambda: "new") == "new"
+    assert cache.stats["entries"] == 1
+    assert cache.stats["evicted"] == 100
@@ -0,0 +1,34 @@
+import random
+
+from src.AppDataBase import FieldProperties, FieldTable
+from src.AppScheduleGrid import ScheduleGrid
+
+
+def random_objects(rng, n=200):
+    return [{
+        "id": rng.randrange(1, 10 ** 6), "name": str(i % 8 + 1), "sname": f"场地{i % 8 + 1}",
+        "status": rng.choice([-1, 0, 1, 2]), "stockid": rng.randrange(1, 10 ** 6),
+        "stock": {"s_date": "2026-01-01", "time_no": f"{8 + i % 14:02d}:00-{9 + i % 14:02d}:00",
+                  "price": rng.choice([10, 20, 30])},
+    } for i in range(n)]
+
+
+def test_table_matches_field_properties():
+    objects = random_objects(random.Random(0))
+    table = FieldTable.from_objects(objects)
+    fields = [FieldProperties(o) for o in objects]
+
+    assert [r.properties for r in table] == [f.properties for f in fields]
+    assert [table[i].properties for i in range(len(table))] == [f.properties for f in fields]
+    assert ScheduleGrid.build(table) == ScheduleGrid.build(fields)
+
+    open_fields = table[table.status == 1]
+    assert open_fields.stockids.tolist() == [f.stockid for f in fields if f.status == 1]
+    assert ScheduleGrid.build(open_fields) == ScheduleGrid.build([f for f in fields if f.status == 1])
+
+
+def test_missing_values():
+    table = FieldTable.from_objects([{"id": "7", "sname": "场地1", "status": None, "stockid": "12.0"}])
+    record = table[0]
+    assert (record.id, record.stockid, record.status, record.price, record.time_no) == (7, 12, -1, -1, None)
+    assert ScheduleGrid.build(FieldTable.empty()) == ([], [], {})
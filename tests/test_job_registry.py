@@ -0,0 +1,33 @@
+from src.AppJobRegistry import JobRegistry
+
+
+def test_page_filters_and_keeps_creation_order():
+    registry = JobRegistry()
+    for i in range(10):
+        kind = "monitor" if i % 2 else "order"
+        registry.upsert(f"job{i}", kind, status="pending", court_id=str(100 + i % 3), date="2026-01-01")
+    registry.set_status("job3", "success")
+
+    total, entries = registry.page(offset=2, limit=3)
+    assert total == 10
+    assert [e.key for e in entries] == ["job2", "job3", "job4"]
+    assert registry.page(offset=9, limit=3)[1][0].key == "job9"
+    assert registry.page(offset=10)[1] == []
+
+    total, entries = registry.page(kind="monitor", status=["pending"])
+    assert (total, [e.key for e in entries]) == (4, ["job1", "job5", "job7", "job9"])
+    assert registry.page(court_id=100)[0] == 4
+    assert registry.page(status="success")[1][0].key == "job3"
+
+
+def test_ids_are_stable():
+    registry = JobRegistry()
+    first = registry.upsert("a", "order").id
+    registry.upsert("b", "order", id=10)
+    assert registry.upsert("a", "order", status="success").id == first  # 重复登记保留原来的id
+    assert registry.upsert("c", "order").id == 11
+
+    assert registry.pop(first).key == "a"
+    assert "a" not in registry and registry.get(first) is None
+    assert [e.key for e in registry.page()[1]] == ["b", "c"]
+    assert registry.upsert("a", "order").id == 12  # 删除后重新登记不会复用旧的id
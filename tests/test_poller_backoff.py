@@ -0,0 +1,35 @@
+from src.AppDataBase import FieldTable
+from src.AppPoller import PollerHub, FieldPoller
+
+
+class Crawler:
+    def __init__(self, results):
+        self.results = iter(results)
+
+    def get_fields(self, date, court_id, **kwargs):
+        result = next(self.results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def test_failed_polls_back_off_even_near_release():
+    crawler = Crawler([ConnectionError("连接超时"), None, None, FieldTable.empty()])
+    hub = PollerHub(None, crawler, min_interval=10.0, max_interval=60.0, backoff=2.0,
+                    release_window=(86400, 86400), dispatch_workers=1)  # 始终临近放票
+    poller = FieldPoller(hub, "100", "2026-01-01")
+    assert poller.interval == 10.0
+
+    poller.poll()  # 异常不会中断轮询任务
+    assert (poller.failures, poller.interval) == (1, 20.0)
+    poller.poll()
+    poller.poll()
+    assert (poller.failures, poller.interval) == (3, 60.0)
+    poller.poll()  # 恢复后回到最短间隔
+    assert (poller.failures, poller.interval) == (0, 10.0)
+
+
+def test_trigger_adds_jitter():
+    hub = PollerHub(None, None, jitter=0.2, dispatch_workers=1)
+    assert hub._trigger(10.0).jitter == 2.0
+    assert PollerHub(None, None, jitter=0, dispatch_workers=1)._trigger(10.0).jitter is None
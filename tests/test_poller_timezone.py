@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta
+
+from src.AppPoller import PollerHub, FieldPoller
+
+
+def test_release_window_uses_scheduler_timezone():
+    hub = PollerHub(None, None, min_interval=3.0, max_interval=30.0, release_window=(300, 300),
+                    timezone="Asia/Shanghai", dispatch_workers=1)
+    poller = FieldPoller(hub, "100", "2026-01-01")
+    poller.interval = 30.0
+
+    # 无论本机时区如何，都按上海时间判断是否临近放票
+    hub.release_times = [datetime.now(hub.timezone).time()]
+    assert hub.next_interval(poller) == 3.0
+    hub.release_times = [(datetime.now(hub.timezone) + timedelta(hours=3)).time()]
+    assert hub.next_interval(poller) == 30.0
+
+    poller.last_change = datetime.now(hub.timezone)
+    assert hub.next_interval(poller) == 3.0
@@ -0,0 +1,99 @@
+import time
+import threading
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from src.AppFakeServer import FakeServer, FakeConfig
+from src.AppJobStore import JobStore
+from src.AppScheduler import AppScheduler
+from src.AppSchedulerPool import SchedulerPool
+
+
+def test_resumed_monitor_does_not_block_login(monkeypatch):
+    """恢复的监听任务在调度器的线程中执行，登录不等待监听任务"""
+    store = JobStore(":memory:")
+    date_str = date.today().isoformat()
+    with FakeServer(FakeConfig()) as server:
+        court_id = server.backend.courts[0]["id"]
+        store.save_job("user", court_id + "/" + date_str + "/monitor", "monitor", court_id=court_id, date=date_str,
+                       num=1, status=JobStore.LISTENING)
+        release, started = threading.Event(), threading.Event()
+        calls = []
+
+        def monitor_court(self, court_id, date, num, **kwargs):
+            calls.append((court_id, date, num))
+            started.set()
+            release.wait(5)
+            raise RuntimeError("监听失败")
+
+        monkeypatch.setattr(AppScheduler, "monitor_court", monitor_court)
+        pool = SchedulerPool(base_url=server.base_url, courts_refresh_minutes=0, job_store=store)
+        try:
+            scheduler = pool.add("user", "password")
+            assert started.wait(5)
+            # 等待调度器线程移除已经执行的一次性任务，否则关闭调度器时可能正好在移除任务
+            deadline = time.monotonic() + 5
+            while scheduler.get_job(court_id + "/" + date_str + "/monitor/resume") is not None:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            assert scheduler.jobs.find(court_id + "/" + date_str + "/monitor").status == JobStore.LISTENING
+            release.set()
+            assert calls == [(court_id, date_str, 1)]
+        finally:
+            release.set()
+            pool.shutdown()
+
+
+def test_resume_reschedules_and_marks_missed_jobs(monkeypatch):
+    store = JobStore(":memory:")
+    now = datetime.now(ZoneInfo("Asia/Shanghai")).replace(tzinfo=None, microsecond=0)
+    today, yesterday = now.date().isoformat(), (now.date() - timedelta(days=1)).isoformat()
+    jobs = {
+        "future": now + timedelta(hours=1),  # 重新定时
+        "late": now - timedelta(seconds=60),  # 在order_misfire_grace之内，立即执行
+        "missed": now - timedelta(seconds=3600),
+    }
+    for field_id, run_at in jobs.items():
+        store.save_job("user", f"100/{today}/{field_id}/1/order", "order", court_id="100", date=today,
+                       field_id=field_id, stock_id="1", run_at=run_at)
+    store.save_job("user", f"100/{yesterday}/monitor", "monitor", court_id="100", date=yesterday, num=1,
+                   status=JobStore.LISTENING)
+    done_id = store.save_job("user", f"100/{today}/monitor", "monitor", court_id="100", date=today, num=1,
+                             status=JobStore.LISTENING)
+    store.add_order("user", f"100/{today}/monitor", None)
+    store.save_job("user", f"100/{today}/old/1/order", "order", court_id="100", date=today, field_id="old",
+                   stock_id="1", run_at=now - timedelta(days=1), status=JobStore.SUCCESS)
+
+    fired = threading.Event()
+    ordered = []
+
+    def order_stock(self, date, court_id, field_id, stock_id):
+        ordered.append(field_id)
+        fired.set()
+
+    monkeypatch.setattr(AppScheduler, "_order_stock", order_stock)
+    monkeypatch.setattr(AppScheduler, "monitor_court", lambda self, *args, **kwargs: None)
+    with FakeServer(FakeConfig()) as server:
+        pool = SchedulerPool(base_url=server.base_url, courts_refresh_minutes=0, job_store=store,
+                             order_misfire_grace=600)
+        try:
+            scheduler = pool.add("user", "password")
+            assert fired.wait(5)
+            deadline = time.monotonic() + 5
+            while scheduler.get_job(f"100/{today}/late/1/order") is not None:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            assert ordered == ["late"]
+            assert scheduler.get_job(f"100/{today}/future/1/order") is not None
+            assert scheduler.get_job(f"100/{today}/missed/1/order") is None
+
+            status = {r.key: r.status for r in store.list_jobs("user")}
+            assert status[f"100/{today}/missed/1/order"] == JobStore.MISSED
+            assert status[f"100/{yesterday}/monitor"] == JobStore.FAILED
+            assert status[f"100/{today}/monitor"] == JobStore.SUCCESS  # 已预订的订单数量已达到目标
+            assert status[f"100/{today}/old/1/order"] == JobStore.SUCCESS
+            assert scheduler.user_order[f"100/{today}/monitor"][0].orderid is None
+            assert scheduler.jobs.find(f"100/{today}/old/1/order") is not None  # 历史任务也登记
+            assert scheduler.jobs.find(f"100/{today}/monitor").id == done_id
+        finally:
+            pool.shutdown()
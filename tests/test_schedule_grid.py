@@ -0,0 +1,63 @@
+import re
+import random
+
+import numpy as np
+
+from src.AppDataBase import FieldProperties
+from src.AppScheduleGrid import ScheduleGrid
+
+
+def build_by_loop(fields):
+    """原先api_venue_schedule中的场地×时间×场次三重循环"""
+    ts = np.unique([f.time_no for f in fields])
+    first_times = [int(t.split(":")[0]) for t in ts]
+    indexs = np.argsort(first_times)
+    times = [{"id": t, "label": t} for t in ts[indexs]]
+
+    cs = np.unique([f.sname for f in fields]).tolist()
+    cs_nums = [int(re.search(r"(\d+)", c).group(1)) for c in cs]
+    cs = sorted(cs, key=lambda c: cs_nums[cs.index(c)])
+    courts = [{"id": c, "name": c} for c in cs]
+
+    cells = {}
+    for c in courts:
+        for t in times:
+            key = f"{c['id']}|{t['id']}"
+            for f in fields:
+                if f.sname == c["name"] and f.time_no == t["label"]:
+                    status, price, stock_id, field_id = f.status, f.price, f.stockid, f.id
+                    break
+            else:
+                status = price = stock_id = field_id = -1
+            if status <= 0:
+                status = "closed"
+            elif status == 2:
+                status = "occupied"
+            else:
+                status = "available"
+            cells[key] = {"price": price, "status": status, "stock_id": stock_id, "court_id": field_id}
+    return courts, times, cells
+
+
+def random_objects(rng, num_courts=12, num_hours=14):
+    objects = []
+    for c in range(1, num_courts + 1):
+        for h in range(8, 8 + num_hours):
+            if rng.random() < 0.1:
+                continue  # 缺少的格子
+            for _ in range(2 if rng.random() < 0.05 else 1):  # 偶尔重复的记录
+                objects.append({
+                    "id": rng.randrange(1, 10 ** 6), "name": str(c), "sname": f"场地{c}",
+                    "status": rng.choice([-1, 0, 1, 2]), "stockid": rng.randrange(1, 10 ** 6),
+                    "stock": {"s_date": "2026-01-01", "time_no": f"{h:02d}:00-{h + 1:02d}:00",
+                              "price": rng.choice([10, 20, 30])},
+                })
+    rng.shuffle(objects)
+    return objects
+
+
+def test_build_matches_triple_loop():
+    rng = random.Random(0)
+    for _ in range(5):
+        fields = [FieldProperties(o) for o in random_objects(rng)]
+        assert ScheduleGrid.build(fields) == build_by_loop(fields)
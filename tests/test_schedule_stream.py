@@ -0,0 +1,62 @@
+import json
+
+from src.AppDataBase import FieldTable
+from src.AppPoller import diff_fields
+from src.AppScheduleGrid import ScheduleStream
+
+
+class Hub:
+    def __init__(self):
+        self.callbacks = {}
+
+    def subscribe(self, court_id, date, key, callback):
+        self.callbacks[key] = callback
+
+    def unsubscribe(self, key):
+        return self.callbacks.pop(key, None) is not None
+
+
+def table(statuses):
+    return FieldTable.from_objects([
+        {"id": 1000 + n, "name": str(n), "sname": f"场地{n}", "status": status, "stockid": 100 + n,
+         "stock": {"s_date": "2026-01-01", "time_no": "08:00-09:00", "price": 20}}
+        for n, status in enumerate(statuses, 1)
+    ])
+
+
+def parse(message):
+    event, data = message.strip().split("\n")
+    return event.split(": ", 1)[1], json.loads(data.split(": ", 1)[1])
+
+
+def test_stream_coalesces_updates_and_resends_grid():
+    hub = Hub()
+    first = table([1, 1])
+    stream = ScheduleStream(hub, "100", "2026-01-01", lambda: first, heartbeat=0.05)
+    messages = iter(stream)
+    event, data = parse(next(messages))
+    assert event == "grid" and set(data["cells"]) == {"场地1|08:00-09:00", "场地2|08:00-09:00"}
+    callback = next(iter(hub.callbacks.values()))
+
+    # 读取之前发生了很多次变化：只发送一次，并且是最新的状态
+    previous = first
+    for i in range(40):
+        current = table([2 if i % 2 == 0 else 1, 2])
+        callback(current, diff_fields(previous, current))
+        previous = current
+    event, data = parse(next(messages))
+    assert event == "cells"
+    assert data["cells"] == {"场地2|08:00-09:00": {"price": 20, "status": "occupied", "stock_id": 102,
+                                                  "court_id": 1002}}
+
+    assert next(messages) == ": keepalive\n\n"
+
+    # 出现新的场地时用最新的数据发送完整表格
+    current = table([1, 2, 1])
+    callback(current, diff_fields(previous, current))
+    event, data = parse(next(messages))
+    assert event == "grid" and len(data["cells"]) == 3
+    assert data["cells"]["场地1|08:00-09:00"]["status"] == "available"
+
+    messages.close()
+    assert not hub.callbacks
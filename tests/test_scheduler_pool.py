@@ -0,0 +1,41 @@
+import threading
+
+import pytest
+
+from src.AppFakeServer import FakeServer, FakeConfig
+from src.AppSchedulerPool import SchedulerPool
+
+
+@pytest.fixture
+def pool():
+    with FakeServer(FakeConfig(accounts={"user": "password"}, latency=0.05)) as server:
+        pool = SchedulerPool(base_url=server.base_url, courts_refresh_minutes=0)
+        yield pool
+        pool.shutdown()
+
+
+def test_existing_account_requires_password(pool):
+    scheduler = pool.add("user", "password")
+    with pytest.raises(ValueError):
+        pool.add("user", "wrong")
+    assert pool.add("user", "password") is scheduler
+    assert pool.add("user", scheduler.crawler.password, encrypt_password=False) is scheduler
+
+
+def test_concurrent_logins_create_one_scheduler(pool, monkeypatch):
+    created = []
+    original = SchedulerPool.add.__globals__["AppScheduler"]
+
+    def counting(*args, **kwargs):
+        created.append(args[0])
+        return original(*args, **kwargs)
+
+    monkeypatch.setitem(SchedulerPool.add.__globals__, "AppScheduler", counting)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.add("user", "password"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert created == ["user"]
+    assert len(results) == 4 and len({id(s) for s in results}) == 1
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from src.AppDataBase import FieldTable
+from src.AppSlotRanking import SlotPreferences, rank_fields
+
+
+def table(rows):
+    """rows为[(场地编号, 开始小时, 价格)]，每个场次一小时"""
+    return FieldTable.from_objects([
+        {"id": i, "name": str(court), "sname": f"场地{court}", "status": 1, "stockid": 100 + i,
+         "stock": {"s_date": "2026-01-01", "time_no": f"{hour:02d}:00-{hour + 1:02d}:00", "price": price}}
+        for i, (court, hour, price) in enumerate(rows)
+    ])
+
+
+def keys(fields):
+    return [(r.name, r.time_no[:5]) for r in fields]
+
+
+def test_window_scores_and_strict():
+    fields = table([(1, 16, 20), (1, 18, 20), (1, 20, 20), (1, 22, 20)])
+    prefs = SlotPreferences(start="18:00", end="21:00", window=2.0)
+    score, _, begin, allowed = prefs.score(fields)
+    assert score.tolist() == [-4.0, 2.0, 2.0, -4.0]  # 时间段外每差一小时扣window
+    assert begin.tolist() == [960.0, 1080.0, 1200.0, 1320.0]
+    assert allowed.tolist() == [False, True, True, False]
+    assert keys(prefs.rank(fields)) == [("1", "18:00"), ("1", "20:00"), ("1", "16:00"), ("1", "22:00")]
+    assert keys(SlotPreferences(start="18:00", end="21:00", strict=True).rank(fields)) == \
+        [("1", "18:00"), ("1", "20:00")]
+
+
+def test_consecutive_runs_are_kept_together():
+    fields = table([(2, 18, 20), (1, 19, 20), (1, 18, 20), (3, 20, 20), (1, 20, 20)])
+    prefs = SlotPreferences(consecutive=1.0)
+    score, runs, _, _ = prefs.score(fields, budget=2)
+    assert score.tolist() == [0.0, 1.0, 1.0, 0.0, 1.0]  # 段长超过budget时不再加分
+    assert len(set(runs[[1, 2, 4]].tolist())) == 1
+    assert keys(prefs.rank(fields, budget=2))[:3] == [("1", "18:00"), ("1", "19:00"), ("1", "20:00")]
+
+
+def test_price_and_court_scores():
+    fields = table([(1, 18, 30), (2, 18, 10), (3, 18, 20), (4, 18, -1)])
+    assert SlotPreferences(window=0, price=1.0).score(fields)[0].tolist() == [0.0, 1.0, 0.5, 0.0]
+
+    score = SlotPreferences(window=0, court=2.0, courts=[3, 1]).score(fields)[0]
+    assert score.tolist() == [1.0, 0.0, 2.0, 0.0]
+    score = SlotPreferences(window=0, court=1.0, low_court=True).score(fields)[0]
+    assert np.allclose(score, [1.0, 2 / 3, 1 / 3, 0.0])
+
+
+def test_from_dict_round_trip_and_default_order():
+    prefs = SlotPreferences(start="18:00", courts=[2], court=1.0, low_court=False)
+    assert SlotPreferences.from_dict(prefs.properties).properties == prefs.properties
+    with pytest.raises(ValueError):
+        SlotPreferences.from_dict({"colour": "red"})
+    with pytest.raises(ValueError):
+        SlotPreferences.from_dict({"start": "evening"})
+
+    fields = table([(2, 20, 20), (1, 18, 20)])
+    assert rank_fields(fields) is fields  # 没有偏好时保持上游的顺序
+    assert len(rank_fields(FieldTable.empty(), {"start": "18:00"})) == 0
@@ -0,0 +1,67 @@
+import sqlite3
+
+from src.AppCaptchaCache import SolveCache
+
+
+def test_verified_entries_are_evicted_after_rejections(tmp_path):
+    cache = SolveCache(str(tmp_path / "captchas.db"), max_rejections=2)
+    cache.put("a", 10.0, 60.0, 0.9, 0)
+    cache.flush()
+    assert cache.get("a") is None  # 未验证的结果不会命中
+
+    cache.verify("a", True)
+    cache.flush()
+    assert cache.get("a") == (10.0, 60.0, 0.9, 0.0)
+    cache.verify("a", False)
+    cache.flush()
+    assert cache.get("a") is not None  # 偶尔被拒绝时保留
+    cache.verify("a", True)  # 再次被接受，重新计数
+    cache.verify("a", False)
+    cache.flush()
+    assert cache.get("a") is not None
+    cache.verify("a", False)
+    cache.flush()
+    assert cache.get("a") is None
+    assert cache.stats["evicted"] == 1
+
+    cache.put("b", 10.0, 60.0, 0.9, 0)
+    cache.verify("b", False)  # 未验证的结果被拒绝一次就删除
+    cache.verify("b", True)
+    cache.flush()
+    assert cache.get("b") is None
+    cache.close()
+
+
+def test_stale_unverified_entries_are_pruned(tmp_path):
+    db_path = str(tmp_path / "captchas.db")
+    cache = SolveCache(db_path, unverified_ttl=3600)
+    cache.put("old", 10.0, 60.0, 0.9, 0)
+    cache.put("new", 10.0, 60.0, 0.9, 0)
+    cache.put("kept", 10.0, 60.0, 0.9, 0)
+    cache.verify("kept", True)
+    cache.flush()
+    with cache._conn:
+        cache._conn.execute("UPDATE solutions SET updated = '2000-01-01 00:00:00' WHERE hash IN ('old', 'kept')")
+
+    assert cache.prune() == 1
+    conn = sqlite3.connect(db_path)
+    assert {row[0] for row in conn.execute("SELECT hash FROM solutions")} == {"new", "kept"}
+    conn.close()
+    cache.close()
+
+
+def test_writes_are_batched_off_the_caller_thread(tmp_path):
+    db_path = str(tmp_path / "captchas.db")
+    cache = SolveCache(db_path)
+    with cache._db_lock:  # 写入线程被阻塞时put和verify仍然立即返回
+        for i in range(100):
+            cache.put(str(i), 10.0, 60.0, 0.9, 0)
+            cache.verify(str(i), True)
+        assert cache.stats["pending"] >= 199
+    cache.flush()
+    assert cache.get("99") == (10.0, 60.0, 0.9, 0.0)
+    assert cache.stats["commits"] <= 2
+    cache.close()
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM solutions WHERE verified = 1").fetchone()[0] == 100
+    conn.close()
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from src.AppFakeServer import synth_captcha
+from src.AppCaptchaHandler import CaptchaHandler, CaptchaLoader, TrackCalibration
+
+
+@pytest.mark.parametrize("margin", [(0, 0), (17, 37), (30, 0)])
+def test_distance_uses_piece_offset(margin):
+    rng = np.random.default_rng(1)
+    for _ in range(5):
+        captcha, offset = synth_captcha(rng, margin=margin)
+        expected = offset * TrackCalibration.TRACK_WIDTH / captcha["backgroundImageWidth"]
+
+        handler = CaptchaHandler(captcha)  # 不做校准
+        assert handler.piece_x == margin[0]
+        assert abs(handler.distance - expected) <= 1
+        assert abs(handler.get_track()[-1]["x"] - expected) <= 2
+
+        # 没有piece_x的求解结果（例如旧版本缓存的结果）从滑块图中计算
+        bx, hx, confidence, _ = CaptchaLoader.locate_slider(captcha["backgroundImage"], captcha["sliderImage"])
+        assert CaptchaHandler(captcha, position=(bx, hx, confidence)).distance == handler.distance
@@ -0,0 +1,34 @@
+from datetime import date
+
+from src.AppFakeServer import FakeServer, FakeConfig
+from src.AppJobStore import JobStore
+from src.AppSchedulerPool import SchedulerPool
+
+
+def test_add_order_without_order():
+    store = JobStore(":memory:")
+    job_id = store.save_job("user", "100/2025-01-01/monitor", "monitor", status=JobStore.LISTENING)
+    assert store.add_order("user", "100/2025-01-01/monitor", None)
+    assert store.orders_by_job([job_id]) == {job_id: [{"orderid": None, "userid": None, "status": None}]}
+
+
+def test_monitor_finishes_on_unpaid():
+    """预订结果为"未支付"时pay_field返回(None, '1')，监听任务仍然要记录订单、标记成功并停止监听"""
+    store = JobStore(":memory:")
+    with FakeServer(FakeConfig(unpaid_rate=1.0, advancenum=2)) as server:
+        pool = SchedulerPool(base_url=server.base_url, courts_refresh_minutes=0, job_store=store)
+        try:
+            scheduler = pool.add("user", "password")
+            court_id = next(iter(scheduler.courts)).id
+            date_str = date.today().isoformat()
+            server.open_fields(date_str, court_id, 6)
+            assert scheduler.monitor_court(court_id, date_str, 2, workers=1) is None
+
+            job_key = court_id + "/" + date_str + "/monitor"
+            record = store.get_job("user", job_key)
+            assert record.status == JobStore.SUCCESS
+            assert len(store.orders_by_job([record.id])[record.id]) == 2
+            assert scheduler.user_order[job_key] == [None, None]
+            assert not pool.pollers.pollers  # 没有进入监听
+        finally:
+            pool.shutdown()